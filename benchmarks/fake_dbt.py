@@ -0,0 +1,1063 @@
+"""
+Stand-in for the dbt CLI, for benchmarking the DBT extension offline.
+
+Parses a project much like dbt does (model, yml, seed and macro files) and writes the artifacts that
+dbt-core 1.7 would write (manifest.json, run_results.json, sources.json, catalog.json, the docs page and
+a partial parse file), without connecting to a warehouse. It supports the commands and options that the
+extension uses. Node selection supports names and the fqn, tag, path, file, package, resource_type,
+config, source, state, result and source_status methods, with graph operators.
+
+The benchmark puts it on the PATH as 'dbt', see step_phases.py. It is configured through environment variables:
+
+FAKE_DBT_NODE_SECONDS
+    Seconds every executed node takes, spread over the threads. Default 0
+FAKE_DBT_FAIL
+    Comma separated names of the nodes that fail.
+FAKE_DBT_INTERNAL_MACROS
+    Number of macros of dbt itself and the adapter in the manifest. Default 400, roughly as many as dbt-postgres has.
+"""
+import datetime
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from collections import deque
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+VERSION = "1.7.0"
+SCHEMAS = "https://schemas.getdbt.com/dbt"
+PARTIAL_PARSE_FILE = "partial_parse.msgpack"
+
+# Options that take a value, and options that take one or more selectors.
+VALUE_OPTIONS = [
+    "--project-dir",
+    "--profiles-dir",
+    "--target",
+    "-t",
+    "--target-path",
+    "--state",
+    "--defer-state",
+    "--threads",
+    "--log-format",
+    "--vars",
+    "--output",
+    "-o",
+]
+SELECT_OPTIONS = {"--models": "select", "-m": "select", "--select": "select"}
+SELECT_OPTIONS.update({"-s": "select", "--exclude": "exclude"})
+
+# Resource types that every command executes.
+COMMAND_RESOURCE_TYPES = {
+    "run": ["model"],
+    "seed": ["seed"],
+    "test": ["test"],
+    "build": ["model", "seed", "snapshot", "test"],
+    "clone": ["model", "seed", "snapshot"],
+}
+
+SELECTOR_PATTERN = re.compile(
+    r"^(?P<childrens_parents>@)?(?P<parents>(?P<parents_depth>\d*)\+)?"
+    r"(?:(?P<method>[\w.]+):)?(?P<value>.*?)(?P<children>\+(?P<children_depth>\d*))?$"
+)
+REF_PATTERN = re.compile(r"ref\(\s*['\"](\w+)['\"]\s*\)")
+SOURCE_PATTERN = re.compile(r"source\(\s*['\"](\w+)['\"]\s*,\s*['\"](\w+)['\"]\s*\)")
+CONFIG_PATTERN = re.compile(r"config\(\s*materialized\s*=\s*['\"](\w+)['\"]")
+MACRO_CALL_PATTERN = re.compile(r"\{\{-?\s*(\w+)\(")
+MACRO_DEFINITION_PATTERN = re.compile(r"\{%-?\s*macro\s+(\w+)\(")
+
+
+class DbtError(Exception):
+    pass
+
+
+def main(argv):
+    if "--version" in argv:
+        print(
+            f"Core:\n  - installed: {VERSION}\n  - latest:    {VERSION} - Up to date!"
+        )
+        print(f"\nPlugins:\n  - postgres: {VERSION} - Up to date!")
+        return 0
+    command, options, flags = parse_args(argv)
+    log = Log(options.get("--log-format") == "json")
+    try:
+        return Invocation(command, options, flags, log).execute()
+    except DbtError as ex:
+        log.line(f"Encountered an error:\n{ex}", level="error")
+        return 2
+
+
+def parse_args(argv):
+    command, options, flags = [], {}, set()
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in SELECT_OPTIONS:
+            values = []
+            while i + 1 < len(argv) and not argv[i + 1].startswith("-"):
+                values.append(argv[i + 1])
+                i += 1
+            options[SELECT_OPTIONS[arg]] = " ".join(values)
+        elif arg in VALUE_OPTIONS:
+            options[arg] = argv[i + 1]
+            i += 1
+        elif arg.startswith("-"):
+            flags.add(arg)
+        else:
+            command.append(arg)
+        i += 1
+    return " ".join(command), options, flags
+
+
+class Log:
+    def __init__(self, structured: bool):
+        self.structured = structured
+        self.invocation_id = str(uuid.uuid4())
+
+    def line(self, msg, level="info", node_info=None):
+        if not self.structured:
+            print(msg, flush=True)
+            return
+        event = {
+            "info": {
+                "name": "Note",
+                "level": level,
+                "msg": msg,
+                "ts": _now(),
+                "invocation_id": self.invocation_id,
+            },
+            "data": {"node_info": node_info} if node_info else {},
+        }
+        print(json.dumps(event), flush=True)
+
+
+class Invocation:
+    def __init__(self, command, options, flags, log):
+        self.command = command
+        self.options = options
+        self.flags = flags
+        self.log = log
+        self.project_dir = options.get("--project-dir", ".")
+        self.project = _load_yaml(os.path.join(self.project_dir, "dbt_project.yml"))
+        if self.project is None:
+            raise DbtError("Not a dbt project: no dbt_project.yml found.")
+        self.target_dir = options.get("--target-path") or os.path.join(
+            self.project_dir, self.project.get("target-path", "target")
+        )
+        state_dir = options.get("--state") or options.get("--defer-state")
+        self.state = {
+            name: _load_json(os.path.join(state_dir, f"{name}.json"))
+            if state_dir
+            else None
+            for name in ["manifest", "run_results", "sources"]
+        }
+        if state_dir and self.state["manifest"] is None:
+            raise DbtError(
+                f"Could not find a manifest in the --state path '{state_dir}'"
+            )
+
+    def execute(self) -> int:
+        self.log.line(f"Running with dbt={VERSION}")
+        if self.command == "deps":
+            self.log.line("No packages to install.")
+            return 0
+
+        credentials = self._credentials()
+        self.threads = int(
+            self.options.get("--threads") or credentials.get("threads", 1)
+        )
+        self.database = credentials.get("dbname") or credentials.get(
+            "database", "bench"
+        )
+        self.schema = credentials.get("schema", "public")
+        self.adapter = credentials.get("type", "postgres")
+
+        started = time.time()
+        self.manifest = Project(self).manifest()
+        self.log.line(_summary(self.manifest))
+        os.makedirs(self.target_dir, exist_ok=True)
+        self._write("manifest.json", self.manifest)
+        self._write(
+            "semantic_manifest.json",
+            {"semantic_models": [], "metrics": [], "project_configuration": {}},
+        )
+        with open(os.path.join(self.target_dir, PARTIAL_PARSE_FILE), "wb") as f:
+            # Partial parse files are about as large as the manifest.
+            f.write(json.dumps(self.manifest).encode())
+
+        if self.command == "parse":
+            return 0
+        if self.command == "source freshness":
+            return self._freshness(started)
+        if self.command == "docs generate":
+            return self._docs()
+        if self.command not in COMMAND_RESOURCE_TYPES:
+            raise DbtError(
+                f"Command '{self.command}' is not supported by the fake dbt."
+            )
+        if self.command == "clone" and self.state["manifest"] is None:
+            raise DbtError("--state is required for cloning")
+        return self._execute_nodes(started)
+
+    def _credentials(self):
+        profiles_dir = (
+            self.options.get("--profiles-dir")
+            or os.environ.get("DBT_PROFILES_DIR")
+            or os.path.expanduser("~/.dbt")
+        )
+        profiles = _load_yaml(os.path.join(profiles_dir, "profiles.yml"))
+        name = self.project.get("profile")
+        if not profiles or name not in profiles:
+            raise DbtError(f"Could not find profile named '{name}'")
+        profile = profiles[name]
+        target = self.options.get("--target") or self.options.get("-t")
+        target = target or profile.get("target", "default")
+        if target not in (profile.get("outputs") or {}):
+            raise DbtError(
+                f"The profile '{name}' does not have a target named '{target}'"
+            )
+        return profile["outputs"][target]
+
+    def _execute_nodes(self, started) -> int:
+        resource_types = COMMAND_RESOURCE_TYPES[self.command]
+        selected = Selector(self.manifest, self.state, self.target_dir).select(
+            self.options.get("select"), self.options.get("exclude")
+        )
+        nodes = self.manifest["nodes"]
+        order = [
+            unique_id
+            for unique_id in _topological(self.manifest)
+            if unique_id in selected
+            and unique_id in nodes
+            and nodes[unique_id]["resource_type"] in resource_types
+        ]
+        self.log.line(f"Concurrency: {self.threads} threads (target='dev')")
+
+        node_seconds = float(os.environ.get("FAKE_DBT_NODE_SECONDS") or 0)
+        failing = set(filter(None, os.environ.get("FAKE_DBT_FAIL", "").split(",")))
+        # Nodes downstream of failed nodes are skipped, like dbt does.
+        blocked = set()
+        results = []
+        for index, unique_id in enumerate(order):
+            node = nodes[unique_id]
+            node_started = _now()
+            time.sleep(node_seconds / self.threads)
+            if unique_id in blocked:
+                status, message = "skipped", "SKIP"
+            elif node["name"] in failing:
+                status = "fail" if node["resource_type"] == "test" else "error"
+                message = f"Database Error in {node['resource_type']} {node['name']}"
+            else:
+                status = "pass" if node["resource_type"] == "test" else "success"
+                message = "PASS" if status == "pass" else "SELECT 100"
+            if status in ["error", "fail"]:
+                blocked |= _walk(self.manifest["child_map"], [unique_id])
+            node_finished = _now()
+            self.log.line(
+                f"{index + 1} of {len(order)} {status.upper()} {node['resource_type']} "
+                f"{self.schema}.{node['name']} [{message} in {node_seconds:.2f}s]",
+                node_info={
+                    "unique_id": unique_id,
+                    "node_name": node["name"],
+                    "node_path": node["path"],
+                    "resource_type": node["resource_type"],
+                    "node_status": status,
+                    "node_started_at": node_started,
+                    "node_finished_at": node_finished,
+                },
+            )
+            results.append(
+                {
+                    "status": status,
+                    "timing": [
+                        {
+                            "name": "compile",
+                            "started_at": node_started,
+                            "completed_at": node_started,
+                        },
+                        {
+                            "name": "execute",
+                            "started_at": node_started,
+                            "completed_at": node_finished,
+                        },
+                    ],
+                    "thread_id": f"Thread-{index % self.threads + 1}",
+                    "execution_time": node_seconds,
+                    "adapter_response": (
+                        {}
+                        if status == "skipped"
+                        else {
+                            "_message": "SELECT 100",
+                            "code": "SELECT",
+                            "rows_affected": 100,
+                        }
+                    ),
+                    "message": message,
+                    "failures": (0 if status == "pass" else 1)
+                    if node["resource_type"] == "test"
+                    else None,
+                    "unique_id": unique_id,
+                    "compiled": True,
+                    "compiled_code": node.get("raw_code"),
+                    "relation_name": node.get("relation_name"),
+                }
+            )
+
+        self._write(
+            "run_results.json",
+            {
+                "metadata": self._metadata("run-results/v5"),
+                "results": results,
+                "elapsed_time": time.time() - started,
+                "args": {
+                    "which": self.command,
+                    "select": (self.options.get("select") or "").split(),
+                    "exclude": (self.options.get("exclude") or "").split(),
+                    "threads": self.threads,
+                    "project_dir": self.project_dir,
+                    "target_path": self.target_dir,
+                },
+            },
+        )
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        failed = counts.get("error", 0) + counts.get("fail", 0)
+        self.log.line("Completed with errors" if failed else "Completed successfully")
+        self.log.line(
+            "Done. "
+            + " ".join(
+                f"{status.upper()}={count}" for status, count in sorted(counts.items())
+            )
+        )
+        return 1 if failed else 0
+
+    def _freshness(self, started) -> int:
+        selected = Selector(self.manifest, self.state, self.target_dir).select(
+            self.options.get("select"), self.options.get("exclude")
+        )
+        now = _now()
+        results = []
+        for index, unique_id in enumerate(sorted(self.manifest["sources"])):
+            if unique_id not in selected:
+                continue
+            source = self.manifest["sources"][unique_id]
+            self.log.line(
+                f"{index + 1} of {len(selected)} PASS freshness of {source['name']}"
+            )
+            results.append(
+                {
+                    "unique_id": unique_id,
+                    "max_loaded_at": now,
+                    "snapshotted_at": now,
+                    "max_loaded_at_time_ago_in_s": 0.0,
+                    "status": "pass",
+                    "criteria": source["freshness"],
+                    "adapter_response": {},
+                    "timing": [],
+                    "thread_id": "Thread-1",
+                    "execution_time": 0.0,
+                }
+            )
+        self._write(
+            "sources.json",
+            {
+                "metadata": self._metadata("sources/v3"),
+                "results": results,
+                "elapsed_time": time.time() - started,
+            },
+        )
+        return 0
+
+    def _docs(self) -> int:
+        relations = {
+            unique_id: node
+            for unique_id, node in self.manifest["nodes"].items()
+            if node["resource_type"] in ["model", "seed", "snapshot"]
+            and node["config"].get("materialized") != "ephemeral"
+        }
+        sources = dict(self.manifest["sources"])
+        if "--empty-catalog" in self.flags:
+            relations, sources = {}, {}
+        elif self.options.get("select") and "--no-compile" not in self.flags:
+            # Only the selected relations are looked up when the selection is compiled.
+            selected = Selector(self.manifest, self.state, self.target_dir).select(
+                self.options.get("select"), self.options.get("exclude")
+            )
+            relations = {k: v for k, v in relations.items() if k in selected}
+            sources = {}
+        catalog = {
+            "metadata": self._metadata("catalog/v1"),
+            "nodes": {k: _catalog_entry(v) for k, v in relations.items()},
+            "sources": {k: _catalog_entry(v) for k, v in sources.items()},
+            "errors": None,
+        }
+        self._write("catalog.json", catalog)
+        index = _docs_page()
+        with open(os.path.join(self.target_dir, "index.html"), "w") as f:
+            f.write(index)
+        if "--static" in self.flags:
+            index = index.replace(
+                '"MANIFEST.JSON INLINE DATA"', json.dumps(self.manifest)
+            )
+            index = index.replace('"CATALOG.JSON INLINE DATA"', json.dumps(catalog))
+            with open(os.path.join(self.target_dir, "static_index.html"), "w") as f:
+                f.write(index)
+        self.log.line(
+            f"Catalog written to {os.path.join(self.target_dir, 'catalog.json')}"
+        )
+        return 0
+
+    def _metadata(self, schema):
+        return {
+            "dbt_schema_version": f"{SCHEMAS}/{schema}.json",
+            "dbt_version": VERSION,
+            "generated_at": _now(),
+            "invocation_id": self.log.invocation_id,
+            "env": {},
+        }
+
+    def _write(self, name, artifact):
+        with open(os.path.join(self.target_dir, name), "w") as f:
+            json.dump(artifact, f)
+
+
+class Project:
+    """
+    Builds the manifest of a project from its files.
+    """
+
+    def __init__(self, invocation):
+        self.invocation = invocation
+        self.root = invocation.project_dir
+        self.name = invocation.project["name"]
+        self.created_at = time.time()
+        self.nodes = {}
+        self.sources = {}
+        self.macros = {}
+
+    def manifest(self):
+        conf = self.invocation.project
+        for path in conf.get("macro-paths", ["macros"]):
+            for file in self._files(path, [".sql"]):
+                self._add_macros(file)
+        self._add_internal_macros()
+        patches = {}
+        for path in conf.get("model-paths", ["models"]):
+            for file in self._files(path, [".sql"]):
+                self._add_model(path, file)
+            for file in self._files(path, [".yml", ".yaml"]):
+                self._add_yml(path, file, patches)
+        for path in conf.get("seed-paths", ["seeds"]):
+            for file in self._files(path, [".csv"]):
+                self._add_seed(path, file)
+        self._apply_patches(patches)
+        self._resolve_dependencies()
+
+        parent_map = {
+            unique_id: node["depends_on"]["nodes"]
+            for unique_id, node in self.nodes.items()
+        }
+        parent_map.update({unique_id: [] for unique_id in self.sources})
+        child_map = {unique_id: [] for unique_id in parent_map}
+        for unique_id, parents in parent_map.items():
+            for parent in parents:
+                child_map.setdefault(parent, []).append(unique_id)
+        return {
+            "metadata": dict(
+                self.invocation._metadata("manifest/v11"),
+                project_name=self.name,
+                project_id=hashlib.md5(self.name.encode()).hexdigest(),
+                user_id=None,
+                send_anonymous_usage_stats=False,
+                adapter_type=self.invocation.adapter,
+            ),
+            "nodes": self.nodes,
+            "sources": self.sources,
+            "macros": self.macros,
+            "docs": {
+                "doc.dbt.__overview__": {
+                    "name": "__overview__",
+                    "resource_type": "doc",
+                    "package_name": "dbt",
+                    "path": "overview.md",
+                    "original_file_path": "docs/overview.md",
+                    "unique_id": "doc.dbt.__overview__",
+                    "block_contents": "### Welcome!\n\n" + "Documentation. " * 100,
+                }
+            },
+            "exposures": {},
+            "metrics": {},
+            "groups": {},
+            "selectors": {},
+            "disabled": {},
+            "parent_map": parent_map,
+            "child_map": child_map,
+            "group_map": {},
+            "saved_queries": {},
+            "semantic_models": {},
+        }
+
+    def _files(self, path, extensions):
+        base = os.path.join(self.root, path)
+        for root, _, files in sorted(os.walk(base)):
+            for file in sorted(files):
+                if file.endswith(tuple(extensions)):
+                    yield os.path.relpath(os.path.join(root, file), self.root)
+
+    def _read(self, file):
+        with open(os.path.join(self.root, file)) as f:
+            return f.read()
+
+    def _add_macros(self, file):
+        code = self._read(file)
+        for name in MACRO_DEFINITION_PATTERN.findall(code):
+            self._add_macro(self.name, name, file, code)
+
+    def _add_internal_macros(self):
+        count = int(os.environ.get("FAKE_DBT_INTERNAL_MACROS") or 400)
+        for i in range(count):
+            package = "dbt" if i % 4 else "dbt_postgres"
+            code = (
+                f"{{% macro default__internal_{i:04d}(relation) -%}}\n"
+                + "  {% call statement('main', fetch_result=True) -%}\n"
+                + "    select * from {{ relation }} where 1 = 0\n" * 20
+                + "  {%- endcall %}\n{%- endmacro %}\n"
+            )
+            self._add_macro(
+                package, f"default__internal_{i:04d}", "macros/internal.sql", code
+            )
+
+    def _add_macro(self, package, name, file, code):
+        unique_id = f"macro.{package}.{name}"
+        self.macros[unique_id] = {
+            "name": name,
+            "resource_type": "macro",
+            "package_name": package,
+            "path": file,
+            "original_file_path": file,
+            "unique_id": unique_id,
+            "macro_sql": code,
+            "depends_on": {"macros": []},
+            "description": "",
+            "meta": {},
+            "docs": {"show": True, "node_color": None},
+            "patch_path": None,
+            "arguments": [],
+            "created_at": self.created_at,
+            "supported_languages": None,
+        }
+
+    def _add_model(self, path, file):
+        code = self._read(file)
+        name = os.path.basename(file).rsplit(".", 1)[0]
+        materialized = CONFIG_PATTERN.search(code)
+        materialized = materialized.group(1) if materialized else "view"
+        node = self._node("model", name, path, file, code, materialized)
+        node["refs"] = [
+            {"name": ref, "package": None, "version": None}
+            for ref in REF_PATTERN.findall(code)
+        ]
+        node["sources"] = [list(source) for source in SOURCE_PATTERN.findall(code)]
+        node["depends_on"]["macros"] = sorted(
+            {
+                f"macro.{self.name}.{macro}"
+                for macro in MACRO_CALL_PATTERN.findall(code)
+                if f"macro.{self.name}.{macro}" in self.macros
+            }
+        )
+        self.nodes[node["unique_id"]] = node
+
+    def _add_seed(self, path, file):
+        name = os.path.basename(file).rsplit(".", 1)[0]
+        node = self._node("seed", name, path, file, "", "seed")
+        node["config"]["delimiter"] = ","
+        node["root_path"] = os.path.abspath(self.root)
+        node["checksum"]["checksum"] = _sha256(self._read(file))
+        self.nodes[node["unique_id"]] = node
+
+    def _add_yml(self, path, file, patches):
+        content = yaml.load(self._read(file), Loader=SafeLoader) or {}
+        for model in content.get("models") or []:
+            patches[model["name"]] = (file, model)
+        for source in content.get("sources") or []:
+            for table in source.get("tables") or []:
+                self._add_source(path, file, source, table)
+
+    def _add_source(self, path, file, source, table):
+        unique_id = f"source.{self.name}.{source['name']}.{table['name']}"
+        schema = source.get("schema", source["name"])
+        freshness = source.get("freshness") or {}
+        self.sources[unique_id] = {
+            "database": self.invocation.database,
+            "schema": schema,
+            "name": table["name"],
+            "resource_type": "source",
+            "package_name": self.name,
+            "path": file,
+            "original_file_path": file,
+            "unique_id": unique_id,
+            "fqn": [self.name] + _subdirs(path, file) + [source["name"], table["name"]],
+            "source_name": source["name"],
+            "source_description": source.get("description", ""),
+            "loader": "",
+            "identifier": table["name"],
+            "quoting": {
+                "database": None,
+                "schema": None,
+                "identifier": None,
+                "column": None,
+            },
+            "loaded_at_field": source.get("loaded_at_field"),
+            "freshness": {
+                "warn_after": freshness.get("warn_after")
+                or {"count": None, "period": None},
+                "error_after": freshness.get("error_after")
+                or {"count": None, "period": None},
+                "filter": None,
+            },
+            "external": None,
+            "description": table.get("description", ""),
+            "columns": {},
+            "meta": {},
+            "source_meta": {},
+            "tags": [],
+            "config": {"enabled": True},
+            "patch_path": None,
+            "unrendered_config": {},
+            "relation_name": f'"{self.invocation.database}"."{schema}"."{table["name"]}"',
+            "created_at": self.created_at,
+        }
+
+    def _apply_patches(self, patches):
+        for unique_id, node in list(self.nodes.items()):
+            if node["resource_type"] != "model" or node["name"] not in patches:
+                continue
+            file, patch = patches[node["name"]]
+            node["description"] = patch.get("description", "")
+            node["patch_path"] = f"{self.name}://{file}"
+            for column in patch.get("columns") or []:
+                node["columns"][column["name"]] = {
+                    "name": column["name"],
+                    "description": column.get("description", ""),
+                    "meta": {},
+                    "data_type": column.get("data_type"),
+                    "constraints": [],
+                    "quote": None,
+                    "tags": [],
+                }
+                for test in column.get("tests") or []:
+                    self._add_test(node, file, column["name"], test)
+
+    def _add_test(self, model, file, column, test):
+        name = f"{test}_{model['name']}_{column}"
+        unique_id = f"test.{self.name}.{name}.{_sha256(name)[:10]}"
+        node = self._node(
+            "test",
+            name,
+            "",
+            file,
+            f"{{{{ test_{test}(**_dbt_generic_test_kwargs) }}}}",
+            "test",
+        )
+        node["unique_id"] = unique_id
+        node["path"] = f"{name}.sql"
+        node["schema"] = f"{self.invocation.schema}_dbt_test__audit"
+        node["relation_name"] = None
+        node["config"].update(
+            {
+                "severity": "ERROR",
+                "store_failures": None,
+                "where": None,
+                "limit": None,
+                "fail_calc": "count(*)",
+                "warn_if": "!= 0",
+                "error_if": "!= 0",
+            }
+        )
+        node["test_metadata"] = {
+            "name": test,
+            "kwargs": {
+                "column_name": column,
+                "model": f"{{{{ get_where_subquery(ref('{model['name']}')) }}}}",
+            },
+            "namespace": None,
+        }
+        node["column_name"] = column
+        node["file_key_name"] = f"models.{model['name']}"
+        node["attached_node"] = model["unique_id"]
+        node["refs"] = [{"name": model["name"], "package": None, "version": None}]
+        node["depends_on"] = {
+            "macros": [f"macro.dbt.test_{test}", "macro.dbt.get_where_subquery"],
+            "nodes": [model["unique_id"]],
+        }
+        self.nodes[unique_id] = node
+
+    def _node(self, resource_type, name, path, file, code, materialized):
+        schema = self.invocation.schema
+        return {
+            "database": self.invocation.database,
+            "schema": schema,
+            "name": name,
+            "resource_type": resource_type,
+            "package_name": self.name,
+            "path": os.path.relpath(file, path) if path else file,
+            "original_file_path": file,
+            "unique_id": f"{resource_type}.{self.name}.{name}",
+            "fqn": [self.name] + _subdirs(path, file) + [name],
+            "alias": name,
+            "checksum": {"name": "sha256", "checksum": _sha256(code)},
+            "config": {
+                "enabled": True,
+                "alias": None,
+                "schema": None,
+                "database": None,
+                "tags": [],
+                "meta": {},
+                "group": None,
+                "materialized": materialized,
+                "incremental_strategy": None,
+                "persist_docs": {},
+                "post-hook": [],
+                "pre-hook": [],
+                "quoting": {},
+                "column_types": {},
+                "full_refresh": None,
+                "unique_key": None,
+                "on_schema_change": "ignore",
+                "on_configuration_change": "apply",
+                "grants": {},
+                "packages": [],
+                "docs": {"show": True, "node_color": None},
+                "contract": {"enforced": False, "alias_types": True},
+                "access": "protected",
+            },
+            "tags": [],
+            "description": "",
+            "columns": {},
+            "meta": {},
+            "group": None,
+            "docs": {"show": True, "node_color": None},
+            "patch_path": None,
+            "build_path": None,
+            "deferred": False,
+            "unrendered_config": {"materialized": materialized},
+            "created_at": self.created_at,
+            "relation_name": f'"{self.invocation.database}"."{schema}"."{name}"',
+            "raw_code": code,
+            "language": "sql",
+            "refs": [],
+            "sources": [],
+            "metrics": [],
+            "depends_on": {"macros": [], "nodes": []},
+            "compiled_path": None,
+            "contract": {"enforced": False, "alias_types": True, "checksum": None},
+            "access": "protected",
+            "constraints": [],
+            "version": None,
+            "latest_version": None,
+            "deprecation_date": None,
+        }
+
+    def _resolve_dependencies(self):
+        by_name = {
+            node["name"]: unique_id
+            for unique_id, node in self.nodes.items()
+            if node["resource_type"] in ["model", "seed", "snapshot"]
+        }
+        by_source = {
+            (source["source_name"], source["name"]): unique_id
+            for unique_id, source in self.sources.items()
+        }
+        for node in self.nodes.values():
+            if node["resource_type"] == "test":
+                continue
+            parents = []
+            for ref in node["refs"]:
+                if ref["name"] not in by_name:
+                    raise DbtError(
+                        f"Model '{node['unique_id']}' depends on a node named '{ref['name']}' which was not found"
+                    )
+                parents.append(by_name[ref["name"]])
+            for source in node["sources"]:
+                if tuple(source) not in by_source:
+                    raise DbtError(
+                        f"Model '{node['unique_id']}' depends on a source named '{'.'.join(source)}' which was not found"
+                    )
+                parents.append(by_source[tuple(source)])
+            node["depends_on"]["nodes"] = parents
+
+
+class Selector:
+    """
+    Resolves the node selection of an invocation against the manifest and the state.
+    """
+
+    def __init__(self, manifest, state, target_dir):
+        self.manifest = manifest
+        self.state = state
+        self.target_dir = target_dir
+        self.all = dict(manifest["nodes"], **manifest["sources"])
+
+    def select(self, select, exclude):
+        selected = self._union(select) if select else set(self.all)
+        if exclude:
+            selected -= self._union(exclude)
+        return selected
+
+    def _union(self, selector):
+        selected = set()
+        for union_part in selector.split():
+            intersection = None
+            for part in union_part.split(","):
+                matched = self._select_one(part)
+                intersection = (
+                    matched if intersection is None else intersection & matched
+                )
+            selected |= intersection or set()
+        return selected
+
+    def _select_one(self, part):
+        match = SELECTOR_PATTERN.match(part)
+        method, value = match.group("method"), match.group("value")
+        matched = {
+            unique_id
+            for unique_id, node in self.all.items()
+            if self._matches(unique_id, node, method, value)
+        }
+        selected = set(matched)
+        parents, children = self.manifest["parent_map"], self.manifest["child_map"]
+        if match.group("childrens_parents"):
+            descendants = _walk(children, matched)
+            selected |= descendants | _walk(parents, descendants | matched)
+        if match.group("parents"):
+            selected |= _walk(parents, matched, _depth(match.group("parents_depth")))
+        if match.group("children"):
+            selected |= _walk(children, matched, _depth(match.group("children_depth")))
+        return selected
+
+    def _matches(self, unique_id, node, method, value):
+        if method is None:
+            if "/" in value:
+                method = "path"
+            elif value.endswith((".sql", ".csv", ".py")):
+                method = "file"
+            else:
+                method = "fqn"
+        if method == "fqn":
+            parts = value.split(".")
+            fqn = node["fqn"]
+            return (
+                fnmatch.fnmatch(node["name"], value)
+                or _prefix_matches(fqn, parts)
+                or _prefix_matches(fqn[1:], parts)
+            )
+        if method == "tag":
+            return any(fnmatch.fnmatch(tag, value) for tag in node.get("tags") or [])
+        if method == "path":
+            path = node["original_file_path"]
+            return fnmatch.fnmatch(path, value) or path.startswith(
+                value.rstrip("/") + "/"
+            )
+        if method == "file":
+            return fnmatch.fnmatch(os.path.basename(node["original_file_path"]), value)
+        if method == "package":
+            return fnmatch.fnmatch(node["package_name"], value)
+        if method == "resource_type":
+            return node["resource_type"] == value
+        if method.startswith("config."):
+            return str(node["config"].get(method[len("config.") :])) == value
+        if method == "source":
+            if node["resource_type"] != "source":
+                return False
+            return _prefix_matches(
+                [node["source_name"], node["name"]], value.split(".")
+            )
+        if method == "state":
+            return self._state_matches(unique_id, node, value)
+        if method == "result":
+            results = (self.state["run_results"] or {}).get("results") or []
+            return any(
+                r["unique_id"] == unique_id and r["status"] == value for r in results
+            )
+        if method == "source_status":
+            return self._source_status_matches(unique_id, value)
+        raise DbtError(f"'{method}' is not a valid method name")
+
+    def _state_matches(self, unique_id, node, value):
+        previous = self.state["manifest"]
+        if previous is None:
+            raise DbtError("Got a state selector method, but no comparison manifest")
+        old = previous["nodes"].get(unique_id) or previous["sources"].get(unique_id)
+        if value == "new":
+            return old is None
+        if value in ["old", "unmodified"]:
+            return old is not None and old.get("checksum") == node.get("checksum")
+        if value.split(".")[0] == "modified":
+            return old is None or (
+                old.get("checksum") != node.get("checksum")
+                or old.get("config") != node.get("config")
+            )
+        raise DbtError(f"Got an invalid selector value '{value}' for method 'state'")
+
+    def _source_status_matches(self, unique_id, value):
+        def loaded(artifact):
+            return {
+                r["unique_id"]: r
+                for r in ((artifact or {}).get("results") or [])
+                if r.get("max_loaded_at")
+            }
+
+        previous = loaded(self.state["sources"])
+        current = loaded(_load_json(os.path.join(self.target_dir, "sources.json")))
+        if unique_id not in current:
+            return False
+        if value == "fresher":
+            return (
+                unique_id not in previous
+                or current[unique_id]["max_loaded_at"]
+                > previous[unique_id]["max_loaded_at"]
+            )
+        return current[unique_id]["status"] == value
+
+
+def _catalog_entry(node):
+    columns = dict.fromkeys(node.get("columns") or ["id"])
+    return {
+        "metadata": {
+            "type": "BASE TABLE" if node["resource_type"] != "model" else "VIEW",
+            "schema": node["schema"],
+            "name": node.get("alias") or node.get("identifier") or node["name"],
+            "database": node["database"],
+            "comment": None,
+            "owner": "bench",
+        },
+        "columns": {
+            column: {
+                "type": "integer" if column == "id" else "text",
+                "index": index + 1,
+                "name": column,
+                "comment": None,
+            }
+            for index, column in enumerate(columns)
+        },
+        "stats": {
+            "has_stats": {
+                "id": "has_stats",
+                "label": "Has Stats?",
+                "value": False,
+                "include": False,
+                "description": "Indicates whether there are statistics for this table",
+            }
+        },
+        "unique_id": node["unique_id"],
+    }
+
+
+def _docs_page():
+    # The docs page of dbt is a single file of about 1.5 MB, with placeholders for inlining the manifest and catalog.
+    bundle = "/* dbt docs application bundle */ function n(e){return e}\n" * 25000
+    return (
+        "<!doctype html><html><head><title>dbt Docs</title></head><body>"
+        f"<script>{bundle}</script>"
+        '<script>var manifest = "MANIFEST.JSON INLINE DATA";'
+        ' var catalog = "CATALOG.JSON INLINE DATA";</script>'
+        "</body></html>"
+    )
+
+
+def _summary(manifest):
+    counts = {}
+    for node in manifest["nodes"].values():
+        counts[node["resource_type"]] = counts.get(node["resource_type"], 0) + 1
+    return (
+        f"Found {counts.get('model', 0)} models, {counts.get('test', 0)} tests, "
+        f"{counts.get('seed', 0)} seeds, {len(manifest['sources'])} sources, "
+        f"{len(manifest['macros'])} macros"
+    )
+
+
+def _topological(manifest):
+    pending = {
+        unique_id: len(parents) for unique_id, parents in manifest["parent_map"].items()
+    }
+    queue = deque(
+        sorted(unique_id for unique_id, count in pending.items() if not count)
+    )
+    order = []
+    while queue:
+        unique_id = queue.popleft()
+        order.append(unique_id)
+        for child in manifest["child_map"].get(unique_id, []):
+            pending[child] -= 1
+            if not pending[child]:
+                queue.append(child)
+    return order
+
+
+def _walk(adjacency, start, depth=None):
+    seen = set()
+    queue = deque((unique_id, 0) for unique_id in start)
+    while queue:
+        unique_id, level = queue.popleft()
+        if depth is not None and level >= depth:
+            continue
+        for adjacent in adjacency.get(unique_id, []):
+            if adjacent not in seen:
+                seen.add(adjacent)
+                queue.append((adjacent, level + 1))
+    return seen
+
+
+def _depth(value):
+    return int(value) if value else None
+
+
+def _prefix_matches(fqn, parts):
+    return len(parts) <= len(fqn) and all(
+        fnmatch.fnmatch(name, part) for name, part in zip(fqn, parts)
+    )
+
+
+def _subdirs(path, file):
+    if not path:
+        return []
+    directory = os.path.dirname(os.path.relpath(file, path))
+    return directory.split(os.sep) if directory else []
+
+
+def _sha256(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).strftime(
+        "%Y-%m-%dT%H:%M:%S.%fZ"
+    )
+
+
+def _load_yaml(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def _load_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
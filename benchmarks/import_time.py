@@ -0,0 +1,145 @@
+"""
+Import time benchmark for the DBT extension.
+
+Measures the latency of `import metaflow`, `metaflow --help` and `python flow.py show` for a flow with
+a @dbt step, and checks that none of the heavy modules for executing DBT are loaded on these paths.
+Exits with a non-zero status if a check fails, so it can be used to guard against regressions:
+
+    python benchmarks/import_time.py --repeat 20 --max-ms 1500
+
+Requires metaflow and the extension to be installed, but no dbt project, warehouse or datastore.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Heavy modules that are only needed once a @dbt step executes.
+DEFERRED_MODULES = ["yaml", "pkg_resources", "dbt"]
+
+FLOW = """
+from metaflow import FlowSpec, step, dbt
+
+
+class ImportTimeFlow(FlowSpec):
+    @dbt(models=["orders"], profiles={"default": {"target": "dev", "outputs": {}}})
+    @step
+    def start(self):
+        self.next(self.end)
+
+    @step
+    def end(self):
+        pass
+
+
+if __name__ == "__main__":
+    ImportTimeFlow()
+"""
+
+
+def commands(flow_path):
+    metaflow_cli = shutil.which("metaflow")
+    return {
+        "import metaflow": [sys.executable, "-c", "import metaflow"],
+        "metaflow --help": (
+            [metaflow_cli, "--help"]
+            if metaflow_cli
+            else [sys.executable, "-m", "metaflow.cmd.main_cli", "--help"]
+        ),
+        "flow.py show": [sys.executable, flow_path, "show"],
+    }
+
+
+def environment():
+    env = dict(os.environ)
+    # Metaflow refuses to run flows without knowing the user.
+    env.setdefault("METAFLOW_USER", "benchmark")
+    return env
+
+
+def measure(command, repeat, cwd):
+    """
+    Wall times of running the command, in milliseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            command,
+            cwd=cwd,
+            env=environment(),
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def imported_modules(command, cwd):
+    """
+    Names of the modules that the command imports, from the output of -X importtime.
+    """
+    if command[0] != sys.executable:
+        # Console scripts can not be given interpreter options, so run the module instead.
+        command = [sys.executable, "-m", "metaflow.cmd.main_cli"] + command[1:]
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command[1:],
+        cwd=cwd,
+        env=environment(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    modules = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--repeat", type=int, default=10, help="runs per command. Default 10"
+    )
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        default=None,
+        help="fail if the median wall time of a command exceeds this many milliseconds",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        flow_path = os.path.join(workdir, "import_time_flow.py")
+        with open(flow_path, "w") as f:
+            f.write(FLOW)
+
+        print(f"{'command':<18} {'median ms':>10} {'min ms':>10} {'max ms':>10}")
+        for name, command in commands(flow_path).items():
+            timings = measure(command, args.repeat, workdir)
+            median = statistics.median(timings)
+            print(
+                f"{name:<18} {median:>10.1f} {min(timings):>10.1f} {max(timings):>10.1f}"
+            )
+            if args.max_ms is not None and median > args.max_ms:
+                print(f"  FAIL: median exceeds {args.max_ms:.0f} ms")
+                failed = True
+
+            loaded = imported_modules(command, workdir)
+            for module in DEFERRED_MODULES:
+                if module in loaded:
+                    print(f"  FAIL: imports {module}")
+                    failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
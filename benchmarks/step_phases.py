@@ -0,0 +1,352 @@
+"""
+End to end benchmark of a @dbt step, against the stand-in dbt of fake_dbt.py and a synthetic project.
+
+Runs a flow with a @dbt step a number of times on the local datastore and metadata, and reports the
+wall time, CPU time and memory of every phase of the step from its dbt_timings artifact: profile synthesis
+(write_profiles), state transfer (pull_state, push_state), artifact parsing (read_artifacts), save_artifacts
+and so on. Between runs a few models are changed, so that state selectors have something to select.
+Runs offline, without a warehouse or dbt; only metaflow, PyYAML and the extension need to be installed:
+
+    python benchmarks/step_phases.py --models 1000 --shape layered --runs 5
+
+The memory of every phase is measured by tracing Python allocations, which slows down the step.
+Pass --no-trace-memory for accurate timings. Exits with a non-zero status if the overhead of the decorator
+exceeds --max-overhead-s, so it can be used to guard against regressions.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from synthetic_project import PROFILE_NAME, SHAPES, generate_project, touch_models
+
+FLOW_NAME = "DBTBenchmarkFlow"
+# Commands that can run against a project without a production state to defer to.
+COMMANDS = ["run", "seed", "build", "test", "source freshness"]
+# Phases that wait for dbt itself, rather than being overhead of the decorator.
+DBT_PHASE_PREFIX = "dbt "
+DBT_PHASES = ["wait_docs"]
+
+FLOW = """
+from metaflow import FlowSpec, step, dbt
+
+
+class {flow_name}(FlowSpec):
+    @dbt(**{dbt_args!r})
+    @step
+    def start(self):
+        self.next(self.end)
+
+    @step
+    def end(self):
+        pass
+
+
+if __name__ == "__main__":
+    {flow_name}()
+"""
+
+# The stand-in does not trace its allocations, as it stands for a process of its own.
+FAKE_DBT = """#!/bin/sh
+unset PYTHONTRACEMALLOC
+exec "{python}" "{script}" "$@"
+"""
+
+
+def install_fake_dbt(bin_dir):
+    """
+    Put the stand-in dbt in bin_dir as an executable named 'dbt'.
+    """
+    os.makedirs(bin_dir)
+    path = os.path.join(bin_dir, "dbt")
+    with open(path, "w") as f:
+        f.write(
+            FAKE_DBT.format(
+                python=sys.executable,
+                script=os.path.join(
+                    os.path.dirname(os.path.abspath(__file__)), "fake_dbt.py"
+                ),
+            )
+        )
+    os.chmod(path, 0o755)
+
+
+def profiles(threads):
+    return {
+        PROFILE_NAME: {
+            "target": "dev",
+            "outputs": {
+                "dev": {
+                    "type": "postgres",
+                    "host": "localhost",
+                    "user": "benchmark",
+                    "password": "benchmark",
+                    "port": 5432,
+                    "dbname": "benchmark",
+                    "schema": "analytics",
+                    "threads": threads,
+                }
+            },
+        }
+    }
+
+
+def environment(args, workdir, bin_dir):
+    env = dict(os.environ)
+    python_dir = os.path.dirname(os.path.realpath(sys.executable))
+    # The decorator puts the directory of the interpreter first on the PATH unless it is on it already,
+    # which would let an installed dbt take precedence over the stand-in.
+    env["PATH"] = os.pathsep.join([bin_dir, python_dir, env.get("PATH", "")])
+    env.update(
+        {
+            "METAFLOW_USER": "benchmark",
+            "METAFLOW_DEFAULT_DATASTORE": "local",
+            "METAFLOW_DEFAULT_METADATA": "local",
+            "METAFLOW_DEFAULT_ENVIRONMENT": "local",
+            "METAFLOW_DATASTORE_SYSROOT_LOCAL": workdir,
+            "METAFLOW_DBT_STATE_CACHE_DIR": os.path.join(workdir, "state_cache"),
+            "FAKE_DBT_NODE_SECONDS": str(args.node_seconds),
+        }
+    )
+    if args.no_state_cache:
+        env["METAFLOW_DBT_STATE_CACHE_MAX_SIZE"] = "0"
+    if not args.no_trace_memory:
+        env["PYTHONTRACEMALLOC"] = "1"
+    else:
+        env.pop("PYTHONTRACEMALLOC", None)
+    return env
+
+
+def run_flow(flow_path, env, workdir):
+    """
+    Run the flow, and return its run id.
+    """
+    run_id_file = os.path.join(workdir, "run_id")
+    result = subprocess.run(
+        [sys.executable, flow_path, "run", "--run-id-file", run_id_file],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    if result.returncode != 0:
+        print(result.stdout)
+        raise RuntimeError("The benchmark flow failed.")
+    with open(run_id_file) as f:
+        return f.read().strip()
+
+
+def load_timings(run_id):
+    from metaflow import Run, namespace
+
+    namespace(None)
+    return Run(f"{FLOW_NAME}/{run_id}")["start"].task["dbt_timings"].data
+
+
+def overhead(timings):
+    """
+    Wall time of the step that is not spent waiting for dbt.
+    """
+    dbt_wall = 0.0
+    # Work of the decorator inside a phase that waits for dbt, f.ex. merging the catalog once the docs are generated.
+    nested = 0.0
+    for phase in timings["phases"]:
+        if phase["depth"] > 0:
+            if phase["depth"] == 1 and not _waits_for_dbt(phase):
+                nested += phase["wall_s"]
+            continue
+        if _waits_for_dbt(phase):
+            dbt_wall += phase["wall_s"] - nested
+        nested = 0.0
+    return timings["total_wall_s"] - dbt_wall
+
+
+def _waits_for_dbt(phase):
+    return phase["phase"].startswith(DBT_PHASE_PREFIX) or phase["phase"] in DBT_PHASES
+
+
+def summarize(runs):
+    """
+    Statistics of every phase over the runs, in the order the phases happen.
+    """
+    phases = {}
+    for timings in runs:
+        for phase in timings["phases"]:
+            phases.setdefault((phase["phase"], phase["depth"]), []).append(phase)
+    summary = []
+    for (name, depth), records in phases.items():
+        walls = [record["wall_s"] for record in records]
+        peaks = [record["py_peak_mb"] for record in records if "py_peak_mb" in record]
+        summary.append(
+            {
+                "phase": name,
+                "depth": depth,
+                "runs": len(records),
+                "median_wall_ms": statistics.median(walls) * 1000,
+                "max_wall_ms": max(walls) * 1000,
+                "median_cpu_ms": statistics.median(r["cpu_s"] for r in records) * 1000,
+                "py_peak_mb": max(peaks) if peaks else None,
+            }
+        )
+    return summary
+
+
+def report(summary, runs):
+    print(
+        f"{'phase':<28} {'runs':>5} {'median ms':>10} {'max ms':>10} {'cpu ms':>10} {'py peak MB':>11}"
+    )
+    for phase in summary:
+        name = "  " * phase["depth"] + phase["phase"]
+        peak = "-" if phase["py_peak_mb"] is None else f"{phase['py_peak_mb']:.1f}"
+        print(
+            f"{name:<28} {phase['runs']:>5} {phase['median_wall_ms']:>10.1f} "
+            f"{phase['max_wall_ms']:>10.1f} {phase['median_cpu_ms']:>10.1f} {peak:>11}"
+        )
+    totals = [timings["total_wall_s"] * 1000 for timings in runs]
+    overheads = [overhead(timings) * 1000 for timings in runs]
+    peak_rss = max(phase["peak_rss_mb"] for t in runs for phase in t["phases"])
+    print(f"\n{'step total':<28} {len(runs):>5} {statistics.median(totals):>10.1f}")
+    print(
+        f"{'decorator overhead':<28} {len(runs):>5} {statistics.median(overheads):>10.1f}"
+    )
+    print(f"peak RSS of the task: {peak_rss:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    project = parser.add_argument_group("synthetic project")
+    project.add_argument("--models", type=int, default=200)
+    project.add_argument("--shape", choices=SHAPES, default="layered")
+    project.add_argument("--sources", type=int, default=10)
+    project.add_argument("--seeds", type=int, default=5)
+    project.add_argument("--macros", type=int, default=20)
+    project.add_argument("--columns", type=int, default=10)
+    project.add_argument("--layers", type=int, default=8)
+    project.add_argument("--seed", type=int, default=0, help="random seed")
+
+    step = parser.add_argument_group("@dbt step")
+    step.add_argument("--command", choices=COMMANDS, default="run")
+    step.add_argument(
+        "--select",
+        nargs="*",
+        default=["state:modified+"],
+        help="models to select. Default: state:modified+",
+    )
+    step.add_argument("--threads", type=int, default=4)
+    step.add_argument("--generate-docs", action="store_true")
+    step.add_argument("--background-docs", action="store_true")
+    step.add_argument("--catalog-cache", action="store_true")
+    step.add_argument("--partial-parse-cache", action="store_true")
+    step.add_argument("--stream-logs", action="store_true")
+
+    bench = parser.add_argument_group("benchmark")
+    bench.add_argument("--runs", type=int, default=5, help="measured runs. Default 5")
+    bench.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="runs before the measured ones, f.ex. to publish the first state. Default 1",
+    )
+    bench.add_argument(
+        "--touch",
+        type=int,
+        default=5,
+        help="models to change before every run. Default 5",
+    )
+    bench.add_argument(
+        "--node-seconds",
+        type=float,
+        default=0.0,
+        help="seconds that dbt takes for every node. Default 0",
+    )
+    bench.add_argument("--no-trace-memory", action="store_true")
+    bench.add_argument(
+        "--no-state-cache",
+        action="store_true",
+        help="pull the state from the datastore every time, instead of the local state cache",
+    )
+    bench.add_argument(
+        "--max-overhead-s",
+        type=float,
+        default=None,
+        help="fail if the median overhead of the decorator exceeds this many seconds",
+    )
+    bench.add_argument(
+        "--output", help="write the timings of every run to this json file"
+    )
+    bench.add_argument("--keep", action="store_true", help="keep the working directory")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dbt_benchmark_")
+    try:
+        project_dir = os.path.join(workdir, "project")
+        generate_project(
+            project_dir,
+            models=args.models,
+            shape=args.shape,
+            sources=args.sources,
+            seeds=args.seeds,
+            macros=args.macros,
+            columns=args.columns,
+            layers=args.layers,
+            seed=args.seed,
+        )
+        bin_dir = os.path.join(workdir, "bin")
+        install_fake_dbt(bin_dir)
+        dbt_args = {
+            "command": args.command,
+            "project_dir": project_dir,
+            "profiles": profiles(args.threads),
+            "models": args.select or None,
+            "generate_docs": args.generate_docs,
+            "background_docs": args.background_docs,
+            "catalog_cache": args.catalog_cache,
+            "partial_parse_cache": args.partial_parse_cache,
+            "stream_logs": args.stream_logs,
+        }
+        flow_path = os.path.join(workdir, "benchmark_flow.py")
+        with open(flow_path, "w") as f:
+            f.write(FLOW.format(flow_name=FLOW_NAME, dbt_args=dbt_args))
+
+        env = environment(args, workdir, bin_dir)
+        # The client reads the datastore location from the environment when metaflow is imported.
+        os.environ.update({k: v for k, v in env.items() if k.startswith("METAFLOW_")})
+        rng = random.Random(args.seed)
+        runs = []
+        for i in range(args.warmup + args.runs):
+            if i > 0:
+                touch_models(project_dir, args.touch, rng)
+            run_id = run_flow(flow_path, env, workdir)
+            if i >= args.warmup:
+                runs.append(load_timings(run_id))
+
+        manifest = os.path.join(project_dir, "target", "manifest.json")
+        print(
+            f"{args.models} models ({args.shape}), manifest of "
+            f"{os.path.getsize(manifest) / 1024**2:.1f} MB, {args.runs} runs\n"
+        )
+        summary = summarize(runs)
+        report(summary, runs)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"args": vars(args), "summary": summary, "runs": runs}, f)
+    finally:
+        if args.keep:
+            print(f"working directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    median_overhead = statistics.median(overhead(timings) for timings in runs)
+    if args.max_overhead_s is not None and median_overhead > args.max_overhead_s:
+        print(f"FAIL: median overhead exceeds {args.max_overhead_s} s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
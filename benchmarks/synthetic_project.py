@@ -0,0 +1,242 @@
+"""
+Generator for synthetic dbt projects, used by the step benchmark together with the stand-in dbt in fake_dbt.py.
+
+The projects have a configurable number of models, sources, seeds and macros, wired up in one of
+several DAG shapes, with the yml documentation and tests of a typical project:
+
+    python benchmarks/synthetic_project.py /tmp/project --models 1000 --shape layered
+"""
+import argparse
+import os
+import random
+from typing import Dict, List
+
+# How the models depend on each other:
+# chain: every model depends on the previous one.
+# wide: every model only depends on sources, so the whole project can run in parallel.
+# layered: models are split into layers, every model depends on a few models of the previous layer.
+# random: every model depends on a few random models before it.
+SHAPES = ["chain", "wide", "layered", "random"]
+PROFILE_NAME = "bench"
+PROJECT_NAME = "bench"
+SOURCE_NAME = "raw"
+
+
+def generate_project(
+    path: str,
+    models: int = 200,
+    shape: str = "layered",
+    sources: int = 10,
+    seeds: int = 5,
+    macros: int = 20,
+    columns: int = 10,
+    layers: int = 8,
+    seed: int = 0,
+) -> Dict[str, List[str]]:
+    """
+    Write a synthetic dbt project to path.
+
+    Returns
+    -------
+    Dict[str, List[str]]
+        The parents of every model, by model name.
+    """
+    if shape not in SHAPES:
+        raise ValueError(f"DAG shape '{shape}' is not supported.")
+    rng = random.Random(seed)
+    names = [f"model_{i:05d}" for i in range(models)]
+    tables = [f"table_{i:03d}" for i in range(sources)]
+    parents = _dag(names, shape, layers, rng)
+
+    _write(
+        path,
+        "dbt_project.yml",
+        f"name: {PROJECT_NAME}\n"
+        "version: '1.0.0'\n"
+        "config-version: 2\n"
+        f"profile: {PROFILE_NAME}\n"
+        "model-paths: ['models']\n"
+        "seed-paths: ['seeds']\n"
+        "macro-paths: ['macros']\n"
+        "target-path: target\n"
+        "models:\n"
+        f"  {PROJECT_NAME}:\n"
+        "    +materialized: view\n",
+    )
+
+    column_names = ["id"] + [f"column_{i:02d}" for i in range(columns - 1)]
+    for index, name in enumerate(names):
+        model_parents = parents[name]
+        refs = [f"{{{{ ref('{parent}') }}}}" for parent in model_parents]
+        if not model_parents and tables:
+            refs.append(f"{{{{ source('{SOURCE_NAME}', '{rng.choice(tables)}') }}}}")
+        if not refs:
+            refs.append("(select 1 as id)")
+        _write(
+            path,
+            os.path.join("models", _layer_dir(index, models, layers), f"{name}.sql"),
+            _model_sql(refs, column_names, macros, rng),
+        )
+
+    _write(path, os.path.join("models", "schema.yml"), _schema_yml(names, column_names))
+    _write(path, os.path.join("models", "sources.yml"), _sources_yml(tables))
+
+    for i in range(seeds):
+        rows = "\n".join(f"{row},value_{row}" for row in range(50))
+        _write(path, os.path.join("seeds", f"seed_{i:03d}.csv"), f"id,value\n{rows}\n")
+
+    for i in range(macros):
+        _write(
+            path,
+            os.path.join("macros", f"macro_{i:03d}.sql"),
+            f"{{% macro macro_{i:03d}(column) %}}\n"
+            "    case when {{ column }} is null then 0 else {{ column }} end\n"
+            "{% endmacro %}\n",
+        )
+    return parents
+
+
+def touch_models(path: str, count: int, rng: random.Random) -> List[str]:
+    """
+    Change the code of count random models, so they show up as modified against the previous state.
+    """
+    models = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(os.path.join(path, "models"))
+        for file in files
+        if file.endswith(".sql")
+    )
+    touched = rng.sample(models, min(count, len(models)))
+    for file in touched:
+        with open(file, "a") as f:
+            f.write(f"-- touched {rng.random()}\n")
+    return [os.path.basename(file)[: -len(".sql")] for file in touched]
+
+
+def _dag(names: List[str], shape: str, layers: int, rng: random.Random):
+    parents = {}
+    by_layer = {}
+    for index, name in enumerate(names):
+        by_layer.setdefault(_layer(index, len(names), layers), []).append(name)
+    for index, name in enumerate(names):
+        if shape == "chain":
+            candidates = names[index - 1 : index] if index else []
+            count = 1
+        elif shape == "wide":
+            candidates, count = [], 0
+        elif shape == "layered":
+            candidates = by_layer.get(_layer(index, len(names), layers) - 1, [])
+            count = rng.randint(1, 3)
+        else:
+            candidates = names[:index]
+            count = rng.randint(1, 3)
+        parents[name] = sorted(rng.sample(candidates, min(count, len(candidates))))
+    return parents
+
+
+def _layer(index: int, total: int, layers: int) -> int:
+    return index * layers // max(total, 1)
+
+
+def _layer_dir(index: int, total: int, layers: int) -> str:
+    return f"layer_{_layer(index, total, layers):02d}"
+
+
+def _model_sql(
+    refs: List[str], column_names: List[str], macros: int, rng: random.Random
+) -> str:
+    # Roughly the size of a typical transformation: a few CTEs, joins and derived columns.
+    ctes = [f"input_{i} as (\n    select * from {ref}\n)" for i, ref in enumerate(refs)]
+    derived = ",\n".join(
+        f"    {{{{ macro_{rng.randrange(macros):03d}('input_0.{column}') }}}} as {column}"
+        if i and macros
+        else f"    input_0.{column}"
+        for i, column in enumerate(column_names)
+    )
+    joins = "\n".join(
+        f"left join input_{i} on input_{i}.id = input_0.id" for i in range(1, len(refs))
+    )
+    return (
+        "{{ config(materialized='view') }}\n\n"
+        + "with "
+        + ",\n".join(ctes)
+        + f"\n\nselect\n{derived}\nfrom input_0\n{joins}\n"
+        + "where input_0.id is not null\n"
+    )
+
+
+def _schema_yml(names: List[str], column_names: List[str]) -> str:
+    lines = ["version: 2", "", "models:"]
+    for name in names:
+        lines.extend(
+            [
+                f"  - name: {name}",
+                f"    description: Synthetic model {name} for benchmarking.",
+                "    columns:",
+            ]
+        )
+        for column in column_names:
+            lines.extend(
+                [
+                    f"      - name: {column}",
+                    f"        description: Column {column} of {name}.",
+                ]
+            )
+            if column == "id":
+                lines.extend(
+                    ["        tests:", "          - not_null", "          - unique"]
+                )
+    return "\n".join(lines) + "\n"
+
+
+def _sources_yml(tables: List[str]) -> str:
+    lines = [
+        "version: 2",
+        "",
+        "sources:",
+        f"  - name: {SOURCE_NAME}",
+        "    schema: raw",
+        "    loaded_at_field: loaded_at",
+        "    freshness:",
+        "      warn_after: {count: 12, period: hour}",
+        "    tables:",
+    ]
+    for table in tables:
+        lines.extend([f"      - name: {table}", f"        description: Raw {table}."])
+    return "\n".join(lines) + "\n"
+
+
+def _write(root: str, name: str, content: str):
+    path = os.path.join(root, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="directory to write the project to")
+    parser.add_argument("--models", type=int, default=200)
+    parser.add_argument("--shape", choices=SHAPES, default="layered")
+    parser.add_argument("--sources", type=int, default=10)
+    parser.add_argument("--seeds", type=int, default=5)
+    parser.add_argument("--macros", type=int, default=20)
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--layers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+    generate_project(
+        args.path,
+        models=args.models,
+        shape=args.shape,
+        sources=args.sources,
+        seeds=args.seeds,
+        macros=args.macros,
+        columns=args.columns,
+        layers=args.layers,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -36,6 +36,7 @@ class DBTFlow(FlowSpec):
         project_dir="./jaffle_shop",
         profiles=DBT_PROFILES,
         generate_docs=True,
+        threads="auto",
     )
     @step
     def jaffle_staging(self):
@@ -0,0 +1,54 @@
+from metaflow import (
+    step,
+    FlowSpec,
+    dbt,
+    environment,
+    plan_dbt_shards,
+    merge_dbt_run_results,
+)
+from config import DBT_PROFILES
+
+ENVS = {"username": "postgres", "password": "postgres"}
+
+
+class ShardedDBTFlow(FlowSpec):
+    @environment(vars=ENVS)
+    @dbt(command="seed", project_dir="./jaffle_shop", profiles=DBT_PROFILES)
+    @step
+    def start(self):
+        # jaffle_shop example needs to be seeded before 'dbt run' works for its models.
+        print("Seeded jaffle_shop")
+        self.next(self.plan)
+
+    @step
+    def plan(self):
+        # Split the models into independent shards using the manifest of the previous step.
+        # Passing the run_results of earlier model runs as well balances the shards by execution time.
+        self.shards = plan_dbt_shards(self.manifest_index, n_shards=4)
+        print(f"Executing {len(self.shards)} shards in parallel")
+        self.next(self.dbt_shard, foreach="shards")
+
+    @environment(vars=ENVS)
+    @dbt(
+        models_from_input=True,
+        project_dir="./jaffle_shop",
+        profiles=DBT_PROFILES,
+    )
+    @step
+    def dbt_shard(self):
+        print(f"Executed shard: {self.input}")
+        self.next(self.join)
+
+    @step
+    def join(self, inputs):
+        self.run_results = merge_dbt_run_results([i.run_results for i in inputs])
+        print(f"Executed {len(self.run_results['results'])} models")
+        self.next(self.end)
+
+    @step
+    def end(self):
+        print("Done! 🏁")
+
+
+if __name__ == "__main__":
+    ShardedDBTFlow()
@@ -11,6 +11,20 @@ DEBUG_OPTIONS = ["dbtdebug"]
 # see https://docs.getdbt.com/docs/supported-data-platforms for a list of adapters
 DBT_ADAPTER_NAME = from_conf("DBT_ADAPTER_NAME", "postgres")
 
+# Local cache for DBT state pulled from the datastore, shared by all tasks on the same host.
+# The cache is content-addressed and evicts the least recently used entries once it grows over the max size (in bytes).
+# Setting the max size to 0 disables the cache.
+DBT_STATE_CACHE_DIR = from_conf("DBT_STATE_CACHE_DIR", None)
+DBT_STATE_CACHE_MAX_SIZE = int(from_conf("DBT_STATE_CACHE_MAX_SIZE", 1024**3))
+
+# Number of latest snapshots of the DBT state to keep in the datastore for every state prefix.
+# Older snapshots are removed after publishing a new one. Setting this to 0 keeps all snapshots.
+DBT_STATE_RETENTION = int(from_conf("DBT_STATE_RETENTION", 10))
+
+# Seconds after which the cached catalog entries of relations are looked up again when generating docs with a catalog cache,
+# to pick up changes made outside of dbt, f.ex. to sources. Setting this to 0 never expires the entries.
+DBT_CATALOG_MAX_AGE = int(from_conf("DBT_CATALOG_MAX_AGE", 24 * 60 * 60))
+
 
 def get_pinned_conda_libs(python_version, datastore_type):
     return {"pyyaml": "6.0", f"dbt-{DBT_ADAPTER_NAME}": "1.7.0"}
@@ -8,4 +8,17 @@ class DBTDocs(MetaflowCard):
         return task.data.static_index
 
 
-CARDS = [DBTDocs]
+class DBTLineage(MetaflowCard):
+    """
+    Lightweight alternative to the static docs, rendered from the manifest and run_results of the task.
+    """
+
+    type = "dbt_lineage"
+
+    def render(self, task):
+        from .lineage import render_lineage
+
+        return render_lineage(task)
+
+
+CARDS = [DBTDocs, DBTLineage]
@@ -0,0 +1,388 @@
+import base64
+import gzip
+import json
+from html import escape
+from typing import Dict, List, Mapping, Optional
+
+from ...dbt.dbt_history import timing_table
+
+# Upper limit for the nodes drawn in the lineage view. The executed nodes are kept over their context parents.
+MAX_LINEAGE_NODES = 400
+# Number of node details per compressed chunk of the card.
+DETAIL_CHUNK_SIZE = 64
+# Code in the node details is truncated to this many characters.
+MAX_CODE_CHARS = 20_000
+
+# Layout of the lineage view, in pixels.
+NODE_WIDTH = 180
+NODE_HEIGHT = 26
+COLUMN_GAP = 60
+ROW_GAP = 10
+
+STATUS_COLORS = {
+    "success": "#3fb950",
+    "pass": "#3fb950",
+    "error": "#f85149",
+    "fail": "#f85149",
+    "runtime error": "#f85149",
+    "warn": "#d29922",
+    "skipped": "#8b949e",
+}
+CONTEXT_COLOR = "#d0d7de"
+
+
+def render_lineage(task) -> str:
+    """
+    Render the lineage card of a @dbt task from its manifest and run_results artifacts.
+
+    The card shows the executed nodes along with their direct parents as a layered lineage view,
+    and a table of the status and timings of every executed node.
+    The details of the nodes (description, columns, code) are embedded as gzip compressed chunks,
+    which the browser only decompresses when a node is opened.
+    """
+    run_results = task.data.run_results if "run_results" in task else None
+    manifest = task.data.manifest if "manifest" in task else None
+    if run_results is None or manifest is None:
+        return _page(
+            "<p>No dbt run results or manifest were recorded for this task.</p>"
+        )
+    index = task.data.manifest_index if "manifest_index" in task else None
+    catalog = task.data.catalog if "catalog" in task else None
+
+    table = timing_table(run_results)
+    results = {result["unique_id"]: result for result in run_results.get("results", [])}
+    executed = [uid for uid in table["unique_id"] if not _is_test(uid)]
+    # Nodes are read from the manifest in batches, the executed ones first and then their context parents,
+    # so that every chunk of a ManifestArtifact is decompressed once per batch rather than once per node.
+    looked_up = set(table["unique_id"])
+    manifest_nodes = _nodes(table["unique_id"], manifest)
+    parents = {uid: _parents(uid, manifest_nodes.get(uid), index) for uid in executed}
+
+    nodes = list(dict.fromkeys(executed))
+    context = [p for uid in executed for p in parents[uid] if p not in results]
+    nodes.extend(dict.fromkeys(p for p in context if p not in nodes))
+    truncated = len(nodes) > MAX_LINEAGE_NODES
+    nodes = nodes[:MAX_LINEAGE_NODES]
+    for uid in nodes:
+        if uid not in parents:
+            # Only the edges among the drawn nodes matter, the context nodes are the roots of the view.
+            parents[uid] = []
+    manifest_nodes.update(
+        _nodes([uid for uid in nodes if uid not in looked_up], manifest)
+    )
+
+    details = {
+        uid: _detail(uid, manifest_nodes.get(uid) or {}, catalog, results.get(uid))
+        for uid in dict.fromkeys(nodes + table["unique_id"])
+    }
+    chunks, locations = _chunk(details)
+
+    body = [
+        "<h2>dbt lineage</h2>",
+        _summary(table),
+        _svg(nodes, parents, results),
+    ]
+    if truncated:
+        body.append(
+            f"<p class='note'>Showing the first {MAX_LINEAGE_NODES} nodes of the lineage.</p>"
+        )
+    body.append(
+        "<div id='detail' class='detail'>Select a node to show its details.</div>"
+    )
+    body.append(_table(table))
+    body.extend(
+        f"<script type='application/octet-stream' id='chunk-{i}'>{chunk}</script>"
+        for i, chunk in enumerate(chunks)
+    )
+    body.append(
+        f"<script>const LOCATIONS = {_script_json(locations)};</script><script>{SCRIPT}</script>"
+    )
+    return _page("\n".join(body))
+
+
+def _is_test(unique_id: str) -> bool:
+    return unique_id.split(".")[0] in ["test", "unit_test"]
+
+
+def _nodes(unique_ids: List[str], manifest) -> Dict[str, Dict]:
+    # ManifestArtifact reads nodes without decompressing the whole manifest.
+    if hasattr(manifest, "nodes"):
+        return manifest.nodes(unique_ids)
+    found = {}
+    for unique_id in unique_ids:
+        for section in ["nodes", "sources", "exposures", "metrics", "semantic_models"]:
+            if unique_id in (manifest.get(section) or {}):
+                found[unique_id] = manifest[section][unique_id]
+                break
+    return found
+
+
+def _parents(unique_id: str, node: Optional[Dict], index) -> List[str]:
+    if index is not None and unique_id in index:
+        return [p for p in index.parents(unique_id) if not _is_test(p)]
+    node = node or {}
+    return [
+        p for p in (node.get("depends_on") or {}).get("nodes", []) if not _is_test(p)
+    ]
+
+
+def _layers(nodes: List[str], parents: Mapping[str, List[str]]) -> Dict[str, int]:
+    """
+    Column of every node in the lineage view: one right of its rightmost parent among the nodes.
+    """
+    members = set(nodes)
+    layers = {}
+    for start in nodes:
+        stack = [start]
+        while stack:
+            uid = stack[-1]
+            if uid in layers:
+                stack.pop()
+                continue
+            pending = [p for p in parents[uid] if p in members and p not in layers]
+            if pending and not any(p in stack for p in pending):
+                stack.extend(pending)
+                continue
+            # Parents that are still on the stack would be a cycle, which dbt does not allow. Ignore them regardless.
+            layers[uid] = 1 + max(
+                (layers[p] for p in parents[uid] if p in layers), default=-1
+            )
+            stack.pop()
+    return layers
+
+
+def _svg(nodes: List[str], parents: Mapping[str, List[str]], results: Mapping) -> str:
+    layers = _layers(nodes, parents)
+    rows = {}
+    positions = {}
+    for uid in sorted(nodes, key=lambda uid: (layers[uid], uid)):
+        row = rows.get(layers[uid], 0)
+        rows[layers[uid]] = row + 1
+        positions[uid] = (
+            layers[uid] * (NODE_WIDTH + COLUMN_GAP),
+            row * (NODE_HEIGHT + ROW_GAP),
+        )
+    width = (max(layers.values(), default=0) + 1) * (NODE_WIDTH + COLUMN_GAP)
+    height = max(rows.values(), default=0) * (NODE_HEIGHT + ROW_GAP)
+
+    edges = []
+    for uid in nodes:
+        x, y = positions[uid]
+        for parent in parents[uid]:
+            if parent not in positions:
+                continue
+            px, py = positions[parent]
+            x1, y1 = px + NODE_WIDTH, py + NODE_HEIGHT / 2
+            y2 = y + NODE_HEIGHT / 2
+            middle = (x1 + x) / 2
+            edges.append(
+                f"<path d='M{x1},{y1} C{middle},{y1} {middle},{y2} {x},{y2}'/>"
+            )
+
+    boxes = []
+    for uid in nodes:
+        x, y = positions[uid]
+        result = results.get(uid)
+        color = (
+            STATUS_COLORS.get(result.get("status"), CONTEXT_COLOR)
+            if result
+            else CONTEXT_COLOR
+        )
+        title = escape(uid) + (
+            f" ({escape(str(result.get('status')))})" if result else " (not executed)"
+        )
+        boxes.append(
+            f"<g class='node' data-uid='{escape(uid)}' transform='translate({x},{y})'>"
+            f"<title>{title}</title>"
+            f"<rect width='{NODE_WIDTH}' height='{NODE_HEIGHT}' rx='4' fill='{color}'/>"
+            f"<text x='8' y='17'>{escape(_short(uid))}</text></g>"
+        )
+    return (
+        f"<div class='lineage'><svg width='{width}' height='{height}'>"
+        f"<g class='edges'>{''.join(edges)}</g>{''.join(boxes)}</svg></div>"
+    )
+
+
+def _short(unique_id: str) -> str:
+    name = unique_id.split(".")[-1]
+    return name if len(name) <= 24 else name[:23] + "…"
+
+
+def _summary(table: Mapping[str, List]) -> str:
+    counts = {}
+    for status in table["status"]:
+        counts[status] = counts.get(status, 0) + 1
+    elapsed = sum(t or 0.0 for t in table["execution_time"])
+    parts = [
+        f"{count} {escape(str(status))}"
+        for status, count in sorted(counts.items(), key=str)
+    ]
+    return (
+        f"<p>{len(table['unique_id'])} nodes: {', '.join(parts) or 'none'}. "
+        f"Total node time {elapsed:.1f}s.</p>"
+    )
+
+
+def _table(table: Mapping[str, List]) -> str:
+    columns = [
+        "unique_id",
+        "status",
+        "execution_time",
+        "compile_s",
+        "execute_s",
+        "rows_affected",
+        "thread_id",
+    ]
+    order = sorted(
+        range(len(table["unique_id"])),
+        key=lambda i: -(table["execution_time"][i] or 0.0),
+    )
+    head = "".join(f"<th>{column}</th>" for column in columns)
+    rows = []
+    for i in order:
+        uid = table["unique_id"][i]
+        cells = "".join(
+            f"<td>{escape(_format(table[column][i]))}</td>" for column in columns
+        )
+        rows.append(f"<tr class='node' data-uid='{escape(uid)}'>{cells}</tr>")
+    return (
+        f"<table><thead><tr>{head}</tr></thead><tbody>{''.join(rows)}</tbody></table>"
+    )
+
+
+def _format(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+
+def _detail(unique_id: str, node: Dict, catalog, result: Optional[Mapping]) -> Dict:
+    detail = {
+        "unique_id": unique_id,
+        "resource_type": node.get("resource_type"),
+        "path": node.get("original_file_path"),
+        "materialized": (node.get("config") or {}).get("materialized"),
+        "relation": node.get("relation_name"),
+        "description": node.get("description"),
+        "tags": node.get("tags") or [],
+        "columns": {
+            name: {
+                "description": column.get("description"),
+                "data_type": column.get("data_type"),
+            }
+            for name, column in (node.get("columns") or {}).items()
+        },
+        "raw_code": _truncate(node.get("raw_code") or node.get("raw_sql")),
+        "compiled_code": _truncate(
+            (result or {}).get("compiled_code") or node.get("compiled_code")
+        ),
+    }
+    if catalog is not None:
+        section = "sources" if unique_id.startswith("source.") else "nodes"
+        entry = (catalog.get(section) or {}).get(unique_id)
+        if entry is not None:
+            detail["catalog_columns"] = {
+                name: column.get("type")
+                for name, column in (entry.get("columns") or {}).items()
+            }
+    if result is not None:
+        detail["status"] = result.get("status")
+        detail["message"] = result.get("message")
+        detail["failures"] = result.get("failures")
+    return detail
+
+
+def _truncate(code: Optional[str]) -> Optional[str]:
+    if code is None or len(code) <= MAX_CODE_CHARS:
+        return code
+    return code[:MAX_CODE_CHARS] + "\n-- truncated"
+
+
+def _chunk(details: Mapping[str, Dict]):
+    """
+    Split the details into base64 encoded gzip chunks, along with the chunk of every node.
+    """
+    items = list(details.items())
+    chunks = []
+    locations = {}
+    for start in range(0, len(items), DETAIL_CHUNK_SIZE):
+        chunk = dict(items[start : start + DETAIL_CHUNK_SIZE])
+        for uid in chunk:
+            locations[uid] = len(chunks)
+        chunks.append(
+            base64.b64encode(gzip.compress(json.dumps(chunk).encode())).decode()
+        )
+    return chunks, locations
+
+
+def _script_json(value) -> str:
+    # Keep the json from closing the script tag.
+    return json.dumps(value).replace("</", "<\\/")
+
+
+def _page(body: str) -> str:
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<style>{STYLE}</style></head><body>{body}</body></html>"
+    )
+
+
+STYLE = """
+body { font-family: -apple-system, BlinkMacSystemFont, sans-serif; font-size: 13px; margin: 16px; }
+.lineage { overflow: auto; max-height: 600px; border: 1px solid #d0d7de; padding: 8px; }
+.edges path { fill: none; stroke: #8b949e; stroke-width: 1; }
+.node { cursor: pointer; }
+svg text { font-size: 12px; fill: #1f2328; }
+.detail { margin: 12px 0; padding: 8px; border: 1px solid #d0d7de; white-space: pre-wrap; }
+.detail pre { background: #f6f8fa; padding: 8px; overflow: auto; max-height: 300px; }
+.note { color: #8b949e; }
+table { border-collapse: collapse; }
+th, td { border-bottom: 1px solid #d0d7de; padding: 2px 8px; text-align: left; }
+tr.node:hover { background: #f6f8fa; }
+"""
+
+# Decompresses the chunk of a node on demand, and keeps the decompressed chunks around.
+SCRIPT = """
+const CHUNKS = {};
+async function chunk(i) {
+  if (!(i in CHUNKS)) {
+    const text = document.getElementById("chunk-" + i).textContent;
+    const bytes = Uint8Array.from(atob(text), (c) => c.charCodeAt(0));
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+    CHUNKS[i] = await new Response(stream).json();
+  }
+  return CHUNKS[i];
+}
+function esc(value) {
+  const div = document.createElement("div");
+  div.textContent = value == null ? "" : String(value);
+  return div.innerHTML;
+}
+async function show(uid) {
+  const target = document.getElementById("detail");
+  if (!(uid in LOCATIONS)) { target.textContent = uid; return; }
+  const d = (await chunk(LOCATIONS[uid]))[uid];
+  let html = "<b>" + esc(d.unique_id) + "</b>";
+  for (const key of ["status", "message", "failures", "resource_type", "materialized", "relation", "path", "description"]) {
+    if (d[key] != null && d[key] !== "") html += "<br>" + key + ": " + esc(d[key]);
+  }
+  if (d.tags.length) html += "<br>tags: " + esc(d.tags.join(", "));
+  const columns = Object.entries(d.columns);
+  if (columns.length) {
+    html += "<br>columns:";
+    for (const [name, c] of columns) html += "<br>  " + esc(name) + (c.data_type ? " (" + esc(c.data_type) + ")" : "") + (c.description ? ": " + esc(c.description) : "");
+  }
+  if (d.catalog_columns) {
+    html += "<br>catalog columns:";
+    for (const [name, type] of Object.entries(d.catalog_columns)) html += "<br>  " + esc(name) + " " + esc(type);
+  }
+  if (d.compiled_code) html += "<pre>" + esc(d.compiled_code) + "</pre>";
+  else if (d.raw_code) html += "<pre>" + esc(d.raw_code) + "</pre>";
+  target.innerHTML = html;
+}
+for (const el of document.querySelectorAll(".node")) {
+  el.addEventListener("click", () => show(el.dataset.uid));
+}
+"""
@@ -1,13 +1,18 @@
 class dbt_deco:
     def __init__(self, **kwargs):
         self.generate_docs = kwargs.get("generate_docs", False)
+        self.docs_card = kwargs.get("docs_card", "static")
         self.kwargs = kwargs
 
     def __call__(self, step_func):
         # Make generated docs available as a card.
         from metaflow import _dbt
 
-        if self.generate_docs:
+        if self.docs_card == "lineage":
+            from metaflow import card
+
+            return card(type="dbt_lineage")(_dbt(**self.kwargs)(step_func))
+        elif self.generate_docs:
             from metaflow import card
 
             return card(type="dbt_docs")(_dbt(**self.kwargs)(step_func))
@@ -0,0 +1,296 @@
+import json
+import zlib
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from .dbt_graph import ManifestIndex
+
+# Favour speed over ratio, the json artifacts compress well regardless.
+COMPRESS_LEVEL = 3
+# Sections of the manifest that hold entries keyed by unique_id.
+# These are split into separately compressed chunks, so that single entries can be read without parsing the whole manifest.
+MANIFEST_SECTIONS = [
+    "nodes",
+    "sources",
+    "macros",
+    "docs",
+    "exposures",
+    "metrics",
+    "groups",
+    "semantic_models",
+    "saved_queries",
+]
+# Sections that are included in the lookup index.
+INDEXED_SECTIONS = ["nodes", "sources", "exposures", "metrics", "semantic_models"]
+CHUNK_SIZE = 256
+
+
+class DBTArtifact(Mapping):
+    """
+    A DBT json artifact that is stored compressed, and parsed only when its content is accessed.
+
+    Behaves like the (read-only) dictionary of the artifact, so existing access patterns
+    like `self.run_results["results"]` keep working.
+    The parsed content is not persisted when the artifact is pickled.
+    """
+
+    def __init__(self, compressed: bytes):
+        self._compressed = compressed
+        self._data = None
+
+    @classmethod
+    def from_bytes(cls, raw: bytes):
+        return cls(zlib.compress(raw, COMPRESS_LEVEL))
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        return cls.from_bytes(json.dumps(data).encode())
+
+    def raw(self) -> bytes:
+        """
+        The raw json content of the artifact.
+        """
+        return zlib.decompress(self._compressed)
+
+    @property
+    def data(self) -> Dict:
+        """
+        The parsed content of the artifact.
+        """
+        if self._data is None:
+            self._data = json.loads(self.raw())
+        return self._data
+
+    def to_dict(self) -> Dict:
+        return self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} ({len(self._compressed)} bytes compressed)>"
+
+    def __getstate__(self):
+        return {"_compressed": self._compressed}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._data = None
+
+
+class ManifestArtifact(DBTArtifact):
+    """
+    The DBT manifest, stored as compressed chunks with an index of its nodes.
+
+    Nodes can be looked up by unique_id, name, tag, package and path through the index,
+    and single nodes can be read by decompressing only the chunk they are stored in.
+    The full manifest is assembled only when it is accessed as a dictionary.
+
+    When the artifact is created from the content of a manifest, the graph index of the manifest is built
+    from the same parsed content and kept as `graph`. It is not persisted with the artifact.
+    """
+
+    def __init__(self, compressed: bytes, chunks: List[bytes], index: "NodeIndex"):
+        # compressed holds the manifest without the chunked sections.
+        super().__init__(compressed)
+        self._chunks = chunks
+        self.index = index
+        self.graph: Optional[ManifestIndex] = None
+
+    @classmethod
+    def from_bytes(cls, raw: bytes):
+        return cls.from_dict(json.loads(raw))
+
+    @classmethod
+    def from_dict(cls, data: Dict):
+        # Chunked sections are kept as empty placeholders, so the full manifest keeps its keys and their order.
+        rest = {k: ({} if k in MANIFEST_SECTIONS else v) for k, v in data.items()}
+        chunks = []
+        locations = {}
+        for section in MANIFEST_SECTIONS:
+            entries = list((data.get(section) or {}).items())
+            if not entries:
+                continue
+            for start in range(0, len(entries), CHUNK_SIZE):
+                chunk = dict(entries[start : start + CHUNK_SIZE])
+                for unique_id in chunk:
+                    locations[unique_id] = len(chunks)
+                chunks.append(
+                    zlib.compress(
+                        json.dumps({"section": section, "entries": chunk}).encode(),
+                        COMPRESS_LEVEL,
+                    )
+                )
+        index = NodeIndex(
+            {
+                unique_id: _index_entry(node)
+                for section in INDEXED_SECTIONS
+                for unique_id, node in (data.get(section) or {}).items()
+            },
+            locations,
+        )
+        artifact = cls(
+            zlib.compress(json.dumps(rest).encode(), COMPRESS_LEVEL), chunks, index
+        )
+        artifact.graph = ManifestIndex.from_manifest(data)
+        return artifact
+
+    def _chunk(self, i: int) -> Dict:
+        return json.loads(zlib.decompress(self._chunks[i]))
+
+    def node(self, unique_id: str) -> Optional[Dict]:
+        """
+        Read a single entry of the manifest by unique_id, decompressing only the chunk that contains it.
+        Use `nodes` to read many entries, so that every chunk is decompressed once.
+        """
+        return self.nodes([unique_id]).get(unique_id)
+
+    def nodes(self, unique_ids: Iterable[str]) -> Dict[str, Dict]:
+        """
+        Read the entries of the manifest with the given unique_ids, decompressing every chunk that contains
+        any of them once. unique_ids that are not in the manifest are left out.
+        """
+        if self._data is not None:
+            found = {}
+            for unique_id in unique_ids:
+                for section in MANIFEST_SECTIONS:
+                    if unique_id in self._data.get(section, {}):
+                        found[unique_id] = self._data[section][unique_id]
+                        break
+            return found
+        by_chunk = {}
+        for unique_id in unique_ids:
+            i = self.index.locations.get(unique_id)
+            if i is not None:
+                by_chunk.setdefault(i, []).append(unique_id)
+        found = {}
+        for i, chunk_ids in sorted(by_chunk.items()):
+            entries = self._chunk(i)["entries"]
+            found.update((unique_id, entries[unique_id]) for unique_id in chunk_ids)
+        return found
+
+    def raw(self) -> bytes:
+        return json.dumps(self.data).encode()
+
+    @property
+    def data(self) -> Dict:
+        if self._data is None:
+            data = json.loads(zlib.decompress(self._compressed))
+            for i in range(len(self._chunks)):
+                chunk = self._chunk(i)
+                data[chunk["section"]].update(chunk["entries"])
+            self._data = data
+        return self._data
+
+    def __repr__(self):
+        size = len(self._compressed) + sum(len(c) for c in self._chunks)
+        return f"<{self.__class__.__name__} ({len(self.index)} nodes, {size} bytes compressed)>"
+
+    def __getstate__(self):
+        return {
+            "_compressed": self._compressed,
+            "_chunks": self._chunks,
+            "index": self.index,
+        }
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.graph = None
+
+
+def _index_entry(node: Dict) -> Dict:
+    return {
+        "name": node.get("name"),
+        "resource_type": node.get("resource_type"),
+        "package_name": node.get("package_name"),
+        "path": node.get("original_file_path"),
+        "tags": node.get("tags") or [],
+    }
+
+
+class NodeIndex:
+    """
+    Lookup index of the manifest nodes, holding only the fields required for lookups.
+
+    Parameters
+    ----------
+    entries: Dict[str, Dict]
+        name, resource_type, package_name, path and tags of every node, keyed by unique_id.
+    locations: Dict[str, int]
+        chunk of the manifest that every entry is stored in, keyed by unique_id.
+    """
+
+    def __init__(self, entries: Dict[str, Dict], locations: Dict[str, int]):
+        self.entries = entries
+        self.locations = locations
+        self._by_name = None
+        self._by_tag = None
+        self._by_package = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, unique_id):
+        return unique_id in self.entries
+
+    def get(self, unique_id: str) -> Optional[Dict]:
+        return self.entries.get(unique_id)
+
+    def by_name(self, name: str) -> List[str]:
+        if self._by_name is None:
+            self._by_name = _group(self.entries, lambda e: [e["name"]])
+        return self._by_name.get(name, [])
+
+    def by_tag(self, tag: str) -> List[str]:
+        if self._by_tag is None:
+            self._by_tag = _group(self.entries, lambda e: e["tags"])
+        return self._by_tag.get(tag, [])
+
+    def by_package(self, package: str) -> List[str]:
+        if self._by_package is None:
+            self._by_package = _group(self.entries, lambda e: [e["package_name"]])
+        return self._by_package.get(package, [])
+
+    def by_path(self, path: str) -> List[str]:
+        """
+        unique_ids of the nodes defined in the given file, or anywhere under the given directory.
+        """
+        path = path.rstrip("/")
+        return [
+            unique_id
+            for unique_id, e in self.entries.items()
+            if e["path"] and (e["path"] == path or e["path"].startswith(path + "/"))
+        ]
+
+    def by_resource_type(self, resource_type: str) -> List[str]:
+        return [
+            unique_id
+            for unique_id, e in self.entries.items()
+            if e["resource_type"] == resource_type
+        ]
+
+    def __getstate__(self):
+        # The lookup tables are cheap to rebuild, so only persist the entries.
+        return {"entries": self.entries, "locations": self.locations}
+
+    def __setstate__(self, state):
+        self.__init__(state["entries"], state["locations"])
+
+
+def _group(entries: Dict[str, Dict], keys) -> Dict[str, List[str]]:
+    groups = {}
+    for unique_id, e in entries.items():
+        for key in keys(e):
+            groups.setdefault(key, []).append(unique_id)
+    return groups
@@ -0,0 +1,141 @@
+import json
+import tempfile
+from contextlib import ExitStack
+from typing import Dict, List, Mapping, Optional
+
+from .dbt_selection import intersect_selection
+
+# Selectors for the nodes that have to be executed again after a failed attempt:
+# the errored nodes and failed tests, the nodes that were skipped due to them (or due to --fail-fast), and their children.
+RETRY_SELECTORS = ["result:error+", "result:fail+", "result:skipped+"]
+
+RUN_RESULTS = "run_results.json"
+MANIFEST = "manifest.json"
+
+
+# Selector methods that compare against a previous state. The failed attempt already applied them,
+# so they are not applied again when retrying.
+STATE_METHODS = ["state:", "result:", "source_status:"]
+
+
+def retry_selection(models: Optional[str]) -> str:
+    """
+    Narrow a selection down to the nodes that did not succeed in the previous attempt.
+
+    Selectors that compare against a previous state are dropped from the selection: the unfinished nodes
+    of the previous attempt were selected by them already, while comparing again could drop them,
+    f.ex. when the state that the failed attempt compared against was replaced in the meantime.
+    """
+    parts = []
+    for union_part in (models or "").split():
+        kept = [
+            part
+            for part in union_part.split(",")
+            if not any(method in part for method in STATE_METHODS)
+        ]
+        if not kept:
+            # This part of the union selected nodes only by comparing against the state, so any of the unfinished nodes.
+            return " ".join(RETRY_SELECTORS)
+        parts.append(",".join(kept))
+    return intersect_selection(" ".join(parts) or None, RETRY_SELECTORS)
+
+
+def merge_attempts(run_results: List[Optional[Mapping]]) -> Optional[Dict]:
+    """
+    Merge the run results of consecutive attempts of a task, oldest first.
+
+    The result of a node in a later attempt replaces its result in earlier attempts.
+    """
+    run_results = [r for r in run_results if r is not None]
+    if not run_results:
+        return None
+    results = {}
+    for attempt in run_results:
+        for result in attempt.get("results", []):
+            results[result["unique_id"]] = result
+    latest = run_results[-1]
+    return {
+        "metadata": dict(latest.get("metadata", {})),
+        "results": list(results.values()),
+        # attempts are executed one after another.
+        "elapsed_time": sum(r.get("elapsed_time") or 0.0 for r in run_results),
+        "args": dict(latest.get("args", {})),
+    }
+
+
+def retryable(run_results: Optional[Mapping]) -> bool:
+    """
+    Whether the run results of a failed attempt can be used for narrowing down the selection of the next attempt.
+    """
+    # Without any node results the attempt failed before executing nodes (f.ex. during compilation),
+    # in which case everything has to be executed again.
+    return bool(run_results and run_results.get("results"))
+
+
+class DBTAttemptStore:
+    """
+    Run results of the attempts of a task, kept in the datastore so a retry can
+    pick up where a failed attempt left off.
+
+    The run results stored for an attempt are merged with those of all earlier attempts.
+    The manifest of the attempt is stored along with them, as the state that the retry selects the
+    unfinished nodes against, for when the retry does not run where the failed attempt did.
+
+    Parameters
+    ----------
+    datastore: DataStoreStorage
+        datastore rooted at the prefix of the task.
+    """
+
+    def __init__(self, datastore):
+        self.datastore = datastore
+
+    def save(self, attempt: int, run_results: Mapping, manifest: Optional[str] = None):
+        """
+        Record the run results of an attempt, and the raw content of its manifest.json if available.
+        """
+        contents = {RUN_RESULTS: json.dumps(dict(run_results))}
+        if manifest is not None:
+            contents[MANIFEST] = manifest
+        with ExitStack() as stack:
+            files = []
+            for name, content in contents.items():
+                f = stack.enter_context(tempfile.TemporaryFile())
+                f.write(content.encode())
+                f.seek(0)
+                files.append((f"{attempt}/{name}", f))
+            self.datastore.save_bytes(files, overwrite=True)
+
+    def latest(self, before: int) -> Optional[Dict]:
+        """
+        Run results of the latest attempt before the given one that recorded any.
+        """
+        attempt = self._latest_attempt(before)
+        if attempt is None:
+            return None
+        return json.loads(self._load(f"{attempt}/{RUN_RESULTS}"))
+
+    def manifest(self, before: int) -> Optional[str]:
+        """
+        Raw content of the manifest.json of the attempt that `latest` returns the run results of, if it was recorded.
+        """
+        attempt = self._latest_attempt(before)
+        if attempt is None:
+            return None
+        return self._load(f"{attempt}/{MANIFEST}")
+
+    def _latest_attempt(self, before: int) -> Optional[int]:
+        keys = [f"{attempt}/{RUN_RESULTS}" for attempt in range(before)]
+        recorded = self.datastore.is_file(keys)
+        for attempt in reversed(range(before)):
+            if recorded[attempt]:
+                return attempt
+        return None
+
+    def _load(self, key: str) -> Optional[str]:
+        with self.datastore.load_bytes([key]) as result:
+            for _, file, _ in result:
+                if file is not None:
+                    with open(file) as f:
+                        return f.read()
+        return None
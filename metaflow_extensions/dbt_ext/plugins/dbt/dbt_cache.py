@@ -0,0 +1,176 @@
+import fcntl
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import List, Optional
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "metaflow_dbt_state_cache")
+EVICT_LOCK = ".evict.lock"
+
+
+class DBTStateCache:
+    """
+    On-disk, content-addressed cache for DBT state files.
+
+    Entries are keyed by the sha256 of their content, so the cache can be shared by all tasks on a host
+    regardless of the flow or step the state belongs to. Concurrent tasks coordinate through file locks,
+    so that a missing entry is downloaded only once. The least recently used entries are evicted
+    once the cache grows over max_size bytes.
+
+    Parameters
+    ----------
+    cache_dir: str
+        Directory to keep the cached files in.
+    max_size: int
+        Maximum size of the cache in bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, sha: str) -> str:
+        return os.path.join(self.cache_dir, sha[:2], sha)
+
+    def get(self, sha: str) -> Optional[str]:
+        """
+        Path to the cached file with the given content hash, or None if it is not cached.
+        """
+        path = self._entry_path(sha)
+        try:
+            # Record the access for the LRU eviction.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, sha: str, src: str) -> str:
+        """
+        Add a file to the cache.
+        The entry is written to a temporary file first and moved in place, so readers never see partial entries.
+        """
+        path = self._entry_path(sha)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+        os.close(fd)
+        try:
+            shutil.copy(src, tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.evict()
+        return path
+
+    @contextmanager
+    def locked(self, shas: List[str]):
+        """
+        Hold exclusive locks for the given entries.
+        Locks are taken in sorted order, so that concurrent tasks can not deadlock.
+        """
+        handles = []
+        try:
+            for sha in sorted(set(shas)):
+                lock_path = self._entry_path(sha) + ".lock"
+                os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+                f = open(lock_path, "w")
+                handles.append(f)
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+        finally:
+            for f in handles:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_size, along with the locks of entries
+        that are not cached anymore. Eviction is skipped if another process is already evicting.
+        """
+        with open(os.path.join(self.cache_dir, EVICT_LOCK), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                entries = []
+                locks = []
+                for root, _, files in os.walk(self.cache_dir):
+                    for name in files:
+                        if name.endswith(".lock") and not name.startswith("."):
+                            locks.append(os.path.join(root, name))
+                        if name.startswith(".") or name.endswith(".lock"):
+                            continue
+                        path = os.path.join(root, name)
+                        try:
+                            stat = os.stat(path)
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, path))
+
+                total = sum(size for _, size, _ in entries)
+                for _, size, path in sorted(entries):
+                    if total <= self.max_size:
+                        break
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+
+                for lock_path in locks:
+                    if not os.path.exists(lock_path[: -len(".lock")]):
+                        _remove_lock(lock_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _remove_lock(lock_path: str):
+    # Locks that another task holds are left in place, f.ex. while it downloads the entry.
+    try:
+        with open(lock_path, "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+
+
+def state_cache() -> Optional[DBTStateCache]:
+    """
+    The configured local state cache, or None if caching is disabled.
+    """
+    from metaflow.metaflow_config import DBT_STATE_CACHE_DIR, DBT_STATE_CACHE_MAX_SIZE
+
+    if DBT_STATE_CACHE_MAX_SIZE <= 0:
+        return None
+    try:
+        return DBTStateCache(
+            DBT_STATE_CACHE_DIR or DEFAULT_CACHE_DIR, DBT_STATE_CACHE_MAX_SIZE
+        )
+    except OSError as ex:
+        # f.ex. the shared default directory was created by another user.
+        print(f"DBT state cache is not available: {ex}")
+        return None
+
+
+def state_retention() -> int:
+    """
+    The configured number of DBT state snapshots to keep. 0 keeps all snapshots.
+    """
+    from metaflow.metaflow_config import DBT_STATE_RETENTION
+
+    return DBT_STATE_RETENTION
+
+
+def catalog_max_age() -> int:
+    """
+    The configured number of seconds after which cached catalog entries are looked up again. 0 never expires them.
+    """
+    from metaflow.metaflow_config import DBT_CATALOG_MAX_AGE
+
+    return DBT_CATALOG_MAX_AGE
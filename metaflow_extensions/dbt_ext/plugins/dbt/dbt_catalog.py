@@ -0,0 +1,269 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+# Sections of the catalog, holding the entries of the relations keyed by unique_id.
+CATALOG_SECTIONS = ["nodes", "sources"]
+# dbt queries the catalog of at most this many relations one by one, and scans whole schemas beyond.
+# Refreshing more relations than this is no cheaper than generating the whole catalog.
+MAX_REFRESHED_RELATIONS = 100
+# Node types that are materialized as relations in the warehouse.
+RELATION_RESOURCE_TYPES = ["model", "seed", "snapshot"]
+CACHE_FILE = "catalog.json.gz"
+
+Relation = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+def manifest_relations(manifest: Mapping) -> Dict[str, Relation]:
+    """
+    The relation (database, schema, identifier) of every node of the manifest that can have a catalog entry.
+    """
+    relations = {}
+    for unique_id, node in (manifest.get("nodes") or {}).items():
+        if node.get("resource_type") not in RELATION_RESOURCE_TYPES:
+            continue
+        if (node.get("config") or {}).get("materialized") == "ephemeral":
+            continue
+        relations[unique_id] = _relation(
+            node.get("database"), node.get("schema"), node.get("alias") or node["name"]
+        )
+    for unique_id, source in (manifest.get("sources") or {}).items():
+        relations[unique_id] = _relation(
+            source.get("database"),
+            source.get("schema"),
+            source.get("identifier") or source["name"],
+        )
+    return relations
+
+
+def _relation(database, schema, identifier) -> Relation:
+    # Relation names are matched case-insensitively, just like dbt matches the catalog to the manifest.
+    return tuple(
+        part.casefold() if part else None for part in [database, schema, identifier]
+    )
+
+
+def _entry_relation(entry: Mapping) -> Relation:
+    metadata = entry.get("metadata") or {}
+    return _relation(
+        metadata.get("database"), metadata.get("schema"), metadata.get("name")
+    )
+
+
+def stale_relations(
+    cached: Optional[Mapping],
+    relations: Mapping[str, Relation],
+    built: Iterable[str],
+    max_age: float,
+    now: float,
+) -> Optional[List[str]]:
+    """
+    unique_ids of the relations whose catalog entries have to be refreshed:
+    the relations built by the current execution, relations that were never looked up, that moved,
+    or that were last looked up over max_age seconds ago (f.ex. sources changing outside of dbt).
+    A max_age of 0 never expires the entries.
+
+    Returns None if the whole catalog should be generated instead.
+    """
+    if cached is None:
+        return None
+    refreshed_at = cached.get("refreshed_at") or {}
+    stale = {unique_id for unique_id in built if unique_id in relations}
+    for unique_id, relation in relations.items():
+        if unique_id not in refreshed_at or (
+            max_age > 0 and now - refreshed_at[unique_id] > max_age
+        ):
+            stale.add(unique_id)
+            continue
+        entry = _cached_entry(cached, unique_id)
+        # Relations without an entry did not exist when they were looked up, and are not refreshed until they expire.
+        if entry is not None and _entry_relation(entry) != relation:
+            stale.add(unique_id)
+    # Sources are not selectable for docs generation, so their entries can only be refreshed with the whole catalog.
+    if len(stale) > MAX_REFRESHED_RELATIONS or any(
+        unique_id.startswith("source.") for unique_id in stale
+    ):
+        return None
+    return sorted(stale)
+
+
+def refresh_selector(manifest: Mapping, unique_ids: List[str]) -> str:
+    """
+    Selector for docs generation that selects exactly the given nodes.
+    """
+    nodes = manifest.get("nodes") or {}
+    # The fully qualified name selects exactly one node.
+    return " ".join(
+        ".".join(nodes[unique_id].get("fqn") or []) or nodes[unique_id]["name"]
+        for unique_id in unique_ids
+    )
+
+
+def _cached_entry(cached: Mapping, unique_id: str) -> Optional[Dict]:
+    for section in CATALOG_SECTIONS:
+        entry = ((cached.get("catalog") or {}).get(section) or {}).get(unique_id)
+        if entry is not None:
+            return entry
+    return None
+
+
+def merge_catalog(
+    fresh: Mapping,
+    cached: Optional[Mapping],
+    relations: Mapping[str, Relation],
+    refreshed: Optional[List[str]],
+) -> Dict:
+    """
+    Catalog of the whole project, from the fresh entries of the refreshed relations and the cached entries of the rest.
+
+    With refreshed=None the fresh catalog was generated for the whole project, and is returned as it is.
+    Cached entries of relations that are no longer part of the project are dropped.
+    """
+    if refreshed is None or cached is None:
+        return dict(fresh)
+    refreshed = set(refreshed)
+    merged = dict(fresh)
+    for section in CATALOG_SECTIONS:
+        entries = {
+            unique_id: entry
+            for unique_id, entry in (
+                (cached.get("catalog") or {}).get(section) or {}
+            ).items()
+            if unique_id in relations and unique_id not in refreshed
+        }
+        entries.update(fresh.get(section) or {})
+        merged[section] = entries
+    return merged
+
+
+def cache_record(
+    catalog: Mapping,
+    cached: Optional[Mapping],
+    relations: Mapping[str, Relation],
+    refreshed: Optional[List[str]],
+    now: float,
+) -> Dict:
+    """
+    Record of the merged catalog for the cache, along with when every relation was last looked up.
+    """
+    refreshed_at = {}
+    if refreshed is not None and cached is not None:
+        refreshed_at = {
+            unique_id: at
+            for unique_id, at in (cached.get("refreshed_at") or {}).items()
+            if unique_id in relations
+        }
+    for unique_id in relations if refreshed is None else refreshed:
+        refreshed_at[unique_id] = now
+    return {"catalog": dict(catalog), "refreshed_at": refreshed_at}
+
+
+def render_static_index(target_dir: str):
+    """
+    Render the static docs page from the docs page template, manifest and catalog in the target dir,
+    the same way 'dbt docs generate --static' does.
+    """
+    with open(os.path.join(target_dir, "index.html")) as f:
+        index = f.read()
+    with open(os.path.join(target_dir, "manifest.json")) as f:
+        index = index.replace('"MANIFEST.JSON INLINE DATA"', f.read())
+    with open(os.path.join(target_dir, "catalog.json")) as f:
+        index = index.replace('"CATALOG.JSON INLINE DATA"', f.read())
+    with open(os.path.join(target_dir, "static_index.html"), "w") as f:
+        f.write(index)
+
+
+class CatalogRefresh:
+    """
+    Incremental docs generation for one execution: which relations to look up,
+    and how to merge the fresh catalog with the cached one.
+
+    Parameters
+    ----------
+    cache: DBTCatalogCache
+        the catalog cache of the step.
+    manifest: Mapping
+        manifest of the execution.
+    run_results: Mapping, optional
+        run results of the execution. The relations that it built are always refreshed.
+    max_age: float
+        seconds after which cached entries are looked up again, see stale_relations.
+    """
+
+    def __init__(
+        self,
+        cache: "DBTCatalogCache",
+        manifest: Mapping,
+        run_results: Optional[Mapping],
+        max_age: float,
+    ):
+        self.cache = cache
+        self.now = time.time()
+        self.cached = cache.load()
+        self.relations = manifest_relations(manifest)
+        built = [r["unique_id"] for r in (run_results or {}).get("results", [])]
+        # None when the whole catalog is generated.
+        self.refreshed = stale_relations(
+            self.cached, self.relations, built, max_age, self.now
+        )
+        self.selector = (
+            refresh_selector(manifest, self.refreshed) if self.refreshed else None
+        )
+
+    def docs_args(self, models: Optional[str]) -> List[str]:
+        if self.refreshed is None:
+            args = ["--no-compile"]
+            if models is not None:
+                args.extend(["--models", models])
+            return args
+        if not self.refreshed:
+            # Nothing to look up, but dbt still writes the docs page and manifest.
+            return ["--no-compile", "--empty-catalog"]
+        # Only the nodes selected for compilation are looked up in the warehouse.
+        return ["--select", self.selector]
+
+    def merge(self, fresh: Mapping) -> Dict:
+        """
+        Merge the freshly generated catalog with the cached one, and update the cache.
+        """
+        catalog = merge_catalog(fresh, self.cached, self.relations, self.refreshed)
+        # Relations that failed to be looked up are not cached, so the next execution tries again.
+        if not fresh.get("errors"):
+            self.cache.save(
+                cache_record(
+                    catalog, self.cached, self.relations, self.refreshed, self.now
+                )
+            )
+        return catalog
+
+
+class DBTCatalogCache:
+    """
+    The catalog of a project, kept in the datastore so that docs generation only has to
+    look up the relations that changed since, instead of scanning the whole warehouse.
+
+    Parameters
+    ----------
+    datastore: DataStoreStorage
+        datastore rooted at the prefix of the step.
+    """
+
+    def __init__(self, datastore):
+        self.datastore = datastore
+
+    def load(self) -> Optional[Dict]:
+        with self.datastore.load_bytes([CACHE_FILE]) as result:
+            for _, file, _ in result:
+                if file is not None:
+                    with gzip.open(file, "rt") as f:
+                        return json.load(f)
+        return None
+
+    def save(self, record: Mapping):
+        with tempfile.TemporaryFile() as f:
+            f.write(gzip.compress(json.dumps(record).encode()))
+            f.seek(0)
+            self.datastore.save_bytes([(CACHE_FILE, f)], overwrite=True)
@@ -1,9 +1,22 @@
+import json
 import os
 import sys
 from metaflow.decorators import StepDecorator
 from metaflow.exception import MetaflowException
 
-from .dbt_executor import DBTExecutor, DBTProjectConfig
+try:
+    from metaflow.metadata_provider import MetaDatum
+except ImportError:
+    # Older Metaflow versions name the module metaflow.metadata.
+    from metaflow.metadata import MetaDatum
+
+
+# DBT commands that the decorator can execute.
+COMMANDS = ["run", "seed", "clone", "build", "test", "source freshness"]
+# Commands that can be gated on the freshness of the sources.
+FRESHNESS_GATED_COMMANDS = ["run", "build"]
+# Cards that the docs of the step can be shown with.
+DOCS_CARDS = ["static", "lineage"]
 
 
 class CommandNotSupported(MetaflowException):
@@ -18,6 +31,10 @@ class MissingStateStorage(MetaflowException):
     headline = "Missing DBT State Storage configuration"
 
 
+class DocsCardNotSupported(MetaflowException):
+    headline = "DBT docs card not supported"
+
+
 class DbtStepDecorator(StepDecorator):
     """
     Decorator to execute DBT models before a step execution begins.
@@ -27,7 +44,8 @@ class DbtStepDecorator(StepDecorator):
     ----------
     command: str, optional. Default 'run'
         DBT command to execute. Default is 'run'.
-        Supported commands are: run, seed
+        Supported commands are: run, seed, clone, build, test, source freshness
+        'clone' clones the selected nodes from the relations of the state given with 'defer_to'.
     project_dir: str, optional
         Path to the DBT project that contains a 'dbt_project.yml'.
         If not specified, the current folder and parent folders will be tried.
@@ -38,6 +56,94 @@ class DbtStepDecorator(StepDecorator):
         If not specified, it will use the default target from the profiles.
     profiles: Dict[str, Union[str, Dict]]
         a configuration dictionary that will be translated into a valid profiles.yml for the dbt CLI.
+    generate_docs: bool, optional. Default False
+        Generate the static DBT docs and make them available as a card.
+    docs_card: str, optional. Default 'static'
+        Card for the docs of the step. Supported cards are: static, lineage
+        'static' shows the full static docs page that generate_docs produces, stored as the 'static_index' artifact.
+        'lineage' renders a lightweight card from the manifest and run_results artifacts instead: the lineage
+        of the executed nodes and their status and timings, with the node details loaded on demand.
+        The lineage card does not require generate_docs, but includes the catalog columns when docs are generated.
+    background_docs: bool, optional. Default False
+        Generate the docs in a background dbt process once the command has finished, while the state is pushed
+        and the run artifacts are saved, instead of holding up the task until the docs are done.
+        The catalog (and static docs page) are saved as soon as the docs are generated.
+    docs_timeout: int, optional. Default 600
+        Seconds to wait for docs generated in the background, counted from when docs generation started.
+        The docs are skipped if generating them takes longer, f.ex. due to a slow catalog query, without failing the step.
+    catalog_cache: bool, optional. Default False
+        Keep the catalog of the docs in the datastore, and only look up the relations that the command built
+        (or that changed or were added since) when generating docs, instead of scanning the whole warehouse.
+        The cached entries are merged into the catalog artifact. Cached entries are looked up again after
+        METAFLOW_DBT_CATALOG_MAX_AGE seconds; as sources can only be looked up along with the whole catalog,
+        the whole catalog is generated then.
+    engine: str, optional. Default 'subprocess'
+        How DBT is executed. Supported engines are: subprocess, inprocess
+        'subprocess' calls the dbt CLI for every command, while 'inprocess' uses the programmatic runner of dbt-core
+        inside the task process, parsing the project only once per task.
+        Falls back to 'subprocess' if the installed dbt-core does not provide a programmatic runner.
+    partial_parse_cache: bool, optional. Default False
+        Persist the dbt partial parse file (partial_parse.msgpack) in the datastore and reuse it across tasks,
+        so consecutive executions can skip a full parse of the project.
+        The cache is keyed by the dbt version, project configuration, profiles and target.
+    stream_logs: bool, optional. Default False
+        Forward the dbt log to the task log while dbt is running, instead of printing the output once dbt finishes.
+        Only a bounded tail of the log and node events is kept in memory for reporting failures.
+    skip_empty: bool, optional. Default True
+        Skip invoking dbt when the selection is known to resolve to zero nodes, recording empty run results instead.
+        The selection is resolved against the previous state, and only when this can be done reliably.
+        Retries of the step always invoke dbt.
+    cache: bool, optional. Default False
+        Reuse the results of a previous successful execution of the step, if neither the project files,
+        profiles, target, selection nor the source watermark have changed since.
+        The artifacts of the previous execution are attached by reference, and dbt is not invoked.
+    source_watermark: Union[str, Callable[[], str]], optional
+        Value (or function returning a value) that changes whenever the source data changes,
+        f.ex. the latest load timestamp of the sources. Used as part of the cache fingerprint.
+    models_from_input: bool, optional. Default False
+        Use the foreach input of the step as the model selection, instead of 'models'.
+        Used for executing the shards of a selection in parallel, see plan_dbt_shards.
+    threads: Union[int, str], optional
+        Number of threads for dbt to use, overriding the threads of the profile.
+        With 'auto', the number is chosen at invocation time from the available CPUs
+        and the maximum parallel width of the selected part of the DAG.
+    max_threads: Union[int, Dict[str, int]], optional
+        Upper limit for threads='auto', f.ex. the concurrency limit of the warehouse.
+        Can be given per target as a dictionary.
+    retry_failed: bool, optional. Default True
+        When the step is retried (f.ex. with @retry), only execute the nodes that errored, failed or were skipped
+        in the failed attempt, along with their children. The run results of every attempt are kept in the datastore,
+        and the run_results artifact of the successful attempt includes the results of the earlier attempts.
+    state_prefix: str, optional
+        Location of the state of the step in the datastore, for state and result selectors.
+        Defaults to '<flow name>/<step name>', or '<project>.<branch>.<flow name>/<step name>' for flows with @project,
+        so that f.ex. user and test branches never replace the production state.
+        Set this to share the state between flows, or to keep separate states f.ex. per namespace.
+        Every execution publishes a new snapshot of the state; old snapshots are removed
+        according to METAFLOW_DBT_STATE_RETENTION.
+    defer_to: str, optional
+        State prefix of a production execution, f.ex. 'ProductionFlow/transform'.
+        State selectors are compared against the production state, and references to nodes outside
+        of the selection resolve to the production relations (dbt --defer), so only the selected models are built.
+        The state of the step itself is still stored under its own state prefix.
+    favor_state: bool, optional. Default False
+        Resolve references to the production relations even if the nodes exist in the target (dbt --favor-state).
+    freshness_gate: bool, optional. Default False
+        Check the freshness of the sources first, and only execute the selected nodes downstream of sources
+        that received new data since the last successful execution (source_status:fresher+).
+        Sources failing their freshness thresholds do not fail the step in this mode.
+        Everything is executed if no earlier freshness results are available. Supported with: run, build
+    install_deps: bool, optional. Default True
+        Install the dbt packages that the project declares (packages.yml or dependencies.yml) before the first command.
+        'dbt deps' is only invoked once for every version of the package declarations and dbt version:
+        the installed packages are stored in the datastore and unpacked by later tasks.
+        Packages that are already present in the project (f.ex. installed by hand) are used as they are.
+
+    The wall time, CPU time and peak memory of every phase of the step (state transfer, parsing,
+    dbt execution, artifact handling) are saved as the 'dbt_timings' artifact and as task metadata.
+    Set METAFLOW_DEBUG_DBTDEBUG=1 to print the phases as they happen.
+    The per-node timings of the run results are saved as the 'dbt_timing_table' artifact,
+    see load_dbt_timing_history and detect_dbt_regressions for comparing them across runs.
     """
 
     name = "_dbt"
@@ -49,6 +155,25 @@ class DbtStepDecorator(StepDecorator):
         "target": None,
         "profiles": None,
         "generate_docs": False,  # TODO: This could also be true by default
+        "docs_card": "static",
+        "background_docs": False,
+        "docs_timeout": 600,
+        "catalog_cache": False,
+        "engine": "subprocess",
+        "partial_parse_cache": False,
+        "stream_logs": False,
+        "skip_empty": True,
+        "cache": False,
+        "source_watermark": None,
+        "models_from_input": False,
+        "threads": None,
+        "max_threads": None,
+        "retry_failed": True,
+        "state_prefix": None,
+        "defer_to": None,
+        "favor_state": False,
+        "freshness_gate": False,
+        "install_deps": True,
         #  TODO: Add way to specify adapter through decorator as well.
     }
 
@@ -58,6 +183,7 @@ class DbtStepDecorator(StepDecorator):
     def step_init(
         self, flow, graph, step_name, decorators, environment, flow_datastore, logger
     ):
+        self.flow_datastore = flow_datastore
         if self.attributes["profiles"] is None and not os.path.exists("./profiles.yml"):
             raise MissingProfiles(
                 "You must provide profiles configuration for the DBT decorator.\n"
@@ -67,13 +193,40 @@ class DbtStepDecorator(StepDecorator):
 
         cmd = self.attributes["command"]
 
-        if cmd not in ["run", "seed"]:
+        if cmd not in COMMANDS:
             raise CommandNotSupported(f"command '{cmd}' is not supported.")
+        if self.attributes["freshness_gate"] and cmd not in FRESHNESS_GATED_COMMANDS:
+            raise CommandNotSupported(
+                f"command '{cmd}' can not be gated on source freshness."
+            )
+        if cmd == "clone" and not self.attributes["defer_to"]:
+            raise MissingStateStorage(
+                "The 'clone' command requires a state to clone from.\n"
+                "Provide the state prefix of the production execution with 'defer_to='"
+            )
+
+        docs_card = self.attributes["docs_card"]
+        if docs_card not in DOCS_CARDS:
+            raise DocsCardNotSupported(f"docs card '{docs_card}' is not supported.")
+
+        # The decorator is loaded along with metaflow, so the modules for executing DBT are only imported
+        # once a step with the decorator is initialized, keeping the startup of unrelated flows and commands fast.
+        from .dbt_executor import ENGINES, EngineNotSupported
+
+        engine = self.attributes["engine"]
+        if engine not in ENGINES:
+            raise EngineNotSupported(f"engine '{engine}' is not supported.")
 
         # Do we need persisted state due to the selectors or not?
-        self.use_state = self.attributes["models"] and any(
-            any(sel in val for val in self.attributes["models"])
-            for sel in ["result:", "state:"]
+        # Gating on freshness compares against the freshness results of the previous state.
+        self.use_state = bool(
+            self.attributes["defer_to"] or self.attributes["freshness_gate"]
+        ) or (
+            self.attributes["models"]
+            and any(
+                any(sel in val for val in self.attributes["models"])
+                for sel in ["result:", "state:"]
+            )
         )
 
     def task_pre_step(
@@ -90,66 +243,361 @@ class DbtStepDecorator(StepDecorator):
         ubf_context,
         inputs,
     ):
+        from .dbt_attempts import DBTAttemptStore, retryable
+        from .dbt_executor import DBTExecutor, get_datastore
+        from .dbt_memo import DBTStepMemo, step_fingerprint
+        from .dbt_timing import PhaseTimer
+
+        # Instrumentation of the phases of the step, saved as the dbt_timings artifact.
+        timer = PhaseTimer()
         # Fix for conda environments not being able to locate the dbt binary due to conda decorator extending PATH too late in the lifecycle.
         # TODO: try out task_decorate for execution instead in order to get rid of PATH fix.
-        python_loc = os.path.dirname(os.path.realpath(sys.executable))
-        original_path = os.environ.get("PATH")
-        if python_loc not in original_path:
-            os.environ["PATH"] = os.pathsep.join([python_loc, original_path])
+        with timer.phase("fix_path"):
+            python_loc = os.path.dirname(os.path.realpath(sys.executable))
+            original_path = os.environ.get("PATH")
+            if python_loc not in original_path:
+                os.environ["PATH"] = os.pathsep.join([python_loc, original_path])
 
         # We want to use a run and task independent prefix for the state store,
         # so that consecutive executions have a known location to look in for previous state
-        # TODO: cover projects.
-        state_prefix = f"{flow.name}/{step_name}"
-        executor = DBTExecutor(
-            models=self.attributes["models"],
-            project_dir=self.attributes["project_dir"],
-            target=self.attributes["target"],
-            profiles=self.attributes["profiles"],
-            state_prefix=state_prefix if self.use_state else None,
-            ds_type=task_datastore.TYPE,
+        # The prefix is scoped by the @project branch, and can be set explicitly f.ex. for namespaces.
+        state_prefix = self.attributes["state_prefix"] or _default_state_prefix(
+            flow, step_name
         )
+        models = self.attributes["models"]
+        if self.attributes["models_from_input"]:
+            models = [flow.input]
+        with timer.phase("init_executor"):
+            executor = DBTExecutor(
+                models=models,
+                project_dir=self.attributes["project_dir"],
+                target=self.attributes["target"],
+                profiles=self.attributes["profiles"],
+                state_prefix=state_prefix if self.use_state else None,
+                ds_type=task_datastore.TYPE,
+                engine=self.attributes["engine"],
+                partial_parse_cache=self.attributes["partial_parse_cache"],
+                stream_logs=self.attributes["stream_logs"],
+                threads=self.attributes["threads"],
+                max_threads=self.attributes["max_threads"],
+                timer=timer,
+                defer_prefix=self.attributes["defer_to"],
+                favor_state=self.attributes["favor_state"],
+                state_info={
+                    "pathspec": f"{flow.name}/{run_id}/{step_name}/{task_id}",
+                    "attempt": retry_count,
+                },
+                freshness_gate=self.attributes["freshness_gate"],
+                deps_cache=self.attributes["install_deps"],
+                catalog_prefix=(
+                    state_prefix if self.attributes["catalog_cache"] else None
+                ),
+            )
 
-        cmd = self.attributes["command"]
-        if cmd == "run":
-            out = executor.run()
-            print(out)
-        if cmd == "seed":
-            out = executor.seed()
-            print(out)
-
-        if self.attributes["generate_docs"]:
-            try:
-                # This might fail due to DBT version not supporting docs creation.
-                # We don't want to fail outright due to docs alone
-                out = executor.generate_docs()
-            except Exception:
-                print(out)
-                pass
-
-        # Write DBT run artifacts as task artifacts.
-        # TODO: If required, look into making this available *during* the task execution as well,
-        # by somehow making f.ex. self.run_results be persisted before the task initializes.
-        # As it is now, the run_results will only be available through self in subsequent steps,
-        # but not the one with the decorator.
-        # TODO: check out https://github.com/outerbounds/metaflow-pyspark for impl.
-        # TODO: don't hardcode artifacts if at all not necessary.
-        def _dbt_artifacts_iterable():
-            artifacts = {
-                "run_results": executor.run_results,
-                "semantic_manifest": executor.semantic_manifest,
-                "manifest": executor.manifest,
-                "sources": executor.sources,
-                "catalog": executor.catalog,
-                "static_index": executor.static_index,
-            }
-            for name, func in artifacts.items():
-                val = func()
-                if val is None:
-                    continue
+        # The timings are saved even if the results of an earlier execution are reused.
+        try:
+            self._memo = None
+            if self.attributes["cache"]:
+                self._memo = DBTStepMemo(
+                    get_datastore(task_datastore.TYPE, f"dbt_memo/{state_prefix}")
+                )
+                watermark = self.attributes["source_watermark"]
+                self._fingerprint = step_fingerprint(
+                    executor.project_file_hashes(),
+                    self.attributes["command"],
+                    executor.models,
+                    executor.dbt_version,
+                    str(watermark() if callable(watermark) else watermark),
+                    defer_to=self.attributes["defer_to"],
+                    generate_docs=self.attributes["generate_docs"],
+                    docs_card=self.attributes["docs_card"],
+                    defer_snapshot=executor.deferred_snapshot(),
+                )
+                self._run_id, self._task_id, self._attempt = (
+                    run_id,
+                    task_id,
+                    retry_count,
+                )
+                with timer.phase("lookup_memo"):
+                    record = self._memo.lookup(self._fingerprint)
+                if record is not None and self._reuse(
+                    record,
+                    task_datastore,
+                    metadata,
+                    run_id,
+                    step_name,
+                    task_id,
+                    retry_count,
+                ):
+                    # No need to record the execution again.
+                    self._memo = None
+                    return
+
+            attempts = None
+            if self.attributes["retry_failed"] and max_user_code_retries > 0:
+                attempts = DBTAttemptStore(
+                    get_datastore(
+                        task_datastore.TYPE,
+                        f"dbt_attempts/{flow.name}/{run_id}/{step_name}/{task_id}",
+                    )
+                )
+                if retry_count > 0:
+                    previous = attempts.latest(before=retry_count)
+                    if retryable(previous):
+                        print(
+                            "Retrying the DBT nodes that did not succeed in the previous attempt."
+                        )
+                        executor.retry(previous, attempts.manifest(before=retry_count))
+
+            self._execute(
+                executor,
+                attempts,
+                task_datastore,
+                metadata,
+                run_id,
+                step_name,
+                task_id,
+                retry_count,
+            )
+        finally:
+            task_datastore.save_artifacts([("dbt_timings", timer.to_dict())])
+            metadata.register_metadata(
+                run_id,
+                step_name,
+                task_id,
+                [
+                    MetaDatum(
+                        field=f"dbt-phase-{phase['phase'].replace(' ', '-')}",
+                        value=json.dumps(phase),
+                        type="dbt-phase-timing",
+                        tags=[f"attempt_id:{retry_count}"],
+                    )
+                    for phase in timer.phases
+                ],
+            )
+
+    def _execute(
+        self,
+        executor,
+        attempts,
+        task_datastore,
+        metadata,
+        run_id,
+        step_name,
+        task_id,
+        retry_count,
+    ):
+        from .dbt_executor import DBTExecutionFailed
+        from .dbt_graph import ManifestIndex
+        from .dbt_history import timing_table
+
+        timer = executor.timer
+        # Keep track of the saved artifacts, for reusing them in later executions.
+        self._artifact_names = []
+
+        def _recorded(iterable):
+            for name, val in iterable:
+                self._artifact_names.append(name)
                 yield (name, val)
 
-        task_datastore.save_artifacts(_dbt_artifacts_iterable())
+        # Docs generated in the background, if enabled.
+        docs = None
+        try:
+            # All commands of the task share one session, so that the previous state is pulled
+            # and the new state is pushed only once.
+            with executor.session():
+                cmd = self.attributes["command"]
+                if self.attributes["install_deps"]:
+                    with timer.phase("install_deps"):
+                        executor.install_deps()
+                if self.attributes["freshness_gate"]:
+                    out = executor.source_freshness(fail_on_error=False)
+                    if out:
+                        print(out)
+                # Resolve the selection against the previous state before launching dbt.
+                with timer.phase("resolve_selection"):
+                    selected = executor.resolve_selection(cmd)
+                if selected is not None:
+                    print(f"DBT selection resolves to {len(selected)} node(s)")
+                    _register_metadata(
+                        metadata,
+                        run_id,
+                        step_name,
+                        task_id,
+                        retry_count,
+                        "dbt-selected-nodes",
+                        str(len(selected)),
+                    )
+
+                try:
+                    if _skips_invocation(
+                        selected, self.attributes["skip_empty"], retry_count
+                    ):
+                        print("Nothing to execute. Skipping DBT invocation.")
+                        executor.skip(cmd)
+                    else:
+                        commands = {
+                            "run": executor.run,
+                            "seed": executor.seed,
+                            "clone": executor.clone,
+                            "build": executor.build,
+                            "test": executor.test,
+                            "source freshness": executor.source_freshness,
+                        }
+                        out = commands[cmd]()
+                        if out:
+                            print(out)
+                except DBTExecutionFailed:
+                    # Keep the results of the failed attempt, so a retry can continue from them.
+                    run_results = executor.run_results()
+                    if attempts is not None and run_results is not None:
+                        attempts.save(retry_count, run_results, executor.raw_manifest())
+                    raise
+
+                if executor.resolved_threads is not None:
+                    _register_metadata(
+                        metadata,
+                        run_id,
+                        step_name,
+                        task_id,
+                        retry_count,
+                        "dbt-threads",
+                        str(executor.resolved_threads),
+                    )
+
+                # The lineage card does not show the static page, so skip building it.
+                static_docs = self.attributes["docs_card"] == "static"
+                if (
+                    self.attributes["generate_docs"]
+                    and self.attributes["background_docs"]
+                ):
+                    # The docs are saved once the background process finishes, see below.
+                    docs = executor.start_docs(static=static_docs)
+                if self.attributes["generate_docs"] and docs is None:
+                    try:
+                        # This might fail due to DBT version not supporting docs creation.
+                        # We don't want to fail outright due to docs alone
+                        executor.generate_docs(static=static_docs)
+                    except Exception as ex:
+                        print(f"DBT docs generation failed: {ex}")
+
+                # Write DBT run artifacts as task artifacts.
+                # TODO: If required, look into making this available *during* the task execution as well,
+                # by somehow making f.ex. self.run_results be persisted before the task initializes.
+                # As it is now, the run_results will only be available through self in subsequent steps,
+                # but not the one with the decorator.
+                # TODO: check out https://github.com/outerbounds/metaflow-pyspark for impl.
+                # TODO: don't hardcode artifacts if at all not necessary.
+                # The json artifacts are stored compressed and only parsed when accessed, see DBTArtifact.
+                def _dbt_artifacts_iterable():
+                    artifacts = {
+                        "run_results": executor.run_results,
+                        "semantic_manifest": executor.semantic_manifest,
+                        "manifest": executor.manifest,
+                        "sources": executor.sources,
+                    }
+                    if docs is None:
+                        artifacts.update(_docs_artifacts(executor, static_docs))
+                    for name, func in artifacts.items():
+                        val = func()
+                        if val is None:
+                            continue
+                        yield (name, val)
+                        if name == "run_results":
+                            # Compact per-node timings, for comparing executions across runs. See load_dbt_timing_history.
+                            yield ("dbt_timing_table", timing_table(val))
+                        if name == "manifest":
+                            # Build the graph index once per task, so consumers do not need to walk the manifest themselves.
+                            # It is built along with the artifact, from the manifest that was parsed for it.
+                            yield (
+                                "manifest_index",
+                                (
+                                    val.graph
+                                    if val.graph is not None
+                                    else ManifestIndex.from_manifest(val)
+                                ),
+                            )
+
+                with timer.phase("read_artifacts"):
+                    artifacts = list(_recorded(_dbt_artifacts_iterable()))
+
+            # The state is pushed when leaving the session, while the docs are still being generated.
+            with timer.phase("save_artifacts"):
+                task_datastore.save_artifacts(artifacts)
+            if docs is None:
+                return
+
+            timeout = self.attributes["docs_timeout"]
+            with timer.phase("wait_docs"):
+                try:
+                    generated = docs.wait(timeout)
+                except Exception as ex:
+                    # f.ex. merging the catalog failed.
+                    print(f"DBT docs generation failed: {ex}")
+                    generated = False
+            if docs.timed_out:
+                print(f"DBT docs generation did not finish in {timeout} seconds.")
+            elif not generated:
+                # We don't want to fail outright due to docs alone
+                print(docs.output)
+            with timer.phase("save_docs"):
+                docs_artifacts = [
+                    (name, func())
+                    for name, func in _docs_artifacts(docs, static_docs).items()
+                ]
+                task_datastore.save_artifacts(
+                    list(_recorded((n, v) for n, v in docs_artifacts if v is not None))
+                )
+        finally:
+            if docs is not None:
+                docs.close()
+
+    def task_post_step(
+        self, step_name, flow, graph, retry_count, max_user_code_retries
+    ):
+        # Record the successful execution, so later executions with the same fingerprint can reuse it.
+        if self._memo is not None:
+            self._memo.record(
+                self._fingerprint,
+                self._run_id,
+                self._task_id,
+                self._attempt,
+                self._artifact_names,
+            )
+
+    def _reuse(
+        self, record, task_datastore, metadata, run_id, step_name, task_id, retry_count
+    ):
+        try:
+            origin = self.flow_datastore.get_task_datastore(
+                record["run_id"],
+                step_name,
+                record["task_id"],
+                attempt=record["attempt"],
+            )
+        except Exception:
+            # The recorded task is not available (anymore), so execute as usual.
+            return False
+        task_datastore.passdown_partial(origin, record["artifacts"])
+        origin_pathspec = "/".join(
+            [
+                self.flow_datastore.flow_name,
+                record["run_id"],
+                step_name,
+                record["task_id"],
+            ]
+        )
+        print(f"DBT project unchanged. Reusing results of {origin_pathspec}")
+        _register_metadata(
+            metadata,
+            run_id,
+            step_name,
+            task_id,
+            retry_count,
+            "dbt-reused-from",
+            origin_pathspec,
+        )
+        return True
 
     def add_to_package(self):
         """
@@ -163,9 +611,49 @@ class DbtStepDecorator(StepDecorator):
 
         Returns a list of tuples where each tuple represents (file_path, arcname)
         """
+        from .dbt_executor import DBTProjectConfig
+
         config = DBTProjectConfig(self.attributes["project_dir"])
         paths = config.project_file_paths()
 
-        # TODO: verify keys for possible collisions.
+        # The paths are normalized, so steps that refer to the same project differently (f.ex. './project' and 'project')
+        # do not add the same file under colliding names.
         files = [(path, path) for path in paths]
         return files
+
+
+def _skips_invocation(selected, skip_empty: bool, retry_count: int) -> bool:
+    # Whether dbt is not invoked, as the selection resolved to no nodes.
+    # A retry always invokes dbt, as the previous attempt failed to execute the selection.
+    return selected is not None and not selected and skip_empty and retry_count == 0
+
+
+def _docs_artifacts(source, static: bool):
+    # Artifacts produced by docs generation, read from the executor or from a background docs job.
+    artifacts = {"catalog": source.catalog}
+    if static:
+        artifacts["static_index"] = source.static_index
+    return artifacts
+
+
+def _default_state_prefix(flow, step_name):
+    from metaflow import current
+
+    # project_flow_name includes the project and branch, f.ex. 'myproject.prod.DBTFlow'
+    return f"{current.get('project_flow_name') or flow.name}/{step_name}"
+
+
+def _register_metadata(metadata, run_id, step_name, task_id, retry_count, field, value):
+    metadata.register_metadata(
+        run_id,
+        step_name,
+        task_id,
+        [
+            MetaDatum(
+                field=field,
+                value=value,
+                type=field,
+                tags=[f"attempt_id:{retry_count}"],
+            )
+        ],
+    )
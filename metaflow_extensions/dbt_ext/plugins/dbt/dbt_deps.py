@@ -0,0 +1,146 @@
+import hashlib
+import os
+import shutil
+import tarfile
+import tempfile
+from typing import List, Optional
+
+# Files that declare the packages of a project, and pin their versions.
+PACKAGE_FILES = ["packages.yml", "dependencies.yml", "package-lock.yml"]
+# Marker of the installed package tree, recording the key it was installed for.
+DEPS_MARKER = ".metaflow_dbt_deps"
+ARCHIVE_SUFFIX = ".tar.gz"
+
+
+def declares_packages(project_dir: Optional[str]) -> bool:
+    """
+    Whether the project declares any packages. A lock file alone does not declare packages.
+    """
+    return any(
+        os.path.exists(os.path.join(project_dir or "", name))
+        for name in PACKAGE_FILES
+        if name != "package-lock.yml"
+    )
+
+
+def deps_key(project_dir: Optional[str], dbt_version: str) -> Optional[str]:
+    """
+    Key of the installed packages of a project, or None if the project does not declare any packages.
+    """
+    sha = hashlib.sha256(dbt_version.encode())
+    declared = False
+    for name in PACKAGE_FILES:
+        path = os.path.join(project_dir or "", name)
+        if os.path.exists(path):
+            declared = declared or name != "package-lock.yml"
+            sha.update(name.encode())
+            with open(path, "rb") as f:
+                sha.update(f.read())
+    return sha.hexdigest() if declared else None
+
+
+def installed_key(packages_path: str) -> Optional[str]:
+    """
+    Key that the package tree at the path was installed with, if it was installed from the cache.
+    """
+    try:
+        with open(os.path.join(packages_path, DEPS_MARKER)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+class DBTDepsCache:
+    """
+    Installed dbt package trees, stored as compressed archives in the datastore.
+
+    Resolving packages with 'dbt deps' requires network access to the package hubs and git remotes,
+    so it is done once per key (the package declarations and the dbt version) and the result is
+    unpacked by every following task.
+
+    Parameters
+    ----------
+    datastore: DataStoreStorage
+        datastore rooted at the prefix of the cache.
+    """
+
+    def __init__(self, datastore):
+        self.datastore = datastore
+
+    def pull(self, key: str, packages_path: str) -> bool:
+        """
+        Unpack the package tree for the key into packages_path, replacing any existing tree.
+
+        Returns
+        -------
+        bool
+            Whether the key was found in the cache.
+        """
+        with self.datastore.load_bytes([key + ARCHIVE_SUFFIX]) as result:
+            for _, file, _ in result:
+                if file is None:
+                    return False
+                parent = os.path.dirname(os.path.abspath(packages_path))
+                os.makedirs(parent, exist_ok=True)
+                # Unpack next to the destination and swap it in, so an interrupted unpack never leaves a partial tree.
+                unpacked = tempfile.mkdtemp(dir=parent)
+                try:
+                    with tarfile.open(file, "r:gz") as tar:
+                        _extract(tar, unpacked)
+                    if os.path.exists(packages_path):
+                        shutil.rmtree(packages_path)
+                    os.rename(unpacked, packages_path)
+                finally:
+                    if os.path.exists(unpacked):
+                        shutil.rmtree(unpacked)
+        _write_marker(packages_path, key)
+        return True
+
+    def push(self, key: str, packages_path: str):
+        """
+        Store the package tree at packages_path for the key.
+        """
+        _write_marker(packages_path, key)
+        with tempfile.TemporaryDirectory() as tempdir:
+            archive = os.path.join(tempdir, key + ARCHIVE_SUFFIX)
+            with tarfile.open(archive, "w:gz") as tar:
+                for name in sorted(os.listdir(packages_path)):
+                    if name != DEPS_MARKER:
+                        tar.add(os.path.join(packages_path, name), arcname=name)
+            with open(archive, "rb") as f:
+                # Concurrent tasks resolve the same packages, so keep whichever was stored first.
+                self.datastore.save_bytes([(key + ARCHIVE_SUFFIX, f)], overwrite=False)
+
+
+def _write_marker(packages_path: str, key: str):
+    os.makedirs(packages_path, exist_ok=True)
+    with open(os.path.join(packages_path, DEPS_MARKER), "w") as f:
+        f.write(key)
+
+
+def _extract(tar: tarfile.TarFile, path: str):
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(path, filter="data")
+        return
+    # Older Python versions do not filter members, so refuse anything that would end up outside of the path.
+    root = os.path.realpath(path)
+
+    def _inside(target):
+        target = os.path.realpath(target)
+        return target == root or target.startswith(root + os.sep)
+
+    members: List[tarfile.TarInfo] = []
+    for member in tar.getmembers():
+        target = os.path.join(root, member.name)
+        if member.issym():
+            link = os.path.join(os.path.dirname(target), member.linkname)
+        elif member.islnk():
+            link = os.path.join(root, member.linkname)
+        else:
+            link = target
+        if not _inside(target) or not _inside(link):
+            raise tarfile.TarError(
+                f"Unsafe path in dbt packages archive: {member.name}"
+            )
+        members.append(member)
+    tar.extractall(path, members=members)
@@ -0,0 +1,90 @@
+import os
+import shutil
+import subprocess
+import time
+from typing import Callable, List, Optional
+
+from .dbt_artifacts import DBTArtifact
+
+
+class DBTDocsJob:
+    """
+    dbt docs generation running in a background process, see DBTExecutor.start_docs
+
+    The process writes to a target path inside its own working directory,
+    which is removed when the job is closed.
+
+    Parameters
+    ----------
+    command: List[str]
+        dbt CLI command to run
+    workdir: str
+        working directory of the job, holding its target path and copies of the profiles and state.
+    finish: Callable[[str], None], optional
+        called with the target path once the docs were generated successfully.
+    """
+
+    def __init__(
+        self,
+        command: List[str],
+        workdir: str,
+        finish: Optional[Callable[[str], None]] = None,
+    ):
+        self.workdir = workdir
+        self._finish = finish
+        self.started = time.monotonic()
+        self.output = ""
+        self.timed_out = False
+        self._proc = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the docs, at most until timeout seconds after the job was started.
+        The process is stopped if it does not finish in time.
+
+        Returns
+        -------
+        bool
+            Whether the docs were generated successfully.
+        """
+        remaining = None
+        if timeout is not None:
+            remaining = max(0.0, timeout - (time.monotonic() - self.started))
+        try:
+            # communicate drains the output as well, so a chatty process can not block on a full pipe.
+            self.output, _ = self._proc.communicate(timeout=remaining)
+        except subprocess.TimeoutExpired:
+            self.timed_out = True
+            self._proc.kill()
+            self.output, _ = self._proc.communicate()
+        succeeded = not self.timed_out and self._proc.returncode == 0
+        if succeeded and self._finish is not None:
+            self._finish(os.path.join(self.workdir, "target"))
+        return succeeded
+
+    def catalog(self) -> Optional[DBTArtifact]:
+        try:
+            return DBTArtifact.from_file(self._target_path("catalog.json"))
+        except FileNotFoundError:
+            return None
+
+    def static_index(self) -> Optional[str]:
+        try:
+            with open(self._target_path("static_index.html")) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def close(self):
+        if self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.communicate()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _target_path(self, name: str) -> str:
+        return os.path.join(self.workdir, "target", name)
@@ -2,23 +2,73 @@ import subprocess
 import os
 import tempfile
 import json
-import yaml
-import glob
+import hashlib
+import re
 import shutil
-from typing import Dict, List, Optional
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
 
 from metaflow.exception import MetaflowException
 from metaflow.util import which
-from metaflow.plugins.datatools.s3 import S3
+
+from .dbt_artifacts import DBTArtifact, ManifestArtifact
+from .dbt_attempts import merge_attempts, retry_selection
+from .dbt_cache import catalog_max_age, state_cache, state_retention
+from .dbt_catalog import CatalogRefresh, DBTCatalogCache, render_static_index
+from .dbt_deps import DBTDepsCache, declares_packages, deps_key, installed_key
+from .dbt_docs import DBTDocsJob
+from .dbt_graph import ManifestIndex, UnsupportedSelector
+from .dbt_logs import DBTLogCollector, event_callback
+from .dbt_selection import (
+    COMMAND_RESOURCE_TYPES,
+    PROJECT_FILES,
+    SelectionResolver,
+    UnresolvableSelection,
+    empty_run_results,
+    intersect_selection,
+    project_file_hashes,
+)
+from .dbt_state import DBTStateStore, file_sha256
+from .dbt_timing import PhaseTimer
+
+
+PARTIAL_PARSE_FILE = "partial_parse.msgpack"
+# Artifacts that make up the state of a previous execution, used by state and result selectors.
+STATE_FILES = ["manifest.json", "run_results.json", "sources.json", PROJECT_FILES]
+# Selector for the nodes downstream of sources that received new data since the previous state.
+FRESHNESS_SELECTORS = ["source_status:fresher+"]
+# Threads per available CPU for threads='auto'.
+AUTO_THREADS_PER_CPU = 4
+# Flags whose value is a node selection.
+SELECTION_FLAGS = ["--models", "--select", "--exclude"]
 
 
 class DBTExecutionFailed(MetaflowException):
     headline = "DBT Run execution failed"
 
 
-# TODO: There is a choice to utilize the Python library provided by DBT for performing the run, and accessing run results as well.
-# This would introduce a heavy dependency for the decorator use case, which can be completely avoided with the custom implementation
-# via calling the CLI via subprocess only at the point when execution needs to happen. Decide on the approach after PoC is complete.
+class EngineNotSupported(MetaflowException):
+    headline = "DBT execution engine not supported"
+
+
+# Supported ways of executing DBT commands.
+# subprocess: call the dbt CLI binary for every command. Only requires the binary to be present.
+# inprocess: drive dbt through its programmatic runner (dbt-core >= 1.5) inside the task process.
+#   This avoids an interpreter boot and a project parse for every command.
+ENGINES = ["subprocess", "inprocess"]
+
+
+def _inprocess_available():
+    try:
+        from dbt.cli.main import dbtRunner
+    except ImportError:
+        return False
+    return True
+
+
+# The subprocess engine calls the CLI only at the point when execution needs to happen, which avoids a heavy dependency
+# for the decorator use case. The inprocess engine uses the Python library provided by DBT instead, and is used
+# only when explicitly requested and available.
 class DBTExecutor:
     def __init__(
         self,
@@ -28,170 +78,1020 @@ class DBTExecutor:
         profiles: Dict = {},
         state_prefix: str = None,
         ds_type=None,
+        engine: str = "subprocess",
+        partial_parse_cache: bool = False,
+        stream_logs: bool = False,
+        threads=None,
+        max_threads=None,
+        timer: Optional[PhaseTimer] = None,
+        defer_prefix: str = None,
+        favor_state: bool = False,
+        state_info: Optional[Dict] = None,
+        freshness_gate: bool = False,
+        deps_cache: bool = False,
+        catalog_prefix: str = None,
     ):
         self.models = " ".join(models) if models is not None else None
+        # Instrumentation of the execution phases, see PhaseTimer
+        self.timer = timer or PhaseTimer()
         self.project_dir = project_dir
         self.target = target
+
+        if engine not in ENGINES:
+            raise EngineNotSupported(f"engine '{engine}' is not supported.")
+        if engine == "inprocess" and not _inprocess_available():
+            # Fall back to the CLI if the installed dbt does not ship the programmatic runner.
+            print(
+                "dbt programmatic runner not available. Falling back to subprocess engine."
+            )
+            engine = "subprocess"
+        self.engine = engine
+        self.stream_logs = stream_logs
+        # Bounded record of the most recent dbt log events, used for reporting failures when streaming.
+        self.log_collector = None
+        # Artifacts returned directly by the inprocess engine, keyed by their filename in the target dir.
+        self._artifacts = {}
+        # Parsed manifest that is shared between inprocess invocations, so the project is parsed only once.
+        self._manifest = None
+        # Index of the manifest of the previous state or execution, and the file it was read from. See _known_index()
+        self._manifest_index = None
+        self._manifest_index_key = None
+
         self.bin = which("./dbt") or which("dbt")
-        if self.bin is None:
+        # See the dbt_version property
+        self._dbt_version = None
+        if self.bin is None and self.engine == "subprocess":
             raise DBTExecutionFailed("Can not find DBT binary. Please install DBT")
 
+        # Number of dbt threads, or 'auto' for choosing the number at invocation time. See resolve_threads()
+        self.threads = threads
+        self.max_threads = max_threads
+        # The number of threads used for the last invocation, if set.
+        self.resolved_threads = None
+
         self.profiles = profiles
         conf = DBTProjectConfig(project_dir)
         self._project_config = conf.project_config
         self.datastore = None
+        self.defer_store = None
         self.state_prefix = state_prefix
+        # State prefix of a production execution to pull the state from instead, for deferring and cloning.
+        self.defer_prefix = defer_prefix
+        self.favor_state = favor_state
+        # Recorded with every published state snapshot, f.ex. the task that produced it.
+        self.state_info = state_info
+        # Only execute the nodes downstream of sources with new data, see source_freshness()
+        self.freshness_gate = freshness_gate
+        self._freshness_checked = False
         if self.state_prefix:
             self._init_datastore(ds_type)
 
+        # Working directory of the current session, see session()
+        self._session_dir = None
+        self._has_state = False
+        self._project_file_hashes = None
+        # Run results and manifest of a failed previous attempt, if this execution is a retry. See retry()
+        self._retry_results = None
+        self._retry_manifest = None
+
+        self.parse_datastore = None
+        # Hash of the partial parse file in self.parse_datastore as last pulled or pushed, an unchanged file is not pushed again.
+        self._stored_parse_sha = None
+        if partial_parse_cache:
+            self._init_parse_datastore(ds_type)
+
+        # Installed dbt packages, shared through the datastore. See install_deps()
+        self.deps_cache = None
+        if deps_cache and ds_type is not None:
+            self.deps_cache = DBTDepsCache(get_datastore(ds_type, "dbt_deps"))
+
+        # Catalog of earlier executions, for looking up only the changed relations when generating docs.
+        self.catalog_cache = None
+        if catalog_prefix and ds_type is not None:
+            self.catalog_cache = DBTCatalogCache(
+                get_datastore(ds_type, f"dbt_catalog/{catalog_prefix}")
+            )
+
+    def deferred_snapshot(self) -> Optional[str]:
+        """
+        Id of the snapshot of the deferred state, or None if not deferring or nothing was published to defer to.
+        """
+        if self.defer_store is None:
+            return None
+        return self.defer_store.snapshot_id()
+
     def _init_datastore(self, ds_type):
-        from metaflow.plugins import DATASTORES
+        self.datastore = get_datastore(ds_type, f"dbt_state/{self.state_prefix}")
+        self.state_store = DBTStateStore(
+            self.datastore, cache=state_cache(), retention=state_retention()
+        )
+        # The state is pushed to our own prefix, but pulled from the deferred one if set.
+        self.defer_store = None
+        if self.defer_prefix:
+            self.defer_store = DBTStateStore(
+                get_datastore(ds_type, f"dbt_state/{self.defer_prefix}"),
+                cache=state_cache(),
+            )
 
-        datastore = [d for d in DATASTORES if d.TYPE == ds_type][0]
+    def _init_parse_datastore(self, ds_type):
+        # The partial parse cache is keyed by everything that forces dbt to discard a partial parse file altogether.
+        # Changes to individual project files are detected by dbt itself, as the msgpack records a hash for every file.
+        key = self._partial_parse_key()
+        self.parse_datastore = get_datastore(ds_type, f"dbt_partial_parse/{key}")
 
-        root = datastore.get_datastore_root_from_config(print)
-        self.datastore = datastore(f"{root}/dbt_state/{self.state_prefix}")
+    @property
+    def dbt_version(self) -> str:
+        """
+        Version of the installed dbt-core. Looked up once per executor.
+        """
+        if self._dbt_version is None:
+            self._dbt_version = dbt_version(self.bin)
+        return self._dbt_version
+
+    def _partial_parse_key(self):
+        import yaml
+
+        sha = hashlib.sha256()
+        sha.update(self.dbt_version.encode())
+        sha.update(yaml.dump(self.profiles).encode())
+        sha.update(str(self.target).encode())
+        for name in ["dbt_project.yml", "packages.yml", "package-lock.yml"]:
+            path = os.path.join(self.project_dir or "", name)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    sha.update(f.read())
+        return sha.hexdigest()
 
-    def run_results(self) -> Optional[Dict]:
-        return self._read_dbt_artifact("run_results.json")
+    def run_results(self) -> Optional[DBTArtifact]:
+        run_results = self._read_dbt_artifact("run_results.json")
+        if self._retry_results is None:
+            return run_results
+        # Include the nodes that already succeeded in the previous attempts.
+        return DBTArtifact.from_dict(merge_attempts([self._retry_results, run_results]))
 
-    def semantic_manifest(self) -> Optional[Dict]:
+    def semantic_manifest(self) -> Optional[DBTArtifact]:
         return self._read_dbt_artifact("semantic_manifest.json")
 
-    def manifest(self) -> Optional[Dict]:
-        return self._read_dbt_artifact("manifest.json")
+    def manifest(self) -> Optional[ManifestArtifact]:
+        return self._read_dbt_artifact("manifest.json", cls=ManifestArtifact)
+
+    def raw_manifest(self) -> Optional[str]:
+        """
+        The manifest.json of the latest execution, as json without parsing it.
+        """
+        return self._read_dbt_artifact("manifest.json", raw=True)
 
-    def catalog(self) -> Optional[Dict]:
+    def catalog(self) -> Optional[DBTArtifact]:
         return self._read_dbt_artifact("catalog.json")
 
-    def sources(self) -> Optional[Dict]:
+    def sources(self) -> Optional[DBTArtifact]:
         return self._read_dbt_artifact("sources.json")
 
-    def static_index(self) -> Optional[Dict]:
+    def static_index(self) -> Optional[str]:
         return self._read_dbt_artifact("static_index.html", raw=True)
 
     def run(self) -> str:
-        args = ["--fail-fast"]
+        # The selection, threads and deferral depend on the state that the session pulls.
+        with self.session():
+            args = ["--fail-fast"]
+            if self.project_dir is not None:
+                args.extend(["--project-dir", self.project_dir])
+            if self._selection() is not None:
+                args.extend(["--models", self._selection()])
+            if self.target is not None:
+                args.extend(["--target", self.target])
+            args.extend(self._thread_args("run"))
+            args.extend(self._defer_args())
+
+            return self._call("run", args)
+
+    def seed(self) -> str:
+        with self.session():
+            args = []
+            if self.project_dir is not None:
+                args.extend(["--project-dir", self.project_dir])
+            if self._selection() is not None:
+                args.extend(["--models", self._selection()])
+            if self.target is not None:
+                args.extend(["--target", self.target])
+            args.extend(self._thread_args("seed"))
+            args.extend(self._defer_args())
+
+            return self._call("seed", args)
+
+    def install_deps(self) -> bool:
+        """
+        Install the dbt packages that the project declares, unless they are installed already.
+
+        The installed package tree is stored in the datastore, keyed by the package declarations and the dbt version,
+        so 'dbt deps' is only invoked once per key. Packages that were installed by other means are left as they are.
+
+        Returns
+        -------
+        bool
+            Whether 'dbt deps' was invoked.
+        """
+        # Asking the CLI for its version takes as long as starting up dbt, so check for packages first.
+        if not declares_packages(self.project_dir):
+            return False
+        key = deps_key(self.project_dir, self.dbt_version)
+        packages_path = os.path.join(
+            self.project_dir or "",
+            self._project_config.get("packages-install-path", "dbt_packages"),
+        )
+        installed = installed_key(packages_path)
+        if installed == key:
+            return False
+        if (
+            installed is None
+            and os.path.isdir(packages_path)
+            and os.listdir(packages_path)
+        ):
+            return False
+        if self.deps_cache is not None:
+            with self.timer.phase("pull_deps"):
+                if self.deps_cache.pull(key, packages_path):
+                    return False
+
+        args = []
         if self.project_dir is not None:
             args.extend(["--project-dir", self.project_dir])
-        if self.models is not None:
-            args.extend(["--models", self.models])
-        if self.target is not None:
-            args.extend(["--target", self.target])
+        # deps does not take a profile or state, and can not be parsed before the packages are installed,
+        # so it is not executed through _call.
+        with self.timer.phase("dbt deps"):
+            if self.engine == "inprocess":
+                from dbt.cli.main import dbtRunner
 
-        return self._call("run", args)
+                res = dbtRunner().invoke(["deps"] + args)
+                if not res.success:
+                    raise DBTExecutionFailed(
+                        msg=str(res.exception or "DBT deps failed")
+                    )
+            else:
+                out = self._call_subprocess("deps", args)
+                if out:
+                    print(out)
+        if self.deps_cache is not None:
+            with self.timer.phase("push_deps"):
+                self.deps_cache.push(key, packages_path)
+        return True
 
-    def seed(self) -> str:
+    def build(self) -> str:
+        with self.session():
+            args = ["--fail-fast"]
+            if self.project_dir is not None:
+                args.extend(["--project-dir", self.project_dir])
+            if self._selection() is not None:
+                args.extend(["--select", self._selection()])
+            if self.target is not None:
+                args.extend(["--target", self.target])
+            args.extend(self._thread_args("build"))
+            args.extend(self._defer_args())
+
+            return self._call("build", args)
+
+    def test(self) -> str:
+        with self.session():
+            args = []
+            if self.project_dir is not None:
+                args.extend(["--project-dir", self.project_dir])
+            if self._selection() is not None:
+                args.extend(["--select", self._selection()])
+            if self.target is not None:
+                args.extend(["--target", self.target])
+            args.extend(self._thread_args("test"))
+            args.extend(self._defer_args())
+
+            return self._call("test", args)
+
+    def source_freshness(self, fail_on_error: bool = True) -> str:
+        """
+        Check the freshness of the sources, writing the results to sources.json.
+
+        With fail_on_error=False, sources that fail their freshness thresholds do not fail the command,
+        as long as the results were written. This is used for gating the execution on source freshness.
+        """
         args = []
         if self.project_dir is not None:
             args.extend(["--project-dir", self.project_dir])
-        if self.models is not None:
-            args.extend(["--models", self.models])
+        if self.models is not None and not self.freshness_gate:
+            args.extend(["--select", self.models])
         if self.target is not None:
             args.extend(["--target", self.target])
 
-        return self._call("seed", args)
+        with self.session():
+            args.extend(self._thread_args("source freshness"))
+            # Do not mistake the results of an earlier local execution for the current ones.
+            results_path = self._target_path("sources.json")
+            if os.path.exists(results_path):
+                os.remove(results_path)
+            try:
+                out = self._call("source freshness", args)
+            except DBTExecutionFailed:
+                if fail_on_error or not os.path.exists(results_path):
+                    raise
+                print("Some sources did not pass their freshness checks.")
+                out = ""
+            self._freshness_checked = True
+            return out
 
-    def generate_docs(self) -> str:
+    def clone(self) -> str:
+        """
+        Clone the selected nodes from the relations of the deferred state into the target,
+        using zero-copy clones where the warehouse supports them.
+        """
+        with self.session():
+            if not self.defer_prefix or not self._has_state:
+                raise DBTExecutionFailed(
+                    msg=f"No state to clone from was found under '{self.defer_prefix}'."
+                )
+            args = []
+            if self.project_dir is not None:
+                args.extend(["--project-dir", self.project_dir])
+            if self._selection() is not None:
+                args.extend(["--models", self._selection()])
+            if self.target is not None:
+                args.extend(["--target", self.target])
+            args.extend(self._thread_args("clone"))
+
+            return self._call("clone", args)
+
+    def generate_docs(self, static: bool = True) -> str:
+        refresh = self._catalog_refresh()
+        # Docs generation does not produce state of its own, so do not let it replace the state of the previous command.
+        out = self._call("docs", self._docs_args(static, refresh), update_state=False)
+        self._merge_catalog(
+            refresh, os.path.dirname(self._target_path("catalog.json")), static
+        )
+        return out
+
+    def start_docs(self, static: bool = True) -> Optional[DBTDocsJob]:
+        """
+        Start generating the docs in a background dbt process, while the task carries on.
+
+        The process works in a directory of its own, with its own target path, so it does not touch
+        the artifacts of the session and can outlive it. Returns None if there is no dbt binary to run it with.
+        """
+        if self.bin is None:
+            return None
+        with self.session():
+            refresh = self._catalog_refresh()
+            workdir = tempfile.mkdtemp()
+            try:
+                args = self._docs_args(static, refresh) + [
+                    "--target-path",
+                    os.path.join(workdir, "target"),
+                ]
+                if self.profiles is not None:
+                    shutil.copy(
+                        os.path.join(self._session_dir, "profiles.yml"), workdir
+                    )
+                    args.extend(["--profiles-dir", workdir])
+                state_dir = None
+                if self._state_dir() is not None:
+                    state_dir = os.path.join(workdir, "state")
+                    shutil.copytree(self._state_dir(), state_dir)
+                args, state_args = self._state_args(args, state_dir)
+                # Start from the partial parse of the session, so the background process does not parse from scratch.
+                partial_parse = self._target_path(PARTIAL_PARSE_FILE)
+                if os.path.exists(partial_parse):
+                    os.makedirs(os.path.join(workdir, "target"))
+                    shutil.copy(partial_parse, os.path.join(workdir, "target"))
+                # The inprocess runner is not thread-safe, so the background process always uses the CLI.
+                return DBTDocsJob(
+                    [self.bin, "docs"] + args + state_args,
+                    workdir,
+                    finish=lambda target_dir: self._merge_catalog(
+                        refresh, target_dir, static
+                    ),
+                )
+            except Exception:
+                shutil.rmtree(workdir, ignore_errors=True)
+                raise
+
+    def _docs_args(
+        self, static: bool, refresh: Optional[CatalogRefresh] = None
+    ) -> List[str]:
         # The static docs generation requires dbt-core >= 1.7
-        args = ["generate", "--static", "--no-compile"]
+        args = ["generate"]
+        if static:
+            args.append("--static")
         if self.project_dir is not None:
             args.extend(["--project-dir", self.project_dir])
-        if self.models is not None:
-            args.extend(["--models", self.models])
+        if refresh is not None:
+            args.extend(refresh.docs_args(self.models))
+        else:
+            args.append("--no-compile")
+            if self.models is not None:
+                args.extend(["--models", self.models])
         if self.target is not None:
             args.extend(["--target", self.target])
+        return args
 
-        return self._call("docs", args)
+    def _catalog_refresh(self) -> Optional[CatalogRefresh]:
+        # The relations to look up when generating docs, if the catalog is cached.
+        if self.catalog_cache is None:
+            return None
+        manifest = self.manifest()
+        if manifest is None:
+            return None
+        with self.timer.phase("load_catalog_cache"):
+            return CatalogRefresh(
+                self.catalog_cache, manifest, self.run_results(), catalog_max_age()
+            )
 
-    def _read_dbt_artifact(self, name: str, raw: bool = False):
-        artifact = os.path.join(
-            ".",
-            self.project_dir or "",
-            self._project_config.get("target", "target"),
-            name,
+    def _merge_catalog(
+        self, refresh: Optional[CatalogRefresh], target_dir: str, static: bool
+    ):
+        # Complete the catalog of an incremental docs generation in target_dir with the cached entries.
+        if refresh is None:
+            return
+        path = os.path.join(target_dir, "catalog.json")
+        fresh = _read_json(path)
+        if fresh is None:
+            # Docs generation failed.
+            return
+        with self.timer.phase("merge_catalog"):
+            catalog = refresh.merge(fresh)
+            with open(path, "w") as f:
+                json.dump(catalog, f)
+            if "catalog.json" in self._artifacts:
+                self._artifacts["catalog.json"] = catalog
+            if static and refresh.refreshed is not None:
+                # The page that dbt rendered only embeds the fresh part of the catalog.
+                render_static_index(target_dir)
+
+    def retry(self, run_results: Dict, manifest: Optional[str] = None):
+        """
+        Narrow the selection of the following run and seed commands down to the nodes
+        that did not succeed in a failed previous attempt, given its run results
+        and the raw content of its manifest.json, if recorded.
+        """
+        self._retry_results = run_results
+        self._retry_manifest = manifest
+
+    def _selection(self) -> Optional[str]:
+        # The selection to execute, narrowed down to the unfinished nodes when retrying,
+        # or to the nodes downstream of sources with new data when gating on freshness.
+        if self._retry_results is not None:
+            return retry_selection(self.models)
+        if self._freshness_gated():
+            return intersect_selection(self.models, FRESHNESS_SELECTORS)
+        return self.models
+
+    def _freshness_gated(self) -> bool:
+        # Comparing freshness requires the results of this session and of the previous state.
+        # Without previous results (f.ex. on the first execution), everything is executed.
+        state_dir = self._state_dir()
+        return (
+            self.freshness_gate
+            and self._freshness_checked
+            and state_dir is not None
+            and os.path.exists(os.path.join(state_dir, "sources.json"))
+        )
+
+    def _state_dir(self) -> Optional[str]:
+        # Directory of the state for state and result selectors in the current session, if any.
+        if self._session_dir is None:
+            return None
+        if self._retry_results is not None:
+            return os.path.join(self._session_dir, "retry_state")
+        if self._has_state:
+            return os.path.join(self._session_dir, "prev_state")
+        return None
+
+    def _write_retry_state(self) -> bool:
+        # The previous state, with the run results replaced by those of the failed attempt,
+        # so that result selectors pick the unfinished nodes.
+        # Without a previous state, the manifest of the failed attempt is used, as dbt requires a manifest in the state.
+        # It is the recorded one, as the failed attempt may have run elsewhere, f.ex. in another container.
+        retry_state = os.path.join(self._session_dir, "retry_state")
+        if self._has_state:
+            shutil.copytree(os.path.join(self._session_dir, "prev_state"), retry_state)
+        elif self._retry_manifest is not None:
+            os.makedirs(retry_state)
+            with open(os.path.join(retry_state, "manifest.json"), "w") as f:
+                f.write(self._retry_manifest)
+        elif os.path.exists(self._target_path("manifest.json")):
+            os.makedirs(retry_state)
+            shutil.copy(self._target_path("manifest.json"), retry_state)
+        else:
+            return False
+        with open(os.path.join(retry_state, "run_results.json"), "w") as f:
+            json.dump(self._retry_results, f)
+        return True
+
+    def resolve_selection(self, cmd: str) -> Optional[Set[str]]:
+        """
+        Resolve the nodes that the command would execute against the previous state, without invoking dbt.
+
+        Returns None if the selection can not be resolved reliably,
+        f.ex. when no previous state is available or the selectors are not supported.
+        """
+        state_dir = self._state_dir()
+        if state_dir is None or self._selection() is None:
+            return None
+        index = self._known_index()
+        if index is None:
+            return None
+        previous_files = None
+        if os.path.exists(os.path.join(state_dir, PROJECT_FILES)):
+            with open(os.path.join(state_dir, PROJECT_FILES)) as f:
+                previous_files = json.load(f)
+        run_results = _read_json(os.path.join(state_dir, "run_results.json"))
+
+        resolver = SelectionResolver(
+            index,
+            run_results,
+            previous_files,
+            self.project_file_hashes(),
+            sources=_read_json(self._target_path("sources.json")),
+            previous_sources=_read_json(os.path.join(state_dir, "sources.json")),
+        )
+        try:
+            return resolver.resolve(self._selection(), COMMAND_RESOURCE_TYPES.get(cmd))
+        except UnresolvableSelection:
+            return None
+
+    def resolve_threads(self, cmd: str) -> Optional[int]:
+        """
+        Number of threads to execute the command with.
+
+        With threads='auto', the number is chosen from the available CPUs, the maximum width of the
+        DAG layers of the selection and an optional cap for the target (max_threads).
+        The DAG is read from the manifest of the previous state or of a previous local execution,
+        and only the CPU based limit applies when neither is available.
+        """
+        if self.threads != "auto":
+            return self.threads
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            # not available on all platforms
+            cpus = os.cpu_count() or 1
+        # dbt threads mostly wait on the warehouse, so allow several threads per CPU.
+        threads = cpus * AUTO_THREADS_PER_CPU
+
+        width = self._selection_width(cmd)
+        if width:
+            threads = min(threads, width)
+
+        cap = self.max_threads
+        if isinstance(cap, dict):
+            cap = cap.get(self._target_name())
+        if cap:
+            threads = min(threads, cap)
+        return max(1, threads)
+
+    def _target_name(self) -> Optional[str]:
+        # The target that dbt executes against: the given one, or else the default target of the profile of the project.
+        if self.target is not None:
+            return self.target
+        profile = (self.profiles or {}).get(self._project_config.get("profile"))
+        return (profile or {}).get("target")
+
+    def _selection_width(self, cmd: str) -> Optional[int]:
+        index = self._known_index()
+        if index is None:
+            return None
+        resource_types = COMMAND_RESOURCE_TYPES.get(cmd)
+        selected = self.resolve_selection(cmd)
+        if selected is None:
+            try:
+                selected = (
+                    index.select(self._selection())
+                    if self._selection()
+                    else set(index.unique_ids)
+                )
+            except UnsupportedSelector:
+                selected = set(index.unique_ids)
+        selected = [
+            unique_id
+            for unique_id in selected
+            if resource_types is None
+            or index.attribute(unique_id, "resource_type") in resource_types
+        ]
+        layers = index.topological_layers(selected)
+        return max((len(layer) for layer in layers), default=None)
+
+    def _known_index(self) -> Optional[ManifestIndex]:
+        # Index of the manifest of the previous state (or of the failed attempt when retrying) if available,
+        # or of a previous local execution.
+        # Parsing a large manifest takes a while, so the index is reused until the manifest changes.
+        paths = [self._target_path("manifest.json")]
+        state_dir = self._state_dir()
+        if state_dir is not None:
+            paths.insert(0, os.path.join(state_dir, "manifest.json"))
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            key = (path, stat.st_mtime_ns, stat.st_size)
+            if key != self._manifest_index_key:
+                with open(path) as f:
+                    self._manifest_index = ManifestIndex.from_manifest(json.load(f))
+                self._manifest_index_key = key
+            return self._manifest_index
+        return None
+
+    def _defer_args(self) -> List[str]:
+        # Resolve references to nodes outside of the selection to the relations of the deferred state.
+        if not self.defer_prefix:
+            return []
+        if not self._has_state:
+            print(
+                f"No state to defer to was found under '{self.defer_prefix}'. Executing without deferral."
+            )
+            return []
+        args = ["--defer"]
+        if self.favor_state:
+            args.append("--favor-state")
+        return args
+
+    def _thread_args(self, cmd: str) -> List[str]:
+        self.resolved_threads = self.resolve_threads(cmd)
+        if self.resolved_threads is None:
+            return []
+        return ["--threads", str(self.resolved_threads)]
+
+    def skip(self, cmd: str):
+        """
+        Skip executing the command, f.ex. when the selection is known to be empty.
+        Records empty run results, and keeps the previous state as the current one.
+        """
+        args = ["--models", self._selection()] if self._selection() is not None else []
+        self._artifacts["run_results.json"] = empty_run_results(
+            cmd, args, self.dbt_version
         )
+        if self._session_dir and self._has_state:
+            snapshot_path = os.path.join(self._session_dir, "next_state")
+            os.makedirs(snapshot_path, exist_ok=True)
+            prev_state = os.path.join(self._session_dir, "prev_state")
+            for name in os.listdir(prev_state):
+                if name == "sources.json" and self._freshness_checked:
+                    # Keep the freshness results of this session.
+                    continue
+                shutil.copy(
+                    os.path.join(prev_state, name), os.path.join(snapshot_path, name)
+                )
+
+    def project_file_hashes(self) -> Dict[str, str]:
+        """
+        Content hashes of the project files and the profile configuration.
+        """
+        import yaml
+
+        if self._project_file_hashes is None:
+            config = hashlib.sha256(
+                (yaml.dump(self.profiles) + str(self.target)).encode()
+            ).hexdigest()
+            self._project_file_hashes = project_file_hashes(
+                DBTProjectConfig(self.project_dir).project_file_paths(),
+                self.project_dir,
+                config,
+            )
+        return self._project_file_hashes
+
+    def _read_dbt_artifact(self, name: str, raw: bool = False, cls=DBTArtifact):
+        # Json artifacts are kept compressed and parsed lazily on access, see DBTArtifact
+        if name in self._artifacts:
+            if raw:
+                return json.dumps(self._artifacts[name])
+            return cls.from_dict(self._artifacts[name])
+        artifact = self._state_file_path(name) or self._target_path(name)
         try:
-            with open(artifact) as m:
-                return m.read() if raw else json.load(m)
+            if raw:
+                with open(artifact) as m:
+                    return m.read()
+            return cls.from_file(artifact)
         except FileNotFoundError:
             return None
 
-    def _push_state(self):
+    def _snapshot_state(self):
+        snapshot_path = os.path.join(self._session_dir, "next_state")
+        os.makedirs(snapshot_path, exist_ok=True)
+        for key in STATE_FILES:
+            path = self._target_path(key)
+            if os.path.exists(path):
+                shutil.copy(path, os.path.join(snapshot_path, key))
+        if self.datastore:
+            # Record the project files that produced the state, for resolving state selectors without dbt.
+            with open(os.path.join(snapshot_path, PROJECT_FILES), "w") as f:
+                json.dump(self.project_file_hashes(), f)
+
+    def _state_file_path(self, name):
+        # Path to the state file of the last state producing command in the current session, if any.
+        if self._session_dir is None:
+            return None
+        path = os.path.join(self._session_dir, "next_state", name)
+        return path if os.path.exists(path) else None
+
+    def _push_state(self, succeeded: bool):
         # Push new state to self.datastore if configured
         if not self.datastore:
             return
         files_and_paths = {
-            key: os.path.join(
-                ".",
-                self.project_dir or "",
-                self._project_config.get("target", "target"),
-                key,
-            )
-            for key in ["manifest.json", "run_results.json"]
-        }
-        files_and_handles = {
-            key: open(path, mode="rb")
-            for key, path in files_and_paths.items()
-            if os.path.exists(path)
+            key: self._state_file_path(key)
+            for key in STATE_FILES
+            if self._state_file_path(key) is not None
         }
+        # The state of failed executions is published as well, as result selectors rely on its run results.
+        # It does not become the baseline for state selectors though, see DBTStateStore.
+        # Their freshness results are not published, so that data that arrived since the last successful execution
+        # still counts as new for source_status:fresher selectors.
+        if not succeeded:
+            files_and_paths.pop("sources.json", None)
+        info = dict(self.state_info or {}, status="success" if succeeded else "failed")
+        self.state_store.push(files_and_paths, info=info, succeeded=succeeded)
+
+    def _push_partial_parse(self):
+        # Push the partial parse file to self.parse_datastore if configured
+        if not self.parse_datastore:
+            return
+        path = self._target_path(PARTIAL_PARSE_FILE)
+        if not os.path.exists(path):
+            return
+        sha = file_sha256(path)
+        if sha == self._stored_parse_sha:
+            # dbt reused the pulled file as it is, which is the case whenever the project did not change.
+            return
+        with open(path, mode="rb") as f:
+            self.parse_datastore.save_bytes([(PARTIAL_PARSE_FILE, f)], overwrite=True)
+        self._stored_parse_sha = sha
+
+    def _pull_partial_parse(self):
+        # Fetch a previous partial parse file to the target dir if one is not present already.
+        # A missing file results in a cold parse, so this is always safe.
+        if not self.parse_datastore:
+            return
+        path = self._target_path(PARTIAL_PARSE_FILE)
+        if os.path.exists(path):
+            return
+        with self.parse_datastore.load_bytes([PARTIAL_PARSE_FILE]) as result:
+            for _, file, _ in result:
+                if file is not None:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    shutil.copy(file, path)
+                    self._stored_parse_sha = file_sha256(path)
 
-        self.datastore.save_bytes(
-            (name, content) for name, content in files_and_handles.items()
+    def _target_path(self, name):
+        return os.path.join(
+            ".",
+            self.project_dir or "",
+            self._project_config.get("target", "target"),
+            name,
         )
 
     def _pull_state(self, tempdir):
         # Fetch previous state to tempdir from self.datastore if configured
         if not self.datastore:
             return
-        with self.datastore.load_bytes(["manifest.json", "run_results.json"]) as result:
-            for key, file, _ in result:
-                if file is not None:
-                    shutil.move(file, os.path.join(tempdir, key))
+        (self.defer_store or self.state_store).pull(tempdir, STATE_FILES)
+
+    @contextmanager
+    def session(self):
+        """
+        Context for executing one or more DBT commands with a shared working directory.
+
+        The profiles are written and the previous state is pulled only once when entering the session,
+        and the new state is pushed only once when exiting it.
+        Commands called outside of a session run in a session of their own.
+        """
+        import yaml
+
+        if self._session_dir is not None:
+            # Already inside a session, so reuse it.
+            yield self
+            return
 
-    def _call(self, cmd, args):
-        # Synthesize a profiles.yml from the passed in config dictionary if present.
         with tempfile.TemporaryDirectory() as tempdir:
+            self._session_dir = tempdir
+            succeeded = False
+            try:
+                # Synthesize a profiles.yml from the passed in config dictionary if present.
+                if self.profiles is not None:
+                    with self.timer.phase("write_profiles"):
+                        with open(os.path.join(tempdir, "profiles.yml"), "w") as f:
+                            f.write(yaml.dump(self.profiles))
+
+                # If datastore is configured, we intend to use a previous state.
+                if self.datastore:
+                    with self.timer.phase("pull_state"):
+                        state_path = os.path.join(tempdir, "prev_state")
+                        os.makedirs(state_path)
+                        self._pull_state(state_path)
+                        self._has_state = bool(os.listdir(state_path))
+
+                if self._retry_results is not None and not self._write_retry_state():
+                    print(
+                        "No manifest of the failed attempt is available. Executing the whole selection again."
+                    )
+                    self._retry_results = None
+
+                if self.parse_datastore:
+                    with self.timer.phase("pull_partial_parse"):
+                        self._pull_partial_parse()
+                yield self
+                succeeded = True
+            finally:
+                # Push state artifacts to self.datastore
+                if self.datastore:
+                    with self.timer.phase("push_state"):
+                        self._push_state(succeeded)
+                if self.parse_datastore:
+                    with self.timer.phase("push_partial_parse"):
+                        self._push_partial_parse()
+                self._session_dir = None
+                self._has_state = False
+
+    def _call(self, cmd, args, update_state=True):
+        with self.session():
             profile_args = []
             if self.profiles is not None:
-                conf = yaml.dump(self.profiles)
-                f = open(os.path.join(tempdir, "profiles.yml"), "w")
-                f.write(conf)
-                f.close()
-                profile_args = ["--profiles-dir", tempdir]
-
-            state_args = []
-            # If datastore is configured, we intend to use a previous state.
-            if self.datastore:
-                state_path = os.path.join(tempdir, "prev_state")
-                os.makedirs(state_path)
-                self._pull_state(state_path)
-                if os.listdir(state_path):
-                    # a previous state was available.
-                    state_args = ["--state", state_path]
-                else:
-                    # we do not have a previous state,
-                    # so we need to clean up any known state selectors from args in order to avoid errors.
-                    def _cleanup(arg: str):
-                        # TODO: Add debug message.
-                        split = arg.split(",")
-                        args = [
-                            a for a in split if not "state:" in a and not "result:" in a
-                        ]
-                        return ",".join(args)
-
-                    args = [_cleanup(arg) for arg in args]
+                profile_args = ["--profiles-dir", self._session_dir]
+
+            args, state_args = self._state_args(args)
+            args = _split_selection(args)
 
             try:
-                return subprocess.check_output(
-                    [self.bin, cmd] + args + profile_args + state_args,
-                    stderr=subprocess.PIPE,
-                ).decode()
-            except subprocess.CalledProcessError as e:
-                raise DBTExecutionFailed(msg=e.output.decode())
+                with self.timer.phase(f"dbt {cmd}"):
+                    if self.engine == "inprocess":
+                        return self._call_inprocess(
+                            cmd, args + profile_args + state_args
+                        )
+                    return self._call_subprocess(cmd, args + profile_args + state_args)
             finally:
-                # Push state artifacts to self.datastore
-                self._push_state()
+                # Keep the state produced by this command, so later commands in the session
+                # (f.ex. docs generation) do not overwrite it before it is pushed.
+                if update_state:
+                    self._snapshot_state()
+
+    def _state_args(self, args: List[str], state_dir: Optional[str] = None):
+        # The args of a command, along with the args for the state to compare against.
+        if self._state_dir() is not None:
+            # a previous state (or the run results of a failed attempt) was available.
+            return args, ["--state", state_dir or self._state_dir()]
+        if self.datastore:
+            # we do not have a previous state,
+            # so we need to clean up any known state selectors from args in order to avoid errors.
+            def _cleanup(arg: str):
+                # TODO: Add debug message.
+                split = arg.split(",")
+                args = [a for a in split if not "state:" in a and not "result:" in a]
+                return ",".join(args)
+
+            args = [_cleanup(arg) for arg in args]
+        return args, []
+
+    def _call_subprocess(self, cmd, args):
+        if self.stream_logs:
+            return self._call_streaming(cmd, args)
+        try:
+            return subprocess.check_output(
+                [self.bin] + cmd.split() + args,
+                stderr=subprocess.PIPE,
+            ).decode()
+        except subprocess.CalledProcessError as e:
+            raise DBTExecutionFailed(msg=e.output.decode())
+
+    def _call_streaming(self, cmd, args):
+        # Forward the structured log lines of dbt to the task log as they arrive,
+        # instead of buffering the whole output until the process exits.
+        self.log_collector = DBTLogCollector()
+        proc = subprocess.Popen(
+            [self.bin, "--log-format", "json"] + cmd.split() + args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        with proc.stdout:
+            for line in proc.stdout:
+                self.log_collector.process_line(line)
+        if proc.wait() != 0:
+            raise DBTExecutionFailed(msg=self.log_collector.summary())
+        return ""
+
+    def _call_inprocess(self, cmd, args):
+        from dbt.cli.main import dbtRunner
+
+        callbacks = []
+        if self.stream_logs:
+            # dbt already writes its log to stdout when running in-process, so only collect events here.
+            self.log_collector = DBTLogCollector(echo=None)
+            callbacks.append(event_callback(self.log_collector))
+
+        if self._manifest is None:
+            # Parse once and reuse the manifest for all following commands.
+            # Parsing also writes the manifest.json to the target dir for state purposes.
+            with self.timer.phase("dbt parse"):
+                res = dbtRunner(callbacks=callbacks).invoke(
+                    ["parse"] + _parse_args(args)
+                )
+            if not res.success:
+                raise DBTExecutionFailed(msg=str(res.exception or "DBT parse failed"))
+            self._manifest = res.result
+            self._collect_inprocess_result(res.result)
+
+        res = dbtRunner(manifest=self._manifest, callbacks=callbacks).invoke(
+            cmd.split() + args
+        )
+        # Collect results before checking for success, so run results of failed nodes are available as well.
+        self._collect_inprocess_result(res.result)
+        if res.exception is not None:
+            raise DBTExecutionFailed(msg=str(res.exception))
+        if not res.success:
+            msg = f"DBT {cmd} finished with errors."
+            if self.log_collector is not None:
+                msg = "\n".join([msg, self.log_collector.summary()])
+            raise DBTExecutionFailed(msg=msg)
+        return ""
+
+    def _collect_inprocess_result(self, result):
+        # Translate the result objects of dbt into the same dictionaries that the json artifacts would contain.
+        from dbt.contracts.graph.manifest import Manifest
+        from dbt.contracts.results import (
+            CatalogArtifact,
+            RunExecutionResult,
+            RunResultsArtifact,
+        )
+
+        if isinstance(result, Manifest):
+            self._artifacts["manifest.json"] = result.writable_manifest().to_dict(
+                omit_none=False
+            )
+        elif isinstance(result, RunExecutionResult):
+            self._artifacts[
+                "run_results.json"
+            ] = RunResultsArtifact.from_execution_results(
+                results=result.results,
+                elapsed_time=result.elapsed_time,
+                generated_at=result.generated_at,
+                args=result.args,
+            ).to_dict(
+                omit_none=False
+            )
+        elif isinstance(result, CatalogArtifact):
+            self._artifacts["catalog.json"] = result.to_dict(omit_none=False)
+
+
+def get_datastore(ds_type, prefix):
+    """
+    Datastore of the given type, rooted at prefix under the configured datastore root.
+    """
+    from metaflow.plugins import DATASTORES
+
+    datastore = [d for d in DATASTORES if d.TYPE == ds_type][0]
+
+    root = datastore.get_datastore_root_from_config(print)
+    return datastore(f"{root}/{prefix}")
+
+
+def dbt_version(bin=None):
+    # Prefer the installed package metadata for the version, as it avoids starting up the CLI and importing dbt.
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("dbt-core")
+    except PackageNotFoundError:
+        pass
+    if bin is None:
+        return "unknown"
+    out = subprocess.check_output([bin, "--version"], stderr=subprocess.PIPE).decode()
+    # The rest of the output changes over time, f.ex. the latest available version and the installed plugins,
+    # so only the installed version of dbt-core is used.
+    match = re.search(r"installed(?: version)?:\s*(\S+)", out)
+    return match.group(1) if match else "unknown"
+
+
+def _split_selection(args: List[str]) -> List[str]:
+    # Pass every part of a selection union as an argument of its own, as a single argument is limited to 128 KiB
+    # on Linux, which the selectors of large shards can exceed.
+    split = []
+    for i, arg in enumerate(args):
+        if i > 0 and args[i - 1] in SELECTION_FLAGS:
+            split.extend(arg.split() or [arg])
+        else:
+            split.append(arg)
+    return split
+
+
+def _read_json(path: str) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _parse_args(args: List[str]):
+    # Only a subset of the command arguments are applicable to 'dbt parse'
+    parse_flags = ["--project-dir", "--profiles-dir", "--target"]
+    return [
+        val
+        for i, val in enumerate(args)
+        if val in parse_flags or (i > 0 and args[i - 1] in parse_flags)
+    ]
 
 
 # We want a separate construct for the project config, so this can be parsed without requiring the dbt binary to be present on the system.
@@ -199,14 +1099,22 @@ class DBTExecutor:
 class DBTProjectConfig:
     def __init__(self, project_dir: str = None):
         self.project_dir = project_dir
+        self._config = None
+        self._config_mtime = None
 
     @property
     def project_config(self):
+        import yaml
+
         config_path = os.path.join(self.project_dir or "./", "dbt_project.yml")
 
         try:
-            with open(config_path) as f:
-                return yaml.load(f, Loader=yaml.Loader)
+            mtime = os.stat(config_path).st_mtime_ns
+            if self._config is None or mtime != self._config_mtime:
+                with open(config_path) as f:
+                    self._config = yaml.load(f, Loader=yaml.Loader)
+                self._config_mtime = mtime
+            return self._config
         except FileNotFoundError:
             raise MetaflowException("No configuration file 'dbt_project.yml' found")
 
@@ -214,34 +1122,105 @@ class DBTProjectConfig:
         """
         Return a list of files required for the DBT project.
         Used to include necessary files in the codepackage
+
+        The discovered files are shared by all instances for the same project dir,
+        and discovered again only if the project configuration or any of the walked directories changed.
         """
-        files = []
-        _inc = [
+        key = (os.path.abspath(self.project_dir or "."), os.getcwd())
+        cached = _project_files_cache.get(key)
+        if cached is None or not _unchanged(cached[0]):
+            cached = self._discover_files()
+            _project_files_cache[key] = cached
+        return list(cached[1])
+
+    def _discover_files(self):
+        root = os.path.normpath(self.project_dir or ".")
+        config_path = os.path.normpath(os.path.join(root, "dbt_project.yml"))
+        config = self.project_config
+        # Modification times of the config and the directories that were walked.
+        # A directory changes when files are added to or removed from it.
+        mtimes = {
+            config_path: os.stat(config_path).st_mtime_ns,
+            root: os.stat(root).st_mtime_ns,
+            ".": os.stat(".").st_mtime_ns,
+        }
+        files = [
             f
-            for f in [
-                "./profiles.yml",
-                os.path.join(self.project_dir or "", "dbt_project.yml"),
+            for f in ["profiles.yml"]
+            + [
+                os.path.normpath(os.path.join(root, name))
+                for name in PROJECT_ROOT_FILES
             ]
-            if os.path.exists(f)
+            if os.path.isfile(f)
         ]
-        files.extend(_inc)
-
-        for component in [
-            "model-paths",
-            "seed-paths",
-            "test-paths",
-            "analysis-paths",
-            "macro-paths",
-        ]:
-            rel_path = self.project_config.get(component, [None])[
-                0
-            ]  # dbt profile config defines the file path inside a List.
-            if rel_path is None:
-                continue
-            component_path = os.path.join(self.project_dir or "", rel_path)
-            if not os.path.exists(component_path):
-                continue
-            for path in glob.glob(os.path.join(component_path, "**"), recursive=True):
-                files.append(path)
+        seen = set(files)
+        excluded = {
+            os.path.normpath(os.path.join(root, config.get(key) or default))
+            for key, default in OUTPUT_PATHS.items()
+        }
+
+        for component, defaults in PROJECT_PATHS.items():
+            # dbt profile config defines the paths of a component as a List.
+            for rel_path in config.get(component, defaults) or []:
+                component_path = os.path.normpath(os.path.join(root, rel_path))
+                if not os.path.isdir(component_path):
+                    continue
+                for dirpath, dirnames, filenames in os.walk(component_path):
+                    dirpath = os.path.normpath(dirpath)
+                    if dirpath in mtimes and dirpath != component_path:
+                        # already walked as part of another component.
+                        dirnames[:] = []
+                        continue
+                    mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+                    # Leave out build outputs (f.ex. when a component path is the project root) and hidden files.
+                    dirnames[:] = [
+                        d
+                        for d in dirnames
+                        if not d.startswith(".")
+                        and os.path.normpath(os.path.join(dirpath, d)) not in excluded
+                    ]
+                    for name in filenames:
+                        # Normalized like the root files, f.ex. 'dbt_project.yml' rather than './dbt_project.yml'.
+                        path = os.path.normpath(os.path.join(dirpath, name))
+                        if name.startswith(".") or path in seen:
+                            continue
+                        seen.add(path)
+                        files.append(path)
+
+        return mtimes, files
+
+
+# Default paths of the project components, as used by dbt when they are not configured.
+PROJECT_PATHS = {
+    "model-paths": ["models"],
+    "seed-paths": ["seeds"],
+    "test-paths": ["tests"],
+    "analysis-paths": ["analyses"],
+    "macro-paths": ["macros"],
+    "snapshot-paths": ["snapshots"],
+    "docs-paths": [],
+}
+# Files in the root of the project that are required for executing it.
+PROJECT_ROOT_FILES = [
+    "dbt_project.yml",
+    "packages.yml",
+    "dependencies.yml",
+    "package-lock.yml",
+    "selectors.yml",
+]
+# Build outputs of dbt, along with their default paths. These are never part of the package.
+OUTPUT_PATHS = {
+    "target-path": "target",
+    "packages-install-path": "dbt_packages",
+    "log-path": "logs",
+}
+
+# Project files discovered by DBTProjectConfig, shared between all decorators of the flow.
+_project_files_cache = {}
+
 
-        return files
+def _unchanged(mtimes: Dict[str, int]) -> bool:
+    try:
+        return all(os.stat(path).st_mtime_ns == mtime for path, mtime in mtimes.items())
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,359 @@
+import re
+from array import array
+from collections import deque
+from fnmatch import fnmatch
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set
+
+from metaflow.exception import MetaflowException
+
+# Sections of the manifest that make up the nodes of the DAG.
+GRAPH_SECTIONS = ["nodes", "sources", "exposures", "metrics", "semantic_models"]
+
+# Same syntax as the node selection of dbt, f.ex. '2+tag:nightly+', '@orders', 'staging,state:modified'
+SELECTOR_PATTERN = re.compile(
+    r"\A"
+    r"(?P<childrens_parents>(\@))?"
+    r"(?P<parents>((?P<parents_depth>(\d*))\+))?"
+    r"((?P<method>([\w.]+)):)?(?P<value>(.*?))"
+    r"(?P<children>(\+(?P<children_depth>(\d*))))?"
+    r"\Z"
+)
+
+
+class UnsupportedSelector(MetaflowException):
+    headline = "DBT selector not supported"
+
+
+class ManifestIndex:
+    """
+    Compact graph index over a DBT manifest for fast lineage queries.
+
+    Nodes are integer coded, and the parent and child relations are kept as array-backed adjacency lists
+    (offsets into a flat array of node codes), so the index stays small and cheap to pickle even for large projects.
+
+    The index is built once by the @dbt decorator and stored as the `manifest_index` artifact:
+
+        index = self.manifest_index
+        index.ancestors("model.jaffle_shop.orders")
+        index.select("staging+,tag:nightly")
+        index.topological_layers(index.select("orders+"))
+    """
+
+    def __init__(
+        self,
+        unique_ids: List[str],
+        attributes: Dict[str, List],
+        parent_offsets: array,
+        parents: array,
+        child_offsets: array,
+        children: array,
+    ):
+        self.unique_ids = unique_ids
+        self._codes = {unique_id: i for i, unique_id in enumerate(unique_ids)}
+        self._attributes = attributes
+        self._parent_offsets = parent_offsets
+        self._parents = parents
+        self._child_offsets = child_offsets
+        self._children = children
+
+    @classmethod
+    def from_manifest(cls, manifest: Mapping):
+        """
+        Build the index from the content of a manifest.json
+        """
+        nodes = {}
+        for section in GRAPH_SECTIONS:
+            nodes.update(manifest.get(section) or {})
+        parent_map = manifest.get("parent_map") or {
+            unique_id: node.get("depends_on", {}).get("nodes", [])
+            for unique_id, node in nodes.items()
+        }
+
+        unique_ids = sorted(set(nodes).union(parent_map))
+        codes = {unique_id: i for i, unique_id in enumerate(unique_ids)}
+
+        parent_lists = [[] for _ in unique_ids]
+        child_lists = [[] for _ in unique_ids]
+        for unique_id, parents in parent_map.items():
+            child = codes[unique_id]
+            for parent in set(parents):
+                if parent not in codes:
+                    continue
+                parent_lists[child].append(codes[parent])
+                child_lists[codes[parent]].append(child)
+
+        attributes = {
+            "name": [],
+            "resource_type": [],
+            "package_name": [],
+            "path": [],
+            "fqn": [],
+            "tags": [],
+        }
+        for unique_id in unique_ids:
+            node = nodes.get(unique_id, {})
+            attributes["name"].append(node.get("name"))
+            attributes["resource_type"].append(
+                node.get("resource_type") or unique_id.split(".")[0]
+            )
+            attributes["package_name"].append(node.get("package_name"))
+            attributes["path"].append(node.get("original_file_path"))
+            attributes["fqn"].append(tuple(node.get("fqn") or []))
+            attributes["tags"].append(tuple(node.get("tags") or []))
+
+        return cls(
+            unique_ids,
+            attributes,
+            *_to_csr(parent_lists),
+            *_to_csr(child_lists),
+        )
+
+    def __len__(self):
+        return len(self.unique_ids)
+
+    def __contains__(self, unique_id):
+        return unique_id in self._codes
+
+    def attribute(self, unique_id: str, name: str):
+        """
+        Value of an indexed attribute (name, resource_type, package_name, path, fqn, tags) of a node.
+        """
+        return self._attributes[name][self._codes[unique_id]]
+
+    def parents(self, unique_id: str) -> List[str]:
+        return self._decode(self._adjacent(self._codes[unique_id], upstream=True))
+
+    def children(self, unique_id: str) -> List[str]:
+        return self._decode(self._adjacent(self._codes[unique_id], upstream=False))
+
+    def ancestors(self, unique_ids, depth: Optional[int] = None) -> Set[str]:
+        """
+        All upstream nodes of the given node(s), optionally limited to a number of hops.
+        """
+        return self._decode(self._walk(self._encode(unique_ids), True, depth))
+
+    def descendants(self, unique_ids, depth: Optional[int] = None) -> Set[str]:
+        """
+        All downstream nodes of the given node(s), optionally limited to a number of hops.
+        """
+        return self._decode(self._walk(self._encode(unique_ids), False, depth))
+
+    def select(
+        self,
+        selector: str,
+        methods: Optional[Dict[str, Callable[[str], Iterable[str]]]] = None,
+    ) -> Set[str]:
+        """
+        Resolve a DBT selector string to the set of matching unique_ids.
+
+        Space separated selectors are combined as a union, and comma separated ones as an intersection.
+        Graph operators (+, n+, @) and the methods fqn, tag, path, file, package, resource_type,
+        source and exposure are supported, along with a bare name or fqn.
+        Further methods can be supplied through `methods`, mapping a method name to a function that
+        returns the unique_ids matching a value.
+
+        Raises UnsupportedSelector for any other method.
+        """
+        selected = set()
+        for union_part in selector.split():
+            intersection = None
+            for part in union_part.split(","):
+                matched = self._select_one(part, methods or {})
+                intersection = (
+                    matched if intersection is None else intersection & matched
+                )
+            selected |= intersection or set()
+        return selected
+
+    def topological_layers(self, unique_ids: Optional[Iterable[str]] = None):
+        """
+        Group the given nodes (or all nodes) into layers, where every node only depends on nodes in earlier layers.
+        Only dependencies among the given nodes are considered.
+        """
+        codes = (
+            set(range(len(self.unique_ids)))
+            if unique_ids is None
+            else set(self._encode(unique_ids))
+        )
+        indegree = {
+            code: sum(1 for p in self._adjacent(code, True) if p in codes)
+            for code in codes
+        }
+        layer = sorted(code for code, degree in indegree.items() if degree == 0)
+        layers = []
+        while layer:
+            layers.append([self.unique_ids[code] for code in layer])
+            next_layer = []
+            for code in layer:
+                for child in self._adjacent(code, False):
+                    if child not in codes:
+                        continue
+                    indegree[child] -= 1
+                    if indegree[child] == 0:
+                        next_layer.append(child)
+            layer = sorted(next_layer)
+        return layers
+
+    def connected_components(self, unique_ids: Iterable[str]) -> List[Set[str]]:
+        """
+        Split the given nodes into groups that do not depend on each other in any direction.
+        Only dependencies among the given nodes are considered.
+        """
+        codes = set(self._encode(unique_ids))
+        components = []
+        seen = set()
+        for start in sorted(codes):
+            if start in seen:
+                continue
+            component = {start}
+            queue = deque([start])
+            while queue:
+                code = queue.popleft()
+                for upstream in [True, False]:
+                    for adjacent in self._adjacent(code, upstream):
+                        if adjacent in codes and adjacent not in component:
+                            component.add(adjacent)
+                            queue.append(adjacent)
+            seen |= component
+            components.append(self._decode(component))
+        return components
+
+    def _select_one(self, part: str, methods) -> Set[str]:
+        match = SELECTOR_PATTERN.match(part)
+        if match is None:
+            raise UnsupportedSelector(f"Can not parse selector '{part}'")
+        method = match.group("method")
+        value = match.group("value")
+
+        if method in methods:
+            codes = set(self._encode(u for u in methods[method](value) if u in self))
+        else:
+            codes = {
+                code
+                for code in range(len(self.unique_ids))
+                if self._matches(code, method, value)
+            }
+
+        selected = set(codes)
+        if match.group("childrens_parents"):
+            descendants = self._walk(codes, False, None)
+            selected |= descendants | self._walk(descendants | codes, True, None)
+        if match.group("parents"):
+            selected |= self._walk(codes, True, _depth(match.group("parents_depth")))
+        if match.group("children"):
+            selected |= self._walk(codes, False, _depth(match.group("children_depth")))
+        return self._decode(selected)
+
+    def _matches(self, code: int, method: Optional[str], value: str) -> bool:
+        attrs = self._attributes
+        unique_id = self.unique_ids[code]
+        if method is None:
+            if "/" in value or "\\" in value:
+                method = "path"
+            elif value.endswith((".sql", ".py", ".csv")):
+                method = "file"
+            else:
+                method = "fqn"
+
+        if method == "fqn":
+            return _fqn_matches(attrs["fqn"][code], attrs["name"][code], value)
+        if method == "tag":
+            return any(fnmatch(tag, value) for tag in attrs["tags"][code])
+        if method == "path":
+            path = attrs["path"][code]
+            value = value.rstrip("/")
+            return bool(path) and (fnmatch(path, value) or path.startswith(value + "/"))
+        if method == "file":
+            path = attrs["path"][code]
+            return bool(path) and fnmatch(path.rsplit("/", 1)[-1], value)
+        if method == "package":
+            return fnmatch(attrs["package_name"][code] or "", value)
+        if method == "resource_type":
+            return attrs["resource_type"][code] == value
+        if method in ["source", "exposure"]:
+            if attrs["resource_type"][code] != method:
+                return False
+            # unique_id is of the form 'source.package.source_name.table_name' or 'exposure.package.name'
+            parts = unique_id.split(".")[1:]
+            pattern = value.split(".")
+            if len(pattern) >= len(parts):
+                # 'package.source_name.table_name' or 'package.name'
+                if len(pattern) > len(parts):
+                    raise UnsupportedSelector(
+                        f"Invalid {method} selector '{method}:{value}', "
+                        f"expected at most {len(parts)} parts separated by dots"
+                    )
+                return _parts_match(parts, pattern)
+            # 'source_name', 'source_name.table_name' or 'name', without the package
+            return _parts_match(parts[1:], pattern)
+        raise UnsupportedSelector(f"Selector method '{method}' is not supported")
+
+    def _adjacent(self, code: int, upstream: bool):
+        offsets, values = (
+            (self._parent_offsets, self._parents)
+            if upstream
+            else (self._child_offsets, self._children)
+        )
+        return values[offsets[code] : offsets[code + 1]]
+
+    def _walk(self, codes: Set[int], upstream: bool, depth: Optional[int]) -> Set[int]:
+        seen = set()
+        queue = deque((code, 0) for code in codes)
+        while queue:
+            code, level = queue.popleft()
+            if depth is not None and level >= depth:
+                continue
+            for adjacent in self._adjacent(code, upstream):
+                if adjacent not in seen:
+                    seen.add(adjacent)
+                    queue.append((adjacent, level + 1))
+        return seen
+
+    def _encode(self, unique_ids) -> Set[int]:
+        if isinstance(unique_ids, str):
+            unique_ids = [unique_ids]
+        return {self._codes[unique_id] for unique_id in unique_ids}
+
+    def _decode(self, codes):
+        if isinstance(codes, set):
+            return {self.unique_ids[code] for code in codes}
+        return [self.unique_ids[code] for code in codes]
+
+    def __getstate__(self):
+        # The code lookup is cheap to rebuild, so only persist the compact structures.
+        state = dict(self.__dict__)
+        del state["_codes"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._codes = {unique_id: i for i, unique_id in enumerate(self.unique_ids)}
+
+
+def _to_csr(lists: List[List[int]]):
+    offsets = array("i", [0])
+    values = array("i")
+    for items in lists:
+        values.extend(sorted(items))
+        offsets.append(len(values))
+    return offsets, values
+
+
+def _depth(value: Optional[str]) -> Optional[int]:
+    return int(value) if value else None
+
+
+def _parts_match(parts: List[str], pattern: List[str]) -> bool:
+    return len(pattern) <= len(parts) and all(
+        fnmatch(part, pat) for part, pat in zip(parts, pattern)
+    )
+
+
+def _fqn_matches(fqn, name: Optional[str], value: str) -> bool:
+    # A bare value matches the node name, or a prefix of its fqn with or without the package name.
+    pattern = value.split(".")
+    if len(pattern) == 1 and name is not None and fnmatch(name, value):
+        return True
+    if not fqn:
+        return False
+    return _parts_match(list(fqn), pattern) or _parts_match(list(fqn[1:]), pattern)
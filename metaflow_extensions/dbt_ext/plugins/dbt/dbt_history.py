@@ -0,0 +1,214 @@
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Mapping, Optional
+
+DEFAULT_HISTORY_CACHE_DIR = os.path.join(
+    tempfile.gettempdir(), "metaflow_dbt_timing_history"
+)
+
+# Columns of the timing table, in order.
+TIMING_COLUMNS = [
+    "unique_id",
+    "status",
+    "thread_id",
+    "compile_s",
+    "execute_s",
+    "execution_time",
+    "rows_affected",
+]
+
+# Scale factor that makes the median absolute deviation a consistent estimator of the standard deviation.
+MAD_SCALE = 1.4826
+
+
+def timing_table(run_results: Optional[Mapping]) -> Dict[str, List]:
+    """
+    Compact columnar table of the per-node timings of a run results artifact.
+
+    Returns a dictionary of equally long lists, keyed by the TIMING_COLUMNS.
+    """
+    table = {column: [] for column in TIMING_COLUMNS}
+    if run_results is None:
+        return table
+    for result in run_results.get("results", []):
+        durations = {
+            timing["name"]: _duration(timing) for timing in result.get("timing") or []
+        }
+        table["unique_id"].append(result["unique_id"])
+        table["status"].append(result.get("status"))
+        table["thread_id"].append(result.get("thread_id"))
+        table["compile_s"].append(durations.get("compile"))
+        table["execute_s"].append(durations.get("execute"))
+        table["execution_time"].append(result.get("execution_time"))
+        table["rows_affected"].append(
+            (result.get("adapter_response") or {}).get("rows_affected")
+        )
+    return table
+
+
+def _duration(timing: Mapping) -> Optional[float]:
+    if not timing.get("started_at") or not timing.get("completed_at"):
+        return None
+    started = datetime.fromisoformat(timing["started_at"].replace("Z", "+00:00"))
+    completed = datetime.fromisoformat(timing["completed_at"].replace("Z", "+00:00"))
+    return round((completed - started).total_seconds(), 4)
+
+
+def load_timing_history(
+    flow_name: str,
+    step_name: str,
+    max_runs: int = 20,
+    successful_only: bool = True,
+    max_workers: int = 8,
+    cache_dir: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Load the timing tables of a @dbt step over the latest runs of a flow in the current namespace.
+
+    The tables are loaded concurrently, and cached locally per task, as the artifacts of a finished task never change.
+
+    Parameters
+    ----------
+    flow_name: str
+        name of the flow
+    step_name: str
+        name of the @dbt step
+    max_runs: int
+        number of latest runs to load. Default 20
+    successful_only: bool
+        only consider successful runs. Default True
+    max_workers: int
+        number of concurrent loads. Default 8
+    cache_dir: str, optional
+        directory for the local cache of the tables. Defaults to a folder in the system temp dir.
+
+    Returns
+    -------
+    List[Dict]
+        the timing tables, newest run first. Each table also records the 'pathspec' and 'created_at' of its task.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from metaflow import Flow
+
+    cache_dir = cache_dir or DEFAULT_HISTORY_CACHE_DIR
+    tasks = []
+    runs = 0
+    for run in Flow(flow_name).runs():
+        if runs >= max_runs:
+            break
+        if successful_only and not run.successful:
+            continue
+        if step_name not in run:
+            # The step was not executed in this run.
+            continue
+        tasks.extend(run[step_name].tasks())
+        runs += 1
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        tables = list(pool.map(lambda task: _load_table(task, cache_dir), tasks))
+    return [table for table in tables if table is not None]
+
+
+def _load_table(task, cache_dir: str) -> Optional[Dict]:
+    path = os.path.join(cache_dir, task.pathspec.replace("/", "_") + ".json")
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    if "dbt_timing_table" in task:
+        table = dict(task["dbt_timing_table"].data)
+    elif "run_results" in task:
+        # Tasks from before the timing table was recorded.
+        table = timing_table(task["run_results"].data)
+    else:
+        return None
+    table["pathspec"] = task.pathspec
+    table["created_at"] = str(task.created_at)
+    if task.finished:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=cache_dir, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(table, f)
+        os.replace(f.name, path)
+    return table
+
+
+def detect_regressions(
+    history: List[Mapping],
+    current: Optional[Mapping] = None,
+    column: str = "execution_time",
+    threshold: float = 3.5,
+    min_ratio: float = 1.5,
+    min_seconds: float = 1.0,
+    min_samples: int = 5,
+) -> List[Dict]:
+    """
+    Flag the nodes whose duration in the current run is significantly longer than in the history.
+
+    A node is flagged when the robust z-score of its current duration against the history
+    (median and median absolute deviation, which are not thrown off by the odd slow run)
+    exceeds the threshold, the duration grew by at least min_ratio and by at least min_seconds.
+
+    Parameters
+    ----------
+    history: List[Mapping]
+        timing tables of previous runs, f.ex. from load_timing_history
+    current: Mapping, optional
+        timing table of the run to check. Defaults to the newest table of the history,
+        which is then excluded from the baseline.
+    column: str
+        duration column to compare. Default 'execution_time'
+    threshold: float
+        minimum robust z-score. Default 3.5
+    min_ratio: float
+        minimum ratio of the current duration to the median. Default 1.5
+    min_seconds: float
+        minimum absolute increase in seconds, to ignore noise on fast nodes. Default 1.0
+    min_samples: int
+        minimum number of historical durations required for a node to be checked. Default 5
+
+    Returns
+    -------
+    List[Dict]
+        the regressions, most significant first.
+    """
+    import statistics
+
+    if current is None:
+        if not history:
+            return []
+        current, history = history[0], history[1:]
+
+    samples = {}
+    for table in history:
+        for unique_id, status, value in zip(
+            table["unique_id"], table["status"], table[column]
+        ):
+            if status in ["success", "pass"] and value is not None:
+                samples.setdefault(unique_id, []).append(value)
+
+    regressions = []
+    for unique_id, value in zip(current["unique_id"], current[column]):
+        baseline = samples.get(unique_id, [])
+        if value is None or len(baseline) < min_samples:
+            continue
+        median = statistics.median(baseline)
+        mad = MAD_SCALE * statistics.median(abs(v - median) for v in baseline)
+        if value - median < min_seconds or value < min_ratio * median:
+            continue
+        # A perfectly stable history has no deviation, any significant increase is a regression then.
+        score = (value - median) / mad if mad > 0 else float("inf")
+        if score >= threshold:
+            regressions.append(
+                {
+                    "unique_id": unique_id,
+                    "duration": value,
+                    "median": median,
+                    "ratio": round(value / median, 2) if median > 0 else float("inf"),
+                    "score": round(score, 2),
+                    "samples": len(baseline),
+                }
+            )
+    return sorted(regressions, key=lambda r: -r["score"])
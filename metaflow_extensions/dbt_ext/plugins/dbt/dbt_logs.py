@@ -0,0 +1,129 @@
+import json
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+
+# dbt node statuses that mark a node as failed.
+FAILED_STATUSES = ["error", "fail", "runtime error"]
+
+
+class DBTLogCollector:
+    """
+    Consumes dbt structured log events as they arrive.
+
+    Log messages are forwarded to the task log, while only a bounded tail of messages
+    and node events is kept in memory in order to report failures.
+
+    Parameters
+    ----------
+    echo: Callable[[str], None], optional
+        Function to forward log messages with. Defaults to print.
+        Pass None to only collect events.
+    max_lines: int
+        Number of most recent log lines to keep.
+    max_nodes: int
+        Number of most recently seen nodes to keep status information for.
+    """
+
+    def __init__(
+        self,
+        echo: Optional[Callable[[str], None]] = print,
+        max_lines: int = 200,
+        max_nodes: int = 1000,
+    ):
+        self.echo = echo
+        self.tail = deque(maxlen=max_lines)
+        self.max_nodes = max_nodes
+        self.nodes = OrderedDict()
+        self.failed = OrderedDict()
+
+    def process_line(self, line: str):
+        """
+        Process a single line of dbt output produced with '--log-format json'.
+        Lines that are not json (for example tracebacks) are forwarded as-is.
+        """
+        line = line.rstrip("\n")
+        if not line:
+            return
+        try:
+            event = json.loads(line)
+        except ValueError:
+            self._log(line)
+            return
+        if not isinstance(event, dict) or "info" not in event:
+            self._log(line)
+            return
+        self.process_event(event)
+
+    def process_event(self, event: Dict):
+        """
+        Process a dbt event in its dictionary form, as written by '--log-format json'.
+        """
+        info = event.get("info", {})
+        msg = info.get("msg")
+        if msg:
+            self._log(msg)
+
+        node_info = event.get("data", {}).get("node_info")
+        if node_info and node_info.get("unique_id"):
+            self._update_node(node_info)
+
+    def _log(self, msg: str):
+        self.tail.append(msg)
+        if self.echo is not None:
+            self.echo(msg)
+
+    def _update_node(self, node_info: Dict):
+        unique_id = node_info["unique_id"]
+        node = self.nodes.pop(unique_id, {})
+        node.update(
+            {
+                key: node_info[key]
+                for key in [
+                    "node_status",
+                    "node_started_at",
+                    "node_finished_at",
+                    "resource_type",
+                ]
+                if node_info.get(key)
+            }
+        )
+        self.nodes[unique_id] = node
+        while len(self.nodes) > self.max_nodes:
+            self.nodes.popitem(last=False)
+
+        if node.get("node_status") in FAILED_STATUSES:
+            self.failed[unique_id] = node
+            while len(self.failed) > self.max_nodes:
+                self.failed.popitem(last=False)
+
+    def failed_nodes(self) -> List[str]:
+        return list(self.failed.keys())
+
+    def summary(self) -> str:
+        """
+        Human readable report of the failed nodes and the most recent log lines.
+        """
+        lines = []
+        if self.failed:
+            lines.append("Failed nodes:")
+            lines.extend(
+                f"  {uid} ({node.get('node_status')})"
+                for uid, node in self.failed.items()
+            )
+            lines.append("")
+        lines.append(f"Last {len(self.tail)} log lines:")
+        lines.extend(self.tail)
+        return "\n".join(lines)
+
+
+def event_callback(collector: DBTLogCollector):
+    """
+    Create a callback for the dbt programmatic runner that records events into the collector.
+    """
+
+    def _callback(event):
+        from dbt.events.functions import msg_to_dict
+
+        collector.process_event(msg_to_dict(event))
+
+    return _callback
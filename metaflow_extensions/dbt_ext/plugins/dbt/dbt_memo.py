@@ -0,0 +1,77 @@
+import hashlib
+import json
+import tempfile
+from typing import Dict, List, Optional
+
+
+def step_fingerprint(
+    project_files: Dict[str, str],
+    command: str,
+    models: Optional[str],
+    dbt_version: str,
+    watermark: Optional[str] = None,
+    defer_to: Optional[str] = None,
+    generate_docs: bool = False,
+    docs_card: Optional[str] = None,
+    defer_snapshot: Optional[str] = None,
+) -> str:
+    """
+    Fingerprint of everything that determines the outcome of a DBT step:
+    the project files, the profiles and target (covered by the project file record),
+    the command and selection, the dbt version, an optional watermark of the source data,
+    the generated docs, and the state that the execution defers to along with its snapshot.
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps(project_files, sort_keys=True).encode())
+    sha.update(
+        json.dumps([command, models, dbt_version, watermark], sort_keys=True).encode()
+    )
+    # Only part of the fingerprint when set, to keep the fingerprints of existing records valid.
+    if generate_docs:
+        sha.update(json.dumps(["docs", docs_card]).encode())
+    if defer_to is not None:
+        sha.update(json.dumps(["defer", defer_to, defer_snapshot]).encode())
+    return sha.hexdigest()
+
+
+class DBTStepMemo:
+    """
+    Records of successful DBT step executions, keyed by the step fingerprint.
+
+    A record points to the task whose artifacts can be reused by a later execution with the same fingerprint.
+
+    Parameters
+    ----------
+    datastore: DataStoreStorage
+        datastore rooted at the prefix of the step.
+    """
+
+    def __init__(self, datastore):
+        self.datastore = datastore
+
+    def lookup(self, fingerprint: str) -> Optional[Dict]:
+        with self.datastore.load_bytes([f"{fingerprint}.json"]) as result:
+            for _, file, _ in result:
+                if file is not None:
+                    with open(file) as f:
+                        return json.load(f)
+        return None
+
+    def record(
+        self,
+        fingerprint: str,
+        run_id: str,
+        task_id: str,
+        attempt: int,
+        artifacts: List[str],
+    ):
+        record = {
+            "run_id": run_id,
+            "task_id": task_id,
+            "attempt": attempt,
+            "artifacts": artifacts,
+        }
+        with tempfile.TemporaryFile() as f:
+            f.write(json.dumps(record).encode())
+            f.seek(0)
+            self.datastore.save_bytes([(f"{fingerprint}.json", f)], overwrite=True)
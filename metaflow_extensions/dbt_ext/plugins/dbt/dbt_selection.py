@@ -0,0 +1,227 @@
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Union
+
+from .dbt_graph import ManifestIndex, UnsupportedSelector
+from .dbt_state import file_sha256
+
+# Record of the project file hashes at the time a state was produced. Stored along with the state.
+PROJECT_FILES = "project_files.json"
+# Pseudo-file in the project file record that covers the profiles and target configuration.
+CONFIG_KEY = "__config__"
+
+# Resource types that are executed by each supported command.
+COMMAND_RESOURCE_TYPES = {
+    "run": ["model"],
+    "seed": ["seed"],
+    "clone": ["model", "seed", "snapshot"],
+    "build": ["model", "seed", "snapshot", "test"],
+    "test": ["test"],
+    "source freshness": ["source"],
+}
+
+# Extensions of the files that hold the code of a single node: models, tests, snapshots, analyses and seeds.
+NODE_CODE_SUFFIXES = (".sql", ".py", ".csv")
+
+
+class UnresolvableSelection(Exception):
+    """
+    Raised when a selection can not be resolved reliably in Python.
+    """
+
+
+def intersect_selection(models: Optional[str], selectors: List[str]) -> str:
+    """
+    Selection of the nodes that both the models and any of the selectors select.
+    """
+    if not models:
+        return " ".join(selectors)
+    # A space is a union and a comma an intersection of selectors in dbt,
+    # so intersect every part of the union with each of the selectors.
+    return " ".join(
+        f"{part},{selector}" for part in models.split() for selector in selectors
+    )
+
+
+def project_file_hashes(
+    paths: Iterable[str], project_dir: Optional[str], config_hash: str
+) -> Dict[str, str]:
+    """
+    Content hashes of the project files, keyed by their path relative to the project dir.
+    """
+    hashes = {
+        os.path.relpath(path, project_dir or "."): file_sha256(path)
+        for path in paths
+        if os.path.isfile(path)
+    }
+    hashes[CONFIG_KEY] = config_hash
+    return hashes
+
+
+class SelectionResolver:
+    """
+    Resolves DBT selectors in Python against the state of a previous execution.
+
+    State selectors are resolved by comparing the project files against the record of the files
+    that produced the previous state. The resolution is conservative: whenever the outcome can not
+    be determined exactly (unknown selector methods, changes to files that are not the source of a node,
+    like macros or yml files), UnresolvableSelection is raised instead.
+
+    Parameters
+    ----------
+    manifest: Union[Mapping, ManifestIndex]
+        manifest (or its index) of the previous execution
+    run_results: Mapping, optional
+        run results of the previous execution
+    previous_files: Dict[str, str], optional
+        project file hashes recorded with the previous state. State selectors can not be resolved without them.
+    current_files: Dict[str, str]
+        current project file hashes
+    sources: Mapping, optional
+        source freshness results of the current execution
+    previous_sources: Mapping, optional
+        source freshness results of the previous execution
+    """
+
+    def __init__(
+        self,
+        manifest: Union[Mapping, ManifestIndex],
+        run_results: Optional[Mapping],
+        previous_files: Optional[Dict[str, str]],
+        current_files: Dict[str, str],
+        sources: Optional[Mapping] = None,
+        previous_sources: Optional[Mapping] = None,
+    ):
+        self.index = (
+            manifest
+            if isinstance(manifest, ManifestIndex)
+            else ManifestIndex.from_manifest(manifest)
+        )
+        self.run_results = run_results
+        self.previous_files = previous_files
+        self.current_files = current_files
+        self.sources = sources
+        self.previous_sources = previous_sources
+
+    def resolve(
+        self, selector: str, resource_types: Optional[List[str]] = None
+    ) -> Set[str]:
+        """
+        unique_ids of the nodes of the given resource types that the selector selects.
+        """
+        try:
+            selected = self.index.select(
+                selector,
+                methods={
+                    "state": self._state,
+                    "result": self._result,
+                    "source_status": self._source_status,
+                },
+            )
+        except UnsupportedSelector as ex:
+            raise UnresolvableSelection(str(ex))
+        if resource_types is None:
+            return selected
+        return {
+            unique_id
+            for unique_id in selected
+            if self.index.attribute(unique_id, "resource_type") in resource_types
+        }
+
+    def _changed_files(self) -> Set[str]:
+        return {
+            path
+            for path in set(self.previous_files).union(self.current_files)
+            if self.previous_files.get(path) != self.current_files.get(path)
+        }
+
+    def _state(self, value: str) -> Set[str]:
+        # 'modified' and its sub-selectors (modified.body, modified.configs, ...) as well as 'new'
+        # are resolved to the nodes defined in changed files. This is a superset of what dbt selects,
+        # which is safe for proving that a selection is empty.
+        if not (value.startswith("modified") or value == "new"):
+            raise UnresolvableSelection(f"state:{value}")
+        if self.previous_files is None:
+            raise UnresolvableSelection("no record of the previous project files")
+        changed = self._changed_files()
+        nodes_by_path = {}
+        for unique_id in self.index.unique_ids:
+            path = self.index.attribute(unique_id, "path")
+            # Only the code of a node is its own. A yml file that defines tests or sources
+            # also configures and documents the models it patches.
+            if path and path.endswith(NODE_CODE_SUFFIXES):
+                nodes_by_path.setdefault(os.path.normpath(path), []).append(unique_id)
+        selected = set()
+        for path in changed:
+            nodes = nodes_by_path.get(os.path.normpath(path))
+            if nodes is None:
+                # A change to a file that is not the code of a node (macros, yml, configuration, new files)
+                # can affect any node.
+                raise UnresolvableSelection(f"{path} changed")
+            selected.update(nodes)
+        return selected
+
+    def _result(self, value: str) -> Set[str]:
+        if self.run_results is None:
+            raise UnresolvableSelection("no previous run results")
+        return {
+            result["unique_id"]
+            for result in self.run_results.get("results", [])
+            if result.get("status") == value
+        }
+
+    def _source_status(self, value: str) -> Set[str]:
+        # Same semantics as dbt: sources that were loaded more recently than in the previous freshness results,
+        # or that are new, excluding sources whose freshness could not be determined.
+        if value != "fresher":
+            raise UnresolvableSelection(f"source_status:{value}")
+        if self.sources is None or self.previous_sources is None:
+            raise UnresolvableSelection("no freshness results to compare")
+        current = _loaded_at(self.sources)
+        previous = _loaded_at(self.previous_sources)
+        return {
+            unique_id
+            for unique_id, loaded_at in current.items()
+            if loaded_at is not None
+            and (
+                unique_id not in previous
+                or previous[unique_id] is None
+                or loaded_at > previous[unique_id]
+            )
+        }
+
+
+def _loaded_at(sources: Mapping) -> Dict[str, Optional[datetime]]:
+    # max_loaded_at is missing for sources whose freshness check failed with a runtime error.
+    loaded_at = {}
+    for result in sources.get("results", []):
+        value = result.get("max_loaded_at")
+        try:
+            loaded_at[result["unique_id"]] = (
+                datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+            )
+        except ValueError:
+            raise UnresolvableSelection(f"unknown timestamp format '{value}'")
+    return loaded_at
+
+
+def empty_run_results(cmd: str, args: List[str], dbt_version: str) -> Dict:
+    """
+    Run results of a command that did not need to execute, as the selection was empty.
+    """
+    return {
+        "metadata": {
+            "dbt_schema_version": "https://schemas.getdbt.com/dbt/run-results/v5.json",
+            "dbt_version": dbt_version,
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "invocation_id": None,
+            "env": {},
+        },
+        "results": [],
+        "elapsed_time": 0.0,
+        "args": {
+            "which": cmd,
+            "invocation_command": " ".join(["dbt", cmd] + args),
+            "skipped": "selection resolved to zero nodes",
+        },
+    }
@@ -0,0 +1,195 @@
+import heapq
+from typing import Dict, List, Mapping, Optional, Sequence, Set, Tuple, Union
+
+from metaflow.exception import MetaflowException
+
+from .dbt_graph import ManifestIndex
+
+# Execution time assumed for nodes that have no history, when no other history is available either.
+DEFAULT_EXECUTION_TIME = 1.0
+# Characters that make a part of a fully qualified name a pattern, rather than a literal.
+FQN_WILDCARDS = "*?[]"
+
+
+class InvalidShardCount(MetaflowException):
+    headline = "Invalid number of DBT shards"
+
+
+def plan_shards(
+    manifest: Union[Mapping, ManifestIndex],
+    n_shards: int,
+    models: Optional[List[str]] = None,
+    run_results: Optional[Union[Mapping, Sequence[Mapping]]] = None,
+    resource_types: Sequence[str] = ("model",),
+) -> List[str]:
+    """
+    Split a DBT selection into independent shards that can be executed in parallel,
+    f.ex. as a foreach over @dbt steps.
+
+    The selected nodes are grouped into connected components, which have no dependencies between each other.
+    The components are then assigned to shards, longest first, so that the expected execution time
+    of the shards is balanced. Expected execution times come from the run results of previous executions.
+    A component is never split, as its nodes would otherwise be built in parallel with the nodes they depend on,
+    so a selection that is mostly one connected DAG yields fewer shards than requested.
+
+    Parameters
+    ----------
+    manifest: Union[Mapping, ManifestIndex]
+        manifest (or its index, f.ex. the `manifest_index` artifact) of the project.
+    n_shards: int
+        maximum number of shards to create, at least 1. Fewer shards are returned if the selection has fewer components.
+    models: List[str], optional
+        selection to shard, in the same form as the `models` of the @dbt decorator. Defaults to all nodes.
+    run_results: Union[Mapping, List[Mapping]], optional
+        run results of previous executions, used for the expected execution time of each node.
+    resource_types: List[str]
+        resource types to include in the shards. Defaults to models.
+
+    Returns
+    -------
+    List[str]
+        a selector for each shard, to be passed as the `models` of a @dbt step.
+    """
+    if n_shards < 1:
+        raise InvalidShardCount(f"n_shards must be at least 1, got {n_shards}.")
+    index = (
+        manifest
+        if isinstance(manifest, ManifestIndex)
+        else ManifestIndex.from_manifest(manifest)
+    )
+    selected = index.select(" ".join(models)) if models else set(index.unique_ids)
+    selected = {
+        unique_id
+        for unique_id in selected
+        if index.attribute(unique_id, "resource_type") in resource_types
+    }
+    if not selected:
+        return []
+
+    times = execution_times(run_results)
+    default = (
+        sorted(times.values())[len(times) // 2] if times else DEFAULT_EXECUTION_TIME
+    )
+    components = sorted(
+        (
+            (sum(times.get(unique_id, default) for unique_id in component), component)
+            for component in index.connected_components(selected)
+        ),
+        key=lambda item: (-item[0], sorted(item[1])),
+    )
+
+    if len(components) < n_shards:
+        print(
+            f"The selection splits into {len(components)} independent part(s), "
+            f"so only {len(components)} of {n_shards} shards are used."
+        )
+
+    # Longest processing time first: assign every component to the currently lightest shard.
+    shards = [(0.0, i, []) for i in range(min(n_shards, len(components)))]
+    heapq.heapify(shards)
+    for weight, component in components:
+        load, i, nodes = heapq.heappop(shards)
+        nodes.extend(component)
+        heapq.heappush(shards, (load + weight, i, nodes))
+
+    under = _fqn_prefixes(index)
+    return [
+        _selector(index, under, nodes)
+        for _, _, nodes in sorted(shards, key=lambda s: s[1])
+    ]
+
+
+def execution_times(
+    run_results: Optional[Union[Mapping, Sequence[Mapping]]]
+) -> Dict[str, float]:
+    """
+    Average execution time of every node in the given run results.
+    """
+    if run_results is None:
+        return {}
+    if isinstance(run_results, Mapping):
+        run_results = [run_results]
+    totals = {}
+    for results in run_results:
+        for result in results.get("results", []):
+            total, count = totals.get(result["unique_id"], (0.0, 0))
+            totals[result["unique_id"]] = (
+                total + (result.get("execution_time") or 0.0),
+                count + 1,
+            )
+    return {unique_id: total / count for unique_id, (total, count) in totals.items()}
+
+
+def merge_run_results(run_results: Sequence[Mapping]) -> Optional[Dict]:
+    """
+    Merge the run results of parallel shards into the run results of a single execution,
+    f.ex. in the join step of a foreach over @dbt steps.
+
+        @step
+        def join(self, inputs):
+            self.run_results = merge_dbt_run_results([i.run_results for i in inputs])
+    """
+    run_results = [r for r in run_results if r is not None]
+    if not run_results:
+        return None
+    first = run_results[0]
+    return {
+        "metadata": dict(first.get("metadata", {})),
+        "results": [
+            result for results in run_results for result in results.get("results", [])
+        ],
+        # shards are executed in parallel.
+        "elapsed_time": max(r.get("elapsed_time") or 0.0 for r in run_results),
+        "args": dict(first.get("args", {})),
+    }
+
+
+def _selector(
+    index: ManifestIndex, under: Dict[Tuple[str, ...], Set[str]], unique_ids: List[str]
+) -> str:
+    # Nodes are selected by the shortest prefix of their fully qualified name (f.ex. a directory of models)
+    # that selects nothing outside of the shard, so the selector stays short even for large shards.
+    # Tests are ignored if all of their parents are in the shard, as dbt selects them along with their parents anyway.
+    shard = set(unique_ids)
+    allowed = {}
+
+    def _exact(prefix):
+        if prefix not in allowed:
+            allowed[prefix] = prefix in under and all(
+                unique_id in shard
+                or (
+                    index.attribute(unique_id, "resource_type") == "test"
+                    and set(index.parents(unique_id)) <= shard
+                )
+                for unique_id in under[prefix]
+            )
+        return allowed[prefix]
+
+    selectors = set()
+    for unique_id in shard:
+        fqn = tuple(index.attribute(unique_id, "fqn"))
+        # The full name selects the node itself, along with nodes of the same name in other packages.
+        prefix = next(
+            (fqn[:depth] for depth in range(1, len(fqn)) if _exact(fqn[:depth])),
+            fqn,
+        )
+        selectors.add(".".join(prefix) or index.attribute(unique_id, "name"))
+    return " ".join(sorted(selectors))
+
+
+def _fqn_prefixes(index: ManifestIndex) -> Dict[Tuple[str, ...], Set[str]]:
+    # The nodes that every prefix of a fully qualified name selects, as matched by dbt:
+    # a prefix of the fqn with or without the package name, or for a single part, the name of the node.
+    under = {}
+    for unique_id in index.unique_ids:
+        fqn = tuple(index.attribute(unique_id, "fqn"))
+        for parts in [fqn, fqn[1:]]:
+            for depth in range(1, len(parts) + 1):
+                under.setdefault(parts[:depth], set()).add(unique_id)
+        under.setdefault((index.attribute(unique_id, "name"),), set()).add(unique_id)
+    # Prefixes with wildcards would match more nodes than the ones recorded here.
+    return {
+        prefix: nodes
+        for prefix, nodes in under.items()
+        if not any(c in part for part in prefix for c in FQN_WILDCARDS)
+    }
@@ -0,0 +1,463 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from metaflow.debug import debug
+
+# Pointer to the latest published snapshot of the state, and to the latest snapshot of a successful execution.
+POINTER = "LATEST"
+SUCCESS_POINTER = "LATEST_SUCCESS"
+# State files that are read from the latest snapshot even if its execution failed, so result selectors
+# pick up the failures. All other files are read from the latest successful snapshot.
+RESULT_FILES = ["run_results.json"]
+SNAPSHOTS = "snapshots"
+OBJECTS = "objects"
+# Attempts at reading a json object that is being written concurrently.
+READ_ATTEMPTS = 3
+COMPRESSED_SUFFIX = ".gz"
+# Favour speed over ratio, the json artifacts compress well regardless.
+COMPRESS_LEVEL = 3
+
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class DBTStateStore:
+    """
+    Transfers the state files of DBT executions to and from a Metaflow datastore.
+
+    Every push publishes a new immutable snapshot of the state. The files are stored gzip compressed
+    and content-addressed, so files that did not change are shared between snapshots and not uploaded again.
+    A snapshot is published by writing a small pointer object (LATEST) that records the content hashes of its files,
+    so readers resolve the latest complete snapshot with a single read, and never see a partially written one.
+    Snapshots of successful executions are published to a second pointer (LATEST_SUCCESS) as well. Readers compare
+    against the latest successful snapshot, with the run results of the latest snapshot for result selectors,
+    so a failed execution never becomes the baseline for state selectors.
+    Snapshots past the retention are garbage-collected after publishing.
+
+    Layout under the prefix of the state:
+        LATEST                      pointer to the latest snapshot, including its file hashes
+        LATEST_SUCCESS              pointer to the latest snapshot of a successful execution
+        snapshots/<snapshot>.json   file hashes of every snapshot
+        objects/<sha256>.gz         file contents
+
+    Parameters
+    ----------
+    datastore: DataStoreStorage
+        datastore rooted at the prefix of the state.
+    cache: DBTStateCache, optional
+        local cache to consult before downloading state files.
+    retention: int, optional
+        number of latest snapshots to keep. Older snapshots are removed after publishing a new one.
+        No snapshots are removed if not set.
+    """
+
+    def __init__(self, datastore, cache=None, retention: Optional[int] = None):
+        self.datastore = datastore
+        self.cache = cache
+        self.retention = retention
+        # Index of the stored state, loaded on first use.
+        self._index = None
+        # Files of the latest snapshot, regardless of the outcome of its execution.
+        self._latest = None
+        # Id of the snapshot that the index was read from.
+        self._snapshot = None
+
+    def index(self) -> Dict[str, str]:
+        """
+        Content hashes of the files of the stored state to compare against, keyed by filename:
+        the files of the latest successful snapshot, with the run results of the latest snapshot.
+        """
+        if self._index is None:
+            pointer = self.pointer()
+            if pointer is not None:
+                self._latest = pointer.get("files", {})
+                # State published before successful snapshots were tracked separately only has the one pointer.
+                successful = self.pointer(SUCCESS_POINTER) or pointer
+                self._snapshot = successful.get("snapshot")
+                self._index = dict(successful.get("files", {}))
+                self._index.update(
+                    {
+                        name: sha
+                        for name, sha in self._latest.items()
+                        if name in RESULT_FILES
+                    }
+                )
+            else:
+                # Nothing was published as a snapshot yet. Earlier versions stored the files as-is, see pull().
+                self._index = {}
+                self._latest = {}
+        return self._index
+
+    def snapshot_id(self) -> Optional[str]:
+        """
+        Id of the snapshot that the stored state is compared against,
+        or None if nothing has been published as a snapshot yet.
+        """
+        self.index()
+        return self._snapshot
+
+    def pointer(self, key: str = POINTER) -> Optional[Dict]:
+        """
+        The pointer to the latest published snapshot (or the latest successful one, with key=SUCCESS_POINTER),
+        or None if nothing has been published yet.
+        """
+        return self._read_json(key, None)
+
+    def _read_json(self, key: str, default):
+        # Local datastores do not write objects atomically, so retry on a partially written object.
+        for attempt in range(READ_ATTEMPTS):
+            with self.datastore.load_bytes([key]) as result:
+                for _, file, _ in result:
+                    if file is None:
+                        return default
+                    try:
+                        with open(file) as f:
+                            return json.load(f)
+                    except ValueError:
+                        if attempt == READ_ATTEMPTS - 1:
+                            raise
+            time.sleep(0.1 * (attempt + 1))
+        return default
+
+    def _object_key(self, name: str) -> str:
+        return f"{OBJECTS}/{self.index()[name]}{COMPRESSED_SUFFIX}"
+
+    def pull(self, path: str, files: List[str]) -> List[str]:
+        """
+        Fetch the files of the latest stored state into path.
+
+        Returns
+        -------
+        List[str]
+            Names of the files that were available.
+        """
+        index = self.index()
+        if not index:
+            # State pushed before compression was introduced is stored as-is.
+            return self._pull_uncompressed(path, files)
+
+        names = [name for name in files if name in index]
+        if self.cache is not None:
+            try:
+                return self._pull_cached(path, names)
+            except OSError as ex:
+                # f.ex. the shared cache directory or its entries belong to another user.
+                print(
+                    f"DBT state cache is not available: {ex}. Downloading the state instead."
+                )
+                self.cache = None
+        return self._download(path, names)
+
+    def _pull_cached(self, path: str, names: List[str]) -> List[str]:
+        index = self.index()
+        pulled = [name for name in names if self._copy_from_cache(path, name)]
+        missing = [name for name in names if name not in pulled]
+        if not missing:
+            return pulled
+        with self.cache.locked([index[name] for name in missing]):
+            # Another task might have fetched the files while we waited for the lock.
+            cached = [name for name in missing if self._copy_from_cache(path, name)]
+            downloaded = self._download(
+                path, [name for name in missing if name not in cached]
+            )
+            for name in downloaded:
+                local_path = os.path.join(path, name)
+                # Only cache content that matches the index,
+                # as a concurrent push might have replaced the file after the index was read.
+                if file_sha256(local_path) == index[name]:
+                    self.cache.put(index[name], local_path)
+        return pulled + cached + downloaded
+
+    def _copy_from_cache(self, path: str, name: str) -> bool:
+        cached = self.cache.get(self.index()[name])
+        if cached is None:
+            return False
+        try:
+            shutil.copy(cached, os.path.join(path, name))
+        except FileNotFoundError:
+            # evicted in the meantime.
+            return False
+        return True
+
+    def _download(self, path: str, names: List[str]) -> List[str]:
+        if not names:
+            return []
+        keys = {name: self._object_key(name) for name in names}
+
+        def _decompress_to_path(name, file):
+            _decompress(file, os.path.join(path, name))
+            return name
+
+        with self.datastore.load_bytes(sorted(set(keys.values()))) as result:
+            files = {key: file for key, file, _ in result if file is not None}
+            downloaded = [
+                (name, files[key]) for name, key in keys.items() if key in files
+            ]
+            with ThreadPoolExecutor(max_workers=max(len(downloaded), 1)) as pool:
+                return list(
+                    pool.map(lambda args: _decompress_to_path(*args), downloaded)
+                )
+
+    def _pull_uncompressed(self, path: str, files: List[str]) -> List[str]:
+        # Copy instead of moving, as local datastores hand out the stored file itself.
+        pulled = []
+        with self.datastore.load_bytes(files) as result:
+            for key, file, _ in result:
+                if file is not None:
+                    shutil.copy(file, os.path.join(path, key))
+                    pulled.append(key)
+        return pulled
+
+    def push(
+        self,
+        files_and_paths: Dict[str, str],
+        info: Optional[Dict] = None,
+        succeeded: bool = True,
+    ) -> List[str]:
+        """
+        Publish the given files as a new snapshot of the state.
+        Files of the state that are not given are carried over to the new one.
+        Nothing is published if the content matches the latest snapshot.
+
+        Parameters
+        ----------
+        files_and_paths: Dict[str, str]
+            Local paths of the state files, keyed by filename.
+        info: Dict, optional
+            additional information to record with the snapshot, f.ex. the task that produced it.
+        succeeded: bool, optional. Default True
+            Whether the execution that produced the files succeeded. Only successful snapshots
+            become the baseline for state selectors, see index().
+
+        Returns
+        -------
+        List[str]
+            Names of the files that were uploaded.
+        """
+        if not files_and_paths:
+            return []
+        current = self.index()
+        # Skip publishing only if the snapshot would replace an identical one of the same kind.
+        unchanged = self._latest == current
+        with ThreadPoolExecutor(max_workers=len(files_and_paths)) as pool:
+            hashes = dict(
+                zip(
+                    files_and_paths.keys(),
+                    pool.map(file_sha256, files_and_paths.values()),
+                )
+            )
+        files = dict(current, **hashes)
+        if unchanged and files == current:
+            return []
+
+        snapshot = dict(
+            info or {},
+            snapshot=_snapshot_id(),
+            created_at=datetime.now(timezone.utc).isoformat(),
+            files=files,
+        )
+        # The snapshot is recorded before its objects are uploaded, so garbage collection
+        # running concurrently does not remove the objects of a snapshot that is about to be published.
+        self._write_json(f"{SNAPSHOTS}/{snapshot['snapshot']}.json", snapshot)
+
+        candidates = [
+            name for name, sha in hashes.items() if sha not in set(current.values())
+        ]
+        # Content of older snapshots might still be stored, f.ex. after reverting a change.
+        stored = self.datastore.is_file(
+            [f"{OBJECTS}/{hashes[name]}{COMPRESSED_SUFFIX}" for name in candidates]
+        )
+        changed = [name for name, exists in zip(candidates, stored) if not exists]
+        reused = [name for name, exists in zip(candidates, stored) if exists]
+        self._upload(files_and_paths, hashes, changed)
+
+        # The pointers are written last, so readers never see a snapshot whose files were not uploaded yet.
+        self._write_json(POINTER, snapshot)
+        if succeeded:
+            self._write_json(SUCCESS_POINTER, snapshot)
+
+        # Garbage collection running concurrently might have removed the stored objects that we reuse
+        # after checking for them, if it listed the snapshots before ours was recorded. Upload those again.
+        if reused:
+            missing = [
+                name
+                for name, exists in zip(
+                    reused,
+                    self.datastore.is_file(
+                        [
+                            f"{OBJECTS}/{hashes[name]}{COMPRESSED_SUFFIX}"
+                            for name in reused
+                        ]
+                    ),
+                )
+                if not exists
+            ]
+            self._upload(files_and_paths, hashes, missing)
+            changed.extend(missing)
+
+        self._latest = files
+        if succeeded:
+            self._index = files
+        else:
+            self._index = dict(
+                self._index,
+                **{name: sha for name, sha in files.items() if name in RESULT_FILES},
+            )
+
+        if self.retention:
+            self.gc(self.retention)
+        return changed
+
+    def _upload(
+        self, files_and_paths: Dict[str, str], hashes: Dict[str, str], names: List[str]
+    ):
+        if not names:
+            return
+        with tempfile.TemporaryDirectory() as tempdir:
+
+            def _compress_and_upload(name):
+                key = f"{OBJECTS}/{hashes[name]}{COMPRESSED_SUFFIX}"
+                compressed = os.path.join(tempdir, name + COMPRESSED_SUFFIX)
+                _compress(files_and_paths[name], compressed)
+                with open(compressed, "rb") as f:
+                    self.datastore.save_bytes([(key, f)], overwrite=True)
+
+            with ThreadPoolExecutor(max_workers=len(names)) as pool:
+                # consume the results in order to surface possible errors.
+                list(pool.map(_compress_and_upload, names))
+
+    def _write_json(self, key: str, content: Dict):
+        with tempfile.TemporaryFile() as f:
+            f.write(json.dumps(content).encode())
+            f.seek(0)
+            self.datastore.save_bytes([(key, f)], overwrite=True)
+
+    def snapshots(self) -> List[str]:
+        """
+        Ids of the stored snapshots, oldest first.
+        """
+        return sorted(
+            os.path.basename(path)[: -len(".json")]
+            for path, is_file in self.datastore.list_content([SNAPSHOTS])
+            if is_file and path.endswith(".json")
+        )
+
+    def gc(self, retention: int) -> List[str]:
+        """
+        Remove the snapshots older than the latest 'retention' ones, along with the objects
+        that are not referenced by the remaining snapshots.
+
+        Returns
+        -------
+        List[str]
+            Ids of the removed snapshots.
+        """
+        # Objects are listed before the snapshots, so objects of snapshots published in the meantime are not removed.
+        objects = [
+            path for path, is_file in self.datastore.list_content([OBJECTS]) if is_file
+        ]
+        snapshots = self.snapshots()
+        keep = set(snapshots[-retention:])
+        # The baselines of the readers are kept regardless of the retention.
+        for key in [POINTER, SUCCESS_POINTER]:
+            pointer = self.pointer(key) or {}
+            if pointer.get("snapshot"):
+                keep.add(pointer["snapshot"])
+        expired = [snapshot for snapshot in snapshots if snapshot not in keep]
+        if not expired:
+            return []
+
+        referenced = self._referenced(keep)
+        # Snapshots recorded while collecting are kept as well, so their objects are not removed
+        # right before they are published. See push() for the remaining window.
+        referenced |= self._referenced(set(self.snapshots()) - set(snapshots))
+        unreferenced = [
+            path
+            for path in objects
+            if os.path.basename(path)[: -len(COMPRESSED_SUFFIX)] not in referenced
+        ]
+        if not _delete(
+            self.datastore,
+            [f"{SNAPSHOTS}/{snapshot}.json" for snapshot in expired] + unreferenced,
+        ):
+            return []
+        return expired
+
+    def _referenced(self, snapshots) -> set:
+        # Content hashes of the files of the given snapshots.
+        referenced = set()
+        if not snapshots:
+            return referenced
+        with self.datastore.load_bytes(
+            [f"{SNAPSHOTS}/{snapshot}.json" for snapshot in snapshots]
+        ) as result:
+            for _, file, _ in result:
+                if file is not None:
+                    with open(file) as f:
+                        referenced.update(json.load(f).get("files", {}).values())
+        return referenced
+
+
+def _snapshot_id() -> str:
+    # Sortable by creation time, and unique among concurrent writers.
+    return f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+
+
+def _delete(datastore, keys: List[str]) -> bool:
+    # The datastore interface of Metaflow does not support removing objects, so handle the supported storages directly.
+    if not keys:
+        return True
+    if datastore.TYPE == "local":
+        for key in keys:
+            try:
+                os.remove(datastore.full_uri(key))
+            except FileNotFoundError:
+                pass
+        return True
+    if datastore.TYPE == "s3":
+        from metaflow.plugins.datatools.s3.s3util import get_s3_client
+
+        s3, _ = get_s3_client()
+        by_bucket = {}
+        for key in keys:
+            url = urlparse(datastore.full_uri(key))
+            by_bucket.setdefault(url.netloc, []).append(url.path.lstrip("/"))
+        for bucket, paths in by_bucket.items():
+            # At most 1000 keys per request.
+            for i in range(0, len(paths), 1000):
+                s3.delete_objects(
+                    Bucket=bucket,
+                    Delete={"Objects": [{"Key": path} for path in paths[i : i + 1000]]},
+                )
+        return True
+    debug.dbtdebug_exec(
+        f"Removing old DBT state snapshots is not supported for the {datastore.TYPE} datastore."
+    )
+    return False
+
+
+def _compress(src: str, dst: str):
+    with open(src, "rb") as f_in, gzip.open(
+        dst, "wb", compresslevel=COMPRESS_LEVEL
+    ) as f_out:
+        shutil.copyfileobj(f_in, f_out)
+
+
+def _decompress(src: str, dst: str):
+    with gzip.open(src, "rb") as f_in, open(dst, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
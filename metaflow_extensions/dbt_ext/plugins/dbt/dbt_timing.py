@@ -0,0 +1,113 @@
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List
+
+from metaflow.debug import debug
+
+
+def _maxrss_mb(usage) -> float:
+    # ru_maxrss is reported in kilobytes on Linux, but in bytes on macOS
+    if sys.platform == "darwin":
+        return usage.ru_maxrss / 1024**2
+    return usage.ru_maxrss / 1024
+
+
+def _tracing() -> bool:
+    # Resetting the peak requires Python 3.9+
+    return tracemalloc.is_tracing() and hasattr(tracemalloc, "reset_peak")
+
+
+class PhaseTimer:
+    """
+    Records wall time, CPU time of the task process and its child processes (f.ex. the dbt CLI)
+    and peak RSS for the phases of a DBT step.
+
+    When Python allocations are traced (f.ex. with PYTHONTRACEMALLOC=1), the peak traced memory
+    of every phase is recorded as well. Tracing slows down the task considerably, so it is off by default.
+
+    Setting METAFLOW_DEBUG_DBTDEBUG=1 prints every phase as it starts and finishes.
+    """
+
+    def __init__(self):
+        self.phases: List[Dict] = []
+        # Phases can be nested, f.ex. the dbt invocation inside a command.
+        self._depth = 0
+        # Peak traced memory of every open phase, up to the last time the peak was reset.
+        self._traced_peaks: List[int] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        debug.dbtdebug_exec(f"phase '{name}' started")
+        start = time.perf_counter()
+        own_start = resource.getrusage(resource.RUSAGE_SELF)
+        children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+        depth = self._depth
+        self._depth += 1
+        traced = _tracing()
+        if traced:
+            self._start_trace()
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            own = resource.getrusage(resource.RUSAGE_SELF)
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            record = {
+                "phase": name,
+                "depth": depth,
+                "wall_s": round(time.perf_counter() - start, 4),
+                "cpu_s": round(
+                    own.ru_utime
+                    + own.ru_stime
+                    - own_start.ru_utime
+                    - own_start.ru_stime,
+                    4,
+                ),
+                "child_cpu_s": round(
+                    children.ru_utime
+                    + children.ru_stime
+                    - children_start.ru_utime
+                    - children_start.ru_stime,
+                    4,
+                ),
+                # Peak RSS over the lifetime of the processes, as the OS does not track it per phase.
+                "peak_rss_mb": round(_maxrss_mb(own), 1),
+                "child_peak_rss_mb": round(_maxrss_mb(children), 1),
+            }
+            if traced:
+                record["py_peak_mb"] = round(self._finish_trace() / 1024**2, 1)
+            self.phases.append(record)
+            debug.dbtdebug_exec(
+                f"phase '{name}' finished: "
+                + ", ".join(
+                    f"{k}={v}" for k, v in record.items() if k not in ["phase", "depth"]
+                )
+            )
+
+    # tracemalloc only keeps a single peak, so it is reset whenever a phase starts or finishes,
+    # and the peak up to then is carried over to the enclosing phases.
+    def _start_trace(self):
+        _, peak = tracemalloc.get_traced_memory()
+        if self._traced_peaks:
+            self._traced_peaks[-1] = max(self._traced_peaks[-1], peak)
+        tracemalloc.reset_peak()
+        self._traced_peaks.append(0)
+
+    def _finish_trace(self) -> int:
+        _, peak = tracemalloc.get_traced_memory()
+        peak = max(self._traced_peaks.pop(), peak)
+        if self._traced_peaks:
+            self._traced_peaks[-1] = max(self._traced_peaks[-1], peak)
+        tracemalloc.reset_peak()
+        return peak
+
+    def to_dict(self) -> Dict:
+        return {
+            "phases": list(self.phases),
+            "total_wall_s": round(
+                sum(p["wall_s"] for p in self.phases if p["depth"] == 0), 4
+            ),
+        }
@@ -3,11 +3,24 @@ __mf_extensions__ = "dbt-ext"
 # Make the switch decorator available at the top level.
 from ..plugins.dbt import dbt_deco as dbt
 
-import pkg_resources
+# Planning and merging of parallel DBT executions.
+from ..plugins.dbt.dbt_sharding import (
+    plan_shards as plan_dbt_shards,
+    merge_run_results as merge_dbt_run_results,
+)
+
+# Execution time history of DBT steps across runs.
+from ..plugins.dbt.dbt_history import (
+    load_timing_history as load_dbt_timing_history,
+    detect_regressions as detect_dbt_regressions,
+)
+
+# importlib.metadata is already loaded by metaflow for discovering extensions, unlike the slow pkg_resources.
+from importlib import metadata as _metadata
 
 try:
-    __version__ = pkg_resources.get_distribution("metaflow-dbt-extension").version
-except:
+    __version__ = _metadata.version("metaflow-dbt-extension")
+except _metadata.PackageNotFoundError:
     # this happens on remote environments since the job package
     # does not have a version
     __version__ = None
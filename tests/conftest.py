@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+
+os.environ.setdefault("METAFLOW_USER", "tests")
+
+# The extension modules are loaded through metaflow, which registers the decorator.
+import metaflow  # noqa: E402, F401
+
+
+def _node(unique_id, path, parents=(), **attributes):
+    resource_type, package, name = unique_id.split(".")[:3]
+    node = {
+        "unique_id": unique_id,
+        "name": name,
+        "resource_type": resource_type,
+        "package_name": package,
+        "original_file_path": path,
+        "fqn": [package] + os.path.dirname(path).split("/")[1:] + [name],
+        "depends_on": {"nodes": list(parents)},
+    }
+    node.update(attributes)
+    return node
+
+
+@pytest.fixture
+def manifest():
+    """
+    Synthetic manifest of a small project:
+
+        source.shop.raw.orders -> stg_orders -> orders -> not_null_orders_id
+        payments (independent of the others)
+        seed countries
+    """
+    nodes = [
+        _node(
+            "model.shop.stg_orders",
+            "models/staging/stg_orders.sql",
+            ["source.shop.raw.orders"],
+        ),
+        _node(
+            "model.shop.orders", "models/marts/orders.sql", ["model.shop.stg_orders"]
+        ),
+        _node("model.shop.payments", "models/marts/payments.sql"),
+        _node(
+            "test.shop.not_null_orders_id",
+            "models/marts/schema.yml",
+            ["model.shop.orders"],
+        ),
+        _node("seed.shop.countries", "seeds/countries.csv"),
+    ]
+    return {
+        "nodes": {node["unique_id"]: node for node in nodes},
+        "sources": {
+            "source.shop.raw.orders": {
+                "unique_id": "source.shop.raw.orders",
+                "name": "orders",
+                "resource_type": "source",
+                "package_name": "shop",
+                "original_file_path": "models/sources.yml",
+                "fqn": ["shop", "raw", "orders"],
+            }
+        },
+    }
+
+
+@pytest.fixture
+def dbt_bin(tmp_path, monkeypatch):
+    """
+    A stand-in dbt binary on the PATH, that only reports its version.
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    path = bin_dir / "dbt"
+    path.write_text(
+        "#!/bin/sh\n"
+        "echo 'Core:'\n"
+        "echo '  - installed: 1.7.4'\n"
+        "echo '  - latest:    1.8.0 - Update available!'\n"
+    )
+    path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return str(path)
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch, manifest):
+    """
+    A project in the working directory, with the synthetic manifest as the manifest of a previous local execution.
+    """
+    project_dir = tmp_path / "project"
+    (project_dir / "target").mkdir(parents=True)
+    (project_dir / "dbt_project.yml").write_text(
+        "name: shop\nprofile: shop\nmodel-paths: ['.']\n"
+    )
+    (project_dir / "target" / "manifest.json").write_text(json.dumps(manifest))
+    monkeypatch.chdir(project_dir)
+    return project_dir
@@ -0,0 +1,90 @@
+import json
+import pickle
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_artifacts import (
+    CHUNK_SIZE,
+    DBTArtifact,
+    ManifestArtifact,
+)
+
+
+def _large_manifest(n_models):
+    return {
+        "metadata": {"dbt_version": "1.7.4"},
+        "nodes": {
+            f"model.shop.m{i}": {
+                "unique_id": f"model.shop.m{i}",
+                "name": f"m{i}",
+                "resource_type": "model",
+                "package_name": "shop",
+                "original_file_path": f"models/m{i}.sql",
+            }
+            for i in range(n_models)
+        },
+    }
+
+
+def test_nodes_decompress_every_chunk_once(monkeypatch):
+    data = _large_manifest(3 * CHUNK_SIZE)
+    artifact = ManifestArtifact.from_dict(data)
+    decompressed = []
+    chunk = artifact._chunk
+
+    def _chunk(i):
+        decompressed.append(i)
+        return chunk(i)
+
+    monkeypatch.setattr(artifact, "_chunk", _chunk)
+    assert artifact.nodes(list(data["nodes"]) + ["model.shop.missing"]) == data["nodes"]
+    assert sorted(decompressed) == [0, 1, 2]
+    assert artifact.node("model.shop.m1") == data["nodes"]["model.shop.m1"]
+    assert artifact.node("model.shop.missing") is None
+
+
+def test_graph_is_built_without_materializing(manifest):
+    artifact = ManifestArtifact.from_dict(manifest)
+    assert artifact.graph.select("+orders") == {
+        "source.shop.raw.orders",
+        "model.shop.stg_orders",
+        "model.shop.orders",
+    }
+    assert artifact._data is None
+
+
+def test_manifest_round_trip(manifest):
+    manifest = dict(manifest, metadata={"dbt_version": "1.7.4"}, macros={})
+    artifact = ManifestArtifact.from_bytes(json.dumps(manifest).encode())
+    assert (
+        artifact.node("source.shop.raw.orders")
+        == manifest["sources"]["source.shop.raw.orders"]
+    )
+    assert artifact.index.by_path("models/marts") == [
+        "model.shop.orders",
+        "model.shop.payments",
+        "test.shop.not_null_orders_id",
+    ]
+    assert artifact.to_dict() == manifest
+    assert list(artifact) == list(manifest)
+    assert json.loads(artifact.raw()) == manifest
+
+
+def test_pickle_keeps_only_compressed_content(manifest):
+    artifact = ManifestArtifact.from_dict(manifest)
+    artifact.to_dict()
+    restored = pickle.loads(pickle.dumps(artifact))
+    assert restored._data is None
+    assert restored.graph is None
+    assert restored.index.by_name("orders") == [
+        "model.shop.orders",
+        "source.shop.raw.orders",
+    ]
+    assert restored.node("model.shop.orders") == manifest["nodes"]["model.shop.orders"]
+    assert restored == manifest
+
+    run_results = DBTArtifact.from_dict(
+        {"results": [{"unique_id": "model.shop.orders"}]}
+    )
+    assert run_results["results"][0]["unique_id"] == "model.shop.orders"
+    restored = pickle.loads(pickle.dumps(run_results))
+    assert restored._data is None
+    assert restored == run_results.data
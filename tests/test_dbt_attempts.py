@@ -0,0 +1,111 @@
+import json
+
+from metaflow.plugins.datastores.local_storage import LocalStorage
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_attempts import (
+    RETRY_SELECTORS,
+    DBTAttemptStore,
+    retry_selection,
+)
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_decorator import _skips_invocation
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_executor import DBTExecutor
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_selection import SelectionResolver
+
+FILES = {
+    "models/staging/stg_orders.sql": "1",
+    "models/marts/orders.sql": "1",
+    "models/marts/payments.sql": "1",
+    "seeds/countries.csv": "1",
+}
+
+
+def _resolver(manifest, current_files=None, run_results=None, **sources):
+    return SelectionResolver(
+        manifest,
+        run_results,
+        FILES,
+        dict(FILES, **(current_files or {})),
+        **sources,
+    )
+
+
+def _results(**statuses):
+    return {
+        "results": [
+            {"unique_id": unique_id, "status": status}
+            for unique_id, status in statuses.items()
+        ]
+    }
+
+
+def test_retry_selection_drops_state_selectors():
+    assert retry_selection("state:modified+") == " ".join(RETRY_SELECTORS)
+    assert retry_selection(None) == " ".join(RETRY_SELECTORS)
+    narrowed = retry_selection("state:modified+,tag:nightly")
+    assert "state:" not in narrowed
+    assert "tag:nightly" in narrowed
+
+
+def test_retry_selection_resolves_to_unfinished_nodes(manifest):
+    # The retry compares against the run results of the failed attempt only,
+    # even though the project did not change since the state that it compared against.
+    resolver = _resolver(
+        manifest,
+        run_results=_results(
+            **{"model.shop.stg_orders": "error", "model.shop.orders": "skipped"}
+        ),
+    )
+    assert resolver.resolve(retry_selection("state:modified+"), ["model"]) == {
+        "model.shop.stg_orders",
+        "model.shop.orders",
+    }
+
+
+def test_retry_without_previous_state_executes_unfinished_nodes(project, dbt_bin):
+    executor = DBTExecutor(models=["state:modified+"], profiles=None)
+    executor.retry(
+        {
+            "results": [
+                {"unique_id": "model.shop.stg_orders", "status": "error"},
+                {"unique_id": "model.shop.orders", "status": "skipped"},
+                {"unique_id": "model.shop.payments", "status": "success"},
+            ]
+        }
+    )
+    with executor.session():
+        selected = executor.resolve_selection("run")
+    assert selected == {"model.shop.stg_orders", "model.shop.orders"}
+
+
+def test_attempts_keep_the_manifest_of_the_latest_attempt(tmp_path, manifest):
+    attempts = DBTAttemptStore(LocalStorage(str(tmp_path / "attempts")))
+    assert attempts.latest(before=1) is None
+    assert attempts.manifest(before=1) is None
+    attempts.save(0, _results(**{"model.shop.orders": "error"}), json.dumps(manifest))
+    attempts.save(1, _results(**{"model.shop.orders": "skipped"}))
+    assert attempts.latest(before=1) == _results(**{"model.shop.orders": "error"})
+    assert json.loads(attempts.manifest(before=1)) == manifest
+    # The manifest of the latest attempt was not recorded.
+    assert attempts.latest(before=3) == _results(**{"model.shop.orders": "skipped"})
+    assert attempts.manifest(before=3) is None
+
+
+def test_retry_elsewhere_uses_manifest_of_failed_attempt(project, dbt_bin, manifest):
+    # The retry does not run where the failed attempt did, so the project holds no manifest.
+    (project / "target" / "manifest.json").unlink()
+    executor = DBTExecutor(models=["state:modified+"], profiles=None)
+    executor.retry(
+        _results(**{"model.shop.stg_orders": "error", "model.shop.orders": "skipped"}),
+        json.dumps(manifest),
+    )
+    with executor.session():
+        selected = executor.resolve_selection("run")
+    assert selected == {"model.shop.stg_orders", "model.shop.orders"}
+
+
+def test_skip_empty_never_skips_retries():
+    assert _skips_invocation(set(), skip_empty=True, retry_count=0)
+    assert not _skips_invocation(set(), skip_empty=True, retry_count=1)
+    assert not _skips_invocation(set(), skip_empty=False, retry_count=0)
+    assert not _skips_invocation(None, skip_empty=True, retry_count=0)
+    assert not _skips_invocation({"model.shop.orders"}, True, 0)
@@ -0,0 +1,64 @@
+import fcntl
+import os
+import threading
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_cache import EVICT_LOCK, DBTStateCache
+
+
+def _put(cache, tmp_path, sha, mtime):
+    src = tmp_path / f"{sha}.src"
+    src.write_bytes(b"x" * 10)
+    path = cache.put(sha, str(src))
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DBTStateCache(str(tmp_path / "cache"), max_size=25)
+    _put(cache, tmp_path, "aa01", 1000)
+    _put(cache, tmp_path, "bb02", 2000)
+    # Reading an entry makes it the most recently used one.
+    assert cache.get("aa01") is not None
+    _put(cache, tmp_path, "cc03", 3000)
+    cache.evict()
+    assert cache.get("bb02") is None
+    assert cache.get("aa01") is not None
+    assert cache.get("cc03") is not None
+
+
+def test_evict_removes_locks_of_evicted_entries(tmp_path):
+    cache = DBTStateCache(str(tmp_path / "cache"), max_size=0)
+    with cache.locked(["aa01"]):
+        # Held locks survive, f.ex. while another task downloads the entry.
+        cache.evict()
+        assert os.path.exists(cache._entry_path("aa01") + ".lock")
+    cache.evict()
+    assert not os.path.exists(cache._entry_path("aa01") + ".lock")
+
+
+def test_evict_is_skipped_during_another_eviction(tmp_path):
+    cache = DBTStateCache(str(tmp_path / "cache"), max_size=100)
+    path = _put(cache, tmp_path, "aa01", 1000)
+    cache.max_size = 0
+    with open(os.path.join(cache.cache_dir, EVICT_LOCK), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        cache.evict()
+        assert os.path.exists(path)
+    cache.evict()
+    assert not os.path.exists(path)
+
+
+def test_locked_excludes_other_tasks(tmp_path):
+    cache = DBTStateCache(str(tmp_path / "cache"), max_size=100)
+    acquired = threading.Event()
+
+    def _other_task():
+        with cache.locked(["bb02", "aa01"]):
+            acquired.set()
+
+    with cache.locked(["aa01"]):
+        other = threading.Thread(target=_other_task)
+        other.start()
+        assert not acquired.wait(0.2)
+    other.join(5)
+    assert acquired.is_set()
@@ -0,0 +1,62 @@
+import copy
+
+from metaflow.plugins.datastores.local_storage import LocalStorage
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_catalog import (
+    CatalogRefresh,
+    DBTCatalogCache,
+    manifest_relations,
+)
+
+
+def _warehouse(manifest):
+    # Columns of the relation of every node, as the warehouse reports them.
+    return {unique_id: {"id": "integer"} for unique_id in manifest_relations(manifest)}
+
+
+def _generate(manifest, warehouse, unique_ids=None):
+    # What docs generation writes: the catalog entries of the looked up relations.
+    catalog = {"metadata": {}, "nodes": {}, "sources": {}, "errors": None}
+    for unique_id, (database, schema, name) in manifest_relations(manifest).items():
+        if unique_ids is not None and unique_id not in unique_ids:
+            continue
+        section = "sources" if unique_id.startswith("source.") else "nodes"
+        catalog[section][unique_id] = {
+            "metadata": {"database": database, "schema": schema, "name": name},
+            "columns": {
+                column: {"type": type_, "name": column}
+                for column, type_ in warehouse[unique_id].items()
+            },
+        }
+    return catalog
+
+
+def _execute(cache, manifest, warehouse, built):
+    refresh = CatalogRefresh(
+        cache,
+        manifest,
+        {"results": [{"unique_id": unique_id} for unique_id in built]},
+        max_age=0,
+    )
+    return refresh, refresh.merge(_generate(manifest, warehouse, refresh.refreshed))
+
+
+def test_merged_catalog_equals_full_generation(tmp_path, manifest):
+    cache = DBTCatalogCache(LocalStorage(str(tmp_path / "catalog")))
+    warehouse = _warehouse(manifest)
+    refresh, catalog = _execute(cache, manifest, warehouse, [])
+    assert refresh.refreshed is None
+    assert catalog == _generate(manifest, warehouse)
+
+    # The next execution rebuilds orders with a new column, and payments is removed from the project.
+    manifest = copy.deepcopy(manifest)
+    del manifest["nodes"]["model.shop.payments"]
+    warehouse["model.shop.orders"]["amount"] = "numeric"
+    refresh, catalog = _execute(cache, manifest, warehouse, ["model.shop.orders"])
+    assert refresh.refreshed == ["model.shop.orders"]
+    assert catalog == _generate(manifest, warehouse)
+
+    # Nothing was built, so nothing is looked up.
+    refresh, catalog = _execute(cache, manifest, warehouse, [])
+    assert refresh.refreshed == []
+    assert catalog == _generate(manifest, warehouse)
@@ -0,0 +1,71 @@
+import io
+import tarfile
+
+import pytest
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_deps import _extract
+
+
+def _archive(tmp_path, *members):
+    path = tmp_path / "packages.tar.gz"
+    with tarfile.open(path, "w:gz") as tar:
+        for name, linkname in members:
+            info = tarfile.TarInfo(name)
+            if linkname is None:
+                content = b"select 1"
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+            else:
+                info.type = tarfile.SYMTYPE
+                info.linkname = linkname
+                tar.addfile(info)
+    return path
+
+
+@pytest.fixture(params=["data_filter", "fallback"])
+def extract(request, monkeypatch):
+    if request.param == "fallback":
+        # Python versions without extraction filters.
+        monkeypatch.delattr(tarfile, "data_filter", raising=False)
+
+    def _extract_to(archive, path):
+        with tarfile.open(archive) as tar:
+            _extract(tar, str(path))
+
+    return _extract_to
+
+
+def test_extract_packages(tmp_path, extract):
+    archive = _archive(
+        tmp_path,
+        ("dbt_utils/macros/utils.sql", None),
+        ("dbt_utils/macros/alias.sql", "utils.sql"),
+    )
+    extract(archive, tmp_path / "packages")
+    assert (
+        tmp_path / "packages" / "dbt_utils" / "macros" / "alias.sql"
+    ).read_text() == "select 1"
+
+
+@pytest.mark.parametrize(
+    "member",
+    [
+        ("../outside.sql", None),
+        ("dbt_utils/escape", "../../outside"),
+        ("dbt_utils/escape", "/etc/passwd"),
+    ],
+)
+def test_extract_refuses_paths_outside(tmp_path, extract, member):
+    with pytest.raises(tarfile.TarError):
+        extract(_archive(tmp_path, member), tmp_path / "packages")
+    assert not (tmp_path / "outside.sql").exists()
+
+
+def test_extract_keeps_absolute_paths_inside(tmp_path, extract):
+    archive = _archive(tmp_path, (str(tmp_path / "outside.sql"), None))
+    try:
+        extract(archive, tmp_path / "packages")
+    except tarfile.TarError:
+        # Refused without extraction filters, and extracted under the path with them.
+        pass
+    assert not (tmp_path / "outside.sql").exists()
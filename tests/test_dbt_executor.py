@@ -0,0 +1,79 @@
+import importlib.metadata
+
+from metaflow.plugins.datastores.local_storage import LocalStorage
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_executor import (
+    PARTIAL_PARSE_FILE,
+    DBTExecutor,
+    DBTProjectConfig,
+    dbt_version,
+)
+
+
+def test_discover_files_of_project_in_working_directory(project):
+    (project / "dbt_packages" / "utils").mkdir(parents=True)
+    (project / "dbt_packages" / "utils" / "macro.sql").write_text("")
+    (project / "models").mkdir()
+    (project / "models" / "orders.sql").write_text("select 1")
+
+    for project_dir in [".", None]:
+        files = DBTProjectConfig(project_dir).project_file_paths()
+        # Build outputs and installed packages are left out, and root files are included once.
+        assert sorted(files) == ["dbt_project.yml", "models/orders.sql"]
+
+
+def test_dbt_version_reads_installed_version_of_cli(dbt_bin, monkeypatch):
+    def _not_installed(name):
+        raise importlib.metadata.PackageNotFoundError(name)
+
+    monkeypatch.setattr(importlib.metadata, "version", _not_installed)
+    assert dbt_version(dbt_bin) == "1.7.4"
+
+
+def test_unchanged_partial_parse_is_not_pushed(project, dbt_bin, tmp_path, monkeypatch):
+    parse_datastore = LocalStorage(str(tmp_path / "partial_parse"))
+    (tmp_path / "pushed.msgpack").write_bytes(b"parsed")
+    with open(tmp_path / "pushed.msgpack", "rb") as f:
+        parse_datastore.save_bytes([(PARTIAL_PARSE_FILE, f)])
+    saved = []
+    save_bytes = parse_datastore.save_bytes
+
+    def _save_bytes(path_and_bytes_iter, **kwargs):
+        saved.append(True)
+        return save_bytes(path_and_bytes_iter, **kwargs)
+
+    monkeypatch.setattr(parse_datastore, "save_bytes", _save_bytes)
+    executor = DBTExecutor(models=None, profiles=None)
+    executor.parse_datastore = parse_datastore
+
+    executor._pull_partial_parse()
+    executor._push_partial_parse()
+    assert not saved
+
+    # dbt parsed the project again after changes.
+    (project / "target" / PARTIAL_PARSE_FILE).write_bytes(b"parsed again")
+    executor._push_partial_parse()
+    executor._push_partial_parse()
+    assert len(saved) == 1
+
+
+def test_max_threads_of_default_target(project, dbt_bin):
+    profiles = {
+        "shop": {
+            "target": "prod",
+            "outputs": {"dev": {"type": "duckdb"}, "prod": {"type": "duckdb"}},
+        }
+    }
+    max_threads = {"dev": 64, "prod": 1}
+    executor = DBTExecutor(
+        models=None, profiles=profiles, threads="auto", max_threads=max_threads
+    )
+    assert executor.resolve_threads("run") == 1
+    executor = DBTExecutor(
+        models=None,
+        profiles=profiles,
+        target="dev",
+        threads="auto",
+        max_threads=max_threads,
+    )
+    assert executor.resolve_threads("run") > 1
@@ -0,0 +1,47 @@
+import pytest
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_graph import (
+    ManifestIndex,
+    UnsupportedSelector,
+)
+
+
+@pytest.fixture
+def index(manifest):
+    manifest["exposures"] = {
+        "exposure.shop.dashboard": {
+            "unique_id": "exposure.shop.dashboard",
+            "name": "dashboard",
+            "resource_type": "exposure",
+            "package_name": "shop",
+            "original_file_path": "models/exposures.yml",
+            "fqn": ["shop", "dashboard"],
+            "depends_on": {"nodes": ["model.shop.orders"]},
+        }
+    }
+    return ManifestIndex.from_manifest(manifest)
+
+
+@pytest.mark.parametrize(
+    "selector",
+    ["source:raw", "source:raw.orders", "source:shop.raw.orders", "source:shop.*.*"],
+)
+def test_source_selector(index, selector):
+    assert index.select(selector) == {"source.shop.raw.orders"}
+
+
+@pytest.mark.parametrize("selector", ["exposure:dashboard", "exposure:shop.dashboard"])
+def test_exposure_selector(index, selector):
+    assert index.select(selector) == {"exposure.shop.dashboard"}
+
+
+def test_source_selector_of_other_package(index):
+    assert index.select("source:other.raw.orders") == set()
+
+
+@pytest.mark.parametrize(
+    "selector", ["source:shop.raw.orders.id", "exposure:shop.dashboard.extra"]
+)
+def test_selector_with_too_many_parts(index, selector):
+    with pytest.raises(UnsupportedSelector):
+        index.select(selector)
@@ -0,0 +1,57 @@
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_history import (
+    detect_regressions,
+    timing_table,
+)
+
+ORDERS = "model.shop.orders"
+PAYMENTS = "model.shop.payments"
+
+
+def _table(durations, status="success"):
+    return timing_table(
+        {
+            "results": [
+                {"unique_id": unique_id, "status": status, "execution_time": seconds}
+                for unique_id, seconds in durations.items()
+            ]
+        }
+    )
+
+
+def _history(n=6):
+    # Newest run first, with some noise.
+    return [
+        _table({ORDERS: 10.0 + (i % 3) * 0.2, PAYMENTS: 0.2 + (i % 2) * 0.05})
+        for i in range(n)
+    ]
+
+
+def test_slow_node_is_flagged():
+    (regression,) = detect_regressions(
+        _history(), _table({ORDERS: 25.0, PAYMENTS: 0.2})
+    )
+    assert regression["unique_id"] == ORDERS
+    assert regression["median"] == 10.2
+    assert regression["samples"] == 6
+
+
+def test_newest_run_of_the_history_is_checked():
+    history = [_table({ORDERS: 25.0, PAYMENTS: 0.2})] + _history()
+    assert [r["unique_id"] for r in detect_regressions(history)] == [ORDERS]
+    assert detect_regressions([]) == []
+
+
+def test_noise_is_not_flagged():
+    # Within the usual spread, and a large relative increase of a fast node.
+    assert detect_regressions(_history(), _table({ORDERS: 10.6, PAYMENTS: 0.9})) == []
+
+
+def test_short_history_is_not_checked():
+    assert detect_regressions(_history(4), _table({ORDERS: 25.0})) == []
+
+
+def test_failed_runs_are_not_part_of_the_baseline():
+    # Failed runs of the node end early, and would make the baseline look faster than it is.
+    history = _history() + [_table({ORDERS: 0.1}, status="error")] * 10
+    (regression,) = detect_regressions(history, _table({ORDERS: 25.0}))
+    assert regression["samples"] == 6
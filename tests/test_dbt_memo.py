@@ -0,0 +1,59 @@
+import pytest
+from metaflow.plugins.datastores.local_storage import LocalStorage
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_memo import (
+    DBTStepMemo,
+    step_fingerprint,
+)
+
+FILES = {"models/marts/orders.sql": "1", "dbt_project.yml": "1"}
+BASE = dict(project_files=FILES, command="run", models="orders+", dbt_version="1.7.4")
+
+
+def test_fingerprint_is_stable():
+    assert step_fingerprint(**BASE) == step_fingerprint(
+        **dict(BASE, project_files=dict(reversed(list(FILES.items()))))
+    )
+    # Options that are not set leave the fingerprint as it was before they existed.
+    assert step_fingerprint(**BASE) == step_fingerprint(
+        **BASE, generate_docs=False, docs_card="lineage", defer_snapshot="abc"
+    )
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        {"project_files": dict(FILES, **{"models/marts/orders.sql": "2"})},
+        {"project_files": dict(FILES, **{"models/marts/payments.sql": "1"})},
+        {"command": "build"},
+        {"models": "orders"},
+        {"dbt_version": "1.8.0"},
+        {"watermark": "2024-01-01"},
+        {"generate_docs": True},
+        {"defer_to": "prod"},
+    ],
+)
+def test_fingerprint_changes(change):
+    assert step_fingerprint(**BASE) != step_fingerprint(**dict(BASE, **change))
+
+
+def test_fingerprint_covers_docs_and_deferred_snapshot():
+    docs = dict(BASE, generate_docs=True)
+    assert step_fingerprint(**docs) != step_fingerprint(**docs, docs_card="lineage")
+    deferred = dict(BASE, defer_to="prod")
+    assert step_fingerprint(**deferred, defer_snapshot="a") != step_fingerprint(
+        **deferred, defer_snapshot="b"
+    )
+
+
+def test_memo_records(tmp_path):
+    memo = DBTStepMemo(LocalStorage(str(tmp_path / "memo")))
+    fingerprint = step_fingerprint(**BASE)
+    assert memo.lookup(fingerprint) is None
+    memo.record(fingerprint, "1", "2", 0, ["run_results"])
+    assert memo.lookup(fingerprint) == {
+        "run_id": "1",
+        "task_id": "2",
+        "attempt": 0,
+        "artifacts": ["run_results"],
+    }
@@ -0,0 +1,135 @@
+import pytest
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_selection import (
+    SelectionResolver,
+    UnresolvableSelection,
+)
+
+FILES = {
+    "models/staging/stg_orders.sql": "1",
+    "models/marts/orders.sql": "1",
+    "models/marts/payments.sql": "1",
+    "seeds/countries.csv": "1",
+}
+
+
+def _resolver(manifest, current_files=None, run_results=None, **sources):
+    return SelectionResolver(
+        manifest,
+        run_results,
+        FILES,
+        dict(FILES, **(current_files or {})),
+        **sources,
+    )
+
+
+def _results(**statuses):
+    return {
+        "results": [
+            {"unique_id": unique_id, "status": status}
+            for unique_id, status in statuses.items()
+        ]
+    }
+
+
+def _freshness(**loaded_at):
+    return {
+        "results": [
+            {"unique_id": unique_id, "max_loaded_at": value}
+            for unique_id, value in loaded_at.items()
+        ]
+    }
+
+
+def test_state_modified_selects_nodes_of_changed_files(manifest):
+    resolver = _resolver(manifest, {"models/staging/stg_orders.sql": "2"})
+    assert resolver.resolve("state:modified") == {"model.shop.stg_orders"}
+    assert resolver.resolve("state:modified+", ["model"]) == {
+        "model.shop.stg_orders",
+        "model.shop.orders",
+    }
+    assert resolver.resolve("state:modified+", ["model", "test"]) == {
+        "model.shop.stg_orders",
+        "model.shop.orders",
+        "test.shop.not_null_orders_id",
+    }
+
+
+def test_state_modified_is_empty_without_changes(manifest):
+    assert _resolver(manifest).resolve("state:modified+") == set()
+
+
+def test_state_modified_is_unresolvable_for_files_without_nodes(manifest):
+    resolver = _resolver(manifest, {"macros/cents.sql": "1"})
+    with pytest.raises(UnresolvableSelection):
+        resolver.resolve("state:modified+")
+
+
+def test_state_modified_is_unresolvable_for_yml_files(manifest):
+    # The schema file defines a test, but also configures and documents the models.
+    resolver = _resolver(manifest, {"models/marts/schema.yml": "2"})
+    with pytest.raises(UnresolvableSelection):
+        resolver.resolve("state:modified", ["model"])
+
+
+def test_state_is_unresolvable_without_previous_files(manifest):
+    resolver = SelectionResolver(manifest, None, None, FILES)
+    with pytest.raises(UnresolvableSelection):
+        resolver.resolve("state:modified")
+
+
+def test_result_selects_nodes_by_status(manifest):
+    resolver = _resolver(
+        manifest,
+        run_results=_results(
+            **{
+                "model.shop.stg_orders": "error",
+                "model.shop.orders": "skipped",
+                "model.shop.payments": "success",
+            }
+        ),
+    )
+    assert resolver.resolve("result:error") == {"model.shop.stg_orders"}
+    assert resolver.resolve("result:error+ result:skipped+", ["model"]) == {
+        "model.shop.stg_orders",
+        "model.shop.orders",
+    }
+    assert resolver.resolve("result:fail") == set()
+
+
+def test_result_is_unresolvable_without_run_results(manifest):
+    with pytest.raises(UnresolvableSelection):
+        _resolver(manifest).resolve("result:error")
+
+
+def test_source_status_selects_sources_with_new_data(manifest):
+    resolver = _resolver(
+        manifest,
+        sources=_freshness(**{"source.shop.raw.orders": "2024-01-02T00:00:00Z"}),
+        previous_sources=_freshness(
+            **{"source.shop.raw.orders": "2024-01-01T00:00:00Z"}
+        ),
+    )
+    assert resolver.resolve("source_status:fresher+", ["model"]) == {
+        "model.shop.stg_orders",
+        "model.shop.orders",
+    }
+
+
+def test_source_status_ignores_sources_without_new_data(manifest):
+    freshness = _freshness(**{"source.shop.raw.orders": "2024-01-01T00:00:00Z"})
+    resolver = _resolver(manifest, sources=freshness, previous_sources=freshness)
+    assert resolver.resolve("source_status:fresher+") == set()
+
+
+def test_intersection_with_state_selector(manifest):
+    resolver = _resolver(
+        manifest,
+        {
+            "models/staging/stg_orders.sql": "2",
+            "models/marts/payments.sql": "2",
+        },
+    )
+    assert resolver.resolve("state:modified+,orders", ["model"]) == {
+        "model.shop.orders"
+    }
@@ -0,0 +1,41 @@
+import pytest
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_graph import ManifestIndex
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_sharding import (
+    InvalidShardCount,
+    plan_shards,
+)
+
+
+def test_shards_are_independent_components(manifest):
+    index = ManifestIndex.from_manifest(manifest)
+    shards = [
+        {
+            unique_id
+            for unique_id in index.select(shard)
+            if unique_id.startswith("model.")
+        }
+        for shard in plan_shards(manifest, n_shards=4)
+    ]
+    assert sorted(shards, key=len) == [
+        {"model.shop.payments"},
+        {"model.shop.stg_orders", "model.shop.orders"},
+    ]
+
+
+def test_shard_selectors_use_directories(manifest):
+    index = ManifestIndex.from_manifest(manifest)
+    (shard,) = plan_shards(manifest, n_shards=1)
+    # The marts directory holds a test as well, which dbt selects along with the models it tests.
+    assert shard == "shop.marts shop.staging"
+    assert index.select(shard) == {
+        "model.shop.stg_orders",
+        "model.shop.orders",
+        "model.shop.payments",
+        "test.shop.not_null_orders_id",
+    }
+
+
+def test_invalid_shard_count(manifest):
+    with pytest.raises(InvalidShardCount):
+        plan_shards(manifest, n_shards=0)
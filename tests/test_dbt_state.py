@@ -0,0 +1,93 @@
+import json
+
+import pytest
+from metaflow.plugins.datastores.local_storage import LocalStorage
+
+from metaflow_extensions.dbt_ext.plugins.dbt.dbt_state import DBTStateStore
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(str(tmp_path / "dbt_state"))
+
+
+@pytest.fixture
+def push(tmp_path):
+    counter = [0]
+
+    def _push(store, manifest, succeeded=True):
+        counter[0] += 1
+        path = tmp_path / f"manifest_{counter[0]}.json"
+        path.write_text(json.dumps(manifest))
+        return store.push({"manifest.json": str(path)}, succeeded=succeeded)
+
+    return _push
+
+
+def _pulled(storage, tmp_path, name="pulled"):
+    path = tmp_path / name
+    path.mkdir()
+    DBTStateStore(storage).pull(str(path), ["manifest.json"])
+    return json.loads((path / "manifest.json").read_text())
+
+
+def test_gc_keeps_retention(storage, push, tmp_path):
+    store = DBTStateStore(storage)
+    for version in range(4):
+        push(store, {"version": version})
+    assert len(store.gc(2)) == 2
+    assert len(store.snapshots()) == 2
+    assert _pulled(storage, tmp_path) == {"version": 3}
+
+
+def test_gc_keeps_latest_successful_snapshot(storage, push, tmp_path):
+    store = DBTStateStore(storage)
+    push(store, {"version": 0})
+    for version in range(1, 4):
+        push(store, {"version": version}, succeeded=False)
+    store.gc(1)
+    assert len(store.snapshots()) == 2
+    # Failed executions never become the baseline.
+    assert _pulled(storage, tmp_path) == {"version": 0}
+
+
+def test_gc_keeps_objects_of_concurrent_push(storage, push, tmp_path, monkeypatch):
+    store = DBTStateStore(storage)
+    for version in range(3):
+        push(store, {"version": version})
+
+    # Another task publishes the content of an expired snapshot again while gc collects the referenced objects.
+    concurrent = DBTStateStore(LocalStorage(storage.datastore_root))
+    referenced = store._referenced
+    pushed = []
+
+    def _referenced(snapshots):
+        if not pushed:
+            pushed.append(push(concurrent, {"version": 0}))
+        return referenced(snapshots)
+
+    monkeypatch.setattr(store, "_referenced", _referenced)
+    assert len(store.gc(1)) == 2
+    # The snapshot of the concurrent push reuses an object of an expired snapshot, which must survive.
+    assert len(store.snapshots()) == 2
+    assert _pulled(storage, tmp_path) == {"version": 0}
+
+
+def test_identical_push_is_skipped(storage, push):
+    store = DBTStateStore(storage)
+    assert push(store, {"version": 0})
+    assert push(store, {"version": 0}) == []
+    assert len(store.snapshots()) == 1
+
+
+def test_pull_state_stored_as_is(storage, push, tmp_path):
+    # Earlier versions stored the state files uncompressed, under their own names.
+    (tmp_path / "stored.json").write_text(json.dumps({"version": 0}))
+    with open(tmp_path / "stored.json", "rb") as f:
+        storage.save_bytes([("manifest.json", f)])
+    assert _pulled(storage, tmp_path) == {"version": 0}
+
+    # The first push starts the snapshot history.
+    store = DBTStateStore(storage)
+    assert push(store, {"version": 1}) == ["manifest.json"]
+    assert _pulled(storage, tmp_path, "pulled_snapshot") == {"version": 1}